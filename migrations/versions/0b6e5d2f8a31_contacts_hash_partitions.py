@@ -0,0 +1,147 @@
+"""Contacts hash partitions
+
+Revision ID: 0b6e5d2f8a31
+Revises: f4b81d3c6a27
+Create Date: 2026-10-19 23:26:51.604719
+
+Rebuilds contacts as a table hash-partitioned on user_id, online:
+
+1. Create contacts_new with its partitions, and a trigger on contacts that mirrors
+   every write into it.
+2. Copy the existing rows in committed batches of BATCH_SIZE ids. Rows the trigger
+   already copied win. A sweep then drops rows that were deleted while their batch
+   was in flight.
+3. Build each secondary index per partition, concurrently, and attach it to the
+   parent index.
+4. Swap the tables in one short transaction.
+
+Postgres only; SQLite has no partitioning and keeps the plain table.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b6e5d2f8a31'
+down_revision: Union[str, None] = 'f4b81d3c6a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = 16
+BATCH_SIZE = 10000
+
+# Every stored column; search_text is generated and recomputed on insert.
+COLUMNS = ("id, first_name, last_name, email, phone_number, phone_e164, birth_date, birth_mmdd, extra_data, "
+           "avatar, avatar_thumbnail, updated_at, version, user_id")
+
+# The secondary indexes of database/models.py: name, unique, method, key.
+INDEXES = [
+    ('ix_contacts_id', False, 'btree', '(id)'),
+    ('ix_contacts_user_name', False, 'btree', '(user_id, last_name, first_name, id)'),
+    ('ix_contacts_user_email', True, 'btree', '(user_id, email)'),
+    ('ix_contacts_user_birthday', False, 'btree', '(user_id, birth_mmdd)'),
+    ('ix_contacts_user_phone', False, 'btree', '(user_id, phone_e164)'),
+    ('ix_contacts_user_version', False, 'btree', '(user_id, version)'),
+    ('ix_contacts_user_search', False, 'gist', '(user_id, search_text gist_trgm_ops)'),
+    ('ix_contacts_extra_data', False, 'gin', '(extra_data jsonb_path_ops)'),
+]
+
+
+def _create_index(name: str, table: str, unique: bool, method: str, key: str, only: bool = False,
+                  concurrently: bool = False) -> None:
+    op.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}{name} "
+               f"ON {'ONLY ' if only else ''}{table} USING {method} {key}")
+
+
+def _rebuild(partitions: int | None) -> None:
+    """Replaces contacts with a copy that is hash-partitioned into ``partitions``, or plain when None."""
+    bind = op.get_bind()
+    primary_key = '(user_id, id)' if partitions else '(id)'
+    # Leftovers of a run that failed before the swap; the old table is still intact.
+    op.execute("DROP TRIGGER IF EXISTS contacts_mirror ON contacts")
+    op.execute("DROP FUNCTION IF EXISTS contacts_mirror()")
+    op.execute("DROP TABLE IF EXISTS contacts_new")
+    op.execute(f"""
+        CREATE TABLE contacts_new (
+            LIKE contacts INCLUDING DEFAULTS INCLUDING GENERATED,
+            CONSTRAINT contacts_new_pkey PRIMARY KEY {primary_key},
+            CONSTRAINT contacts_new_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        ) {'PARTITION BY HASH (user_id)' if partitions else ''}
+    """)
+    for remainder in range(partitions or 0):
+        op.execute(f"CREATE TABLE contacts_p{remainder} PARTITION OF contacts_new "
+                   f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})")
+    # Rows without an owner are unreachable through the API and cannot be placed in a partition.
+    # An upsert, not a plain INSERT: a copy batch may have inserted the same row without committing yet,
+    # and the conflict then waits for that batch and overwrites its older copy instead of failing.
+    columns = COLUMNS.split(', ')
+    op.execute(f"""
+        CREATE FUNCTION contacts_mirror() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND (OLD.user_id, OLD.id) IS DISTINCT FROM (NEW.user_id, NEW.id)) THEN
+                DELETE FROM contacts_new WHERE user_id = OLD.user_id AND id = OLD.id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.user_id IS NOT NULL THEN
+                INSERT INTO contacts_new ({COLUMNS}) SELECT {', '.join(f'NEW.{c}' for c in columns)}
+                ON CONFLICT {primary_key} DO UPDATE SET
+                    {', '.join(f'{c} = EXCLUDED.{c}' for c in columns if c not in ('id', 'user_id'))};
+            END IF;
+            RETURN NULL;
+        END $$
+    """)
+    op.execute("CREATE TRIGGER contacts_mirror AFTER INSERT OR UPDATE OR DELETE ON contacts "
+               "FOR EACH ROW EXECUTE FUNCTION contacts_mirror()")
+
+    copy = sa.text(f"""
+        INSERT INTO contacts_new ({COLUMNS})
+        SELECT {COLUMNS} FROM contacts WHERE id > :after AND id <= :until AND user_id IS NOT NULL
+        ON CONFLICT {primary_key} DO NOTHING
+    """)
+    # A row deleted after its batch read it but before the batch inserted it comes back; remove it again.
+    sweep = sa.text("""
+        DELETE FROM contacts_new AS n WHERE n.id > :after AND n.id <= :until
+        AND NOT EXISTS (SELECT 1 FROM contacts AS c WHERE c.id = n.id AND c.user_id = n.user_id)
+    """)
+    # Each statement commits on its own, so no batch holds locks for long; the trigger covers new writes.
+    with op.get_context().autocommit_block():
+        last = bind.execute(sa.text("SELECT coalesce(max(id), 0) FROM contacts")).scalar()
+        for statement in (copy, sweep):
+            for after in range(0, last, BATCH_SIZE):
+                bind.execute(statement, {"after": after, "until": after + BATCH_SIZE})
+        for name, unique, method, key in INDEXES:
+            if not partitions:
+                _create_index(f'{name}_new', 'contacts_new', unique, method, key, concurrently=True)
+                continue
+            # The parent index stays invalid until every partition's index is attached.
+            _create_index(f'{name}_new', 'contacts_new', unique, method, key, only=True)
+            for remainder in range(partitions):
+                _create_index(f'{name}_p{remainder}', f'contacts_p{remainder}', unique, method, key,
+                              concurrently=True)
+                op.execute(f"ALTER INDEX {name}_new ATTACH PARTITION {name}_p{remainder}")
+        op.execute("ANALYZE contacts_new")
+
+    # Readers and writers wait here for no longer than the catalog changes take.
+    op.execute("SET LOCAL lock_timeout = '10s'")
+    op.execute("LOCK TABLE contacts IN ACCESS EXCLUSIVE MODE")
+    op.execute("DROP TRIGGER contacts_mirror ON contacts")
+    op.execute("DROP FUNCTION contacts_mirror()")
+    op.execute("ALTER SEQUENCE contacts_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE contacts")
+    op.execute("ALTER TABLE contacts_new RENAME TO contacts")
+    op.execute("ALTER SEQUENCE contacts_id_seq OWNED BY contacts.id")
+    op.execute("ALTER TABLE contacts RENAME CONSTRAINT contacts_new_pkey TO contacts_pkey")
+    op.execute("ALTER TABLE contacts RENAME CONSTRAINT contacts_new_user_id_fkey TO contacts_user_id_fkey")
+    for name, *_ in INDEXES:
+        op.execute(f"ALTER INDEX {name}_new RENAME TO {name}")
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        _rebuild(PARTITIONS)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        _rebuild(None)
@@ -0,0 +1,40 @@
+"""Contacts search_text
+
+Revision ID: 5a0c2e6b9f14
+Revises: e41f7a9c3d58
+Create Date: 2026-10-19 18:22:09.640385
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a0c2e6b9f14'
+down_revision: Union[str, None] = 'e41f7a9c3d58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_TEXT = "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(email, ''))"
+
+
+def upgrade() -> None:
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    if postgresql:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    # Adding a stored generated column rewrites the table; schedule it for a quiet period on large tables.
+    # SQLite cannot add a STORED column to an existing table, only a VIRTUAL one; the index stores the value.
+    op.add_column('contacts', sa.Column('search_text', sa.String(), sa.Computed(SEARCH_TEXT, persisted=postgresql)))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_user_search', 'contacts', ['user_id', 'search_text'], postgresql_using='gist',
+                        postgresql_ops={'search_text': 'gist_trgm_ops'}, postgresql_concurrently=True,
+                        if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contacts_user_search', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('contacts', 'search_text')
@@ -0,0 +1,42 @@
+"""Contacts user indexes
+
+Revision ID: 6361e9f211f1
+Revises: 87b586bd9261
+Create Date: 2026-10-19 09:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6361e9f211f1'
+down_revision: Union[str, None] = '87b586bd9261'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_user_name', 'contacts', ['user_id', 'last_name', 'first_name', 'id'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_contacts_user_email', 'contacts', ['user_id', 'email'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_contacts_email', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_contacts_first_name', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_contacts_last_name', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_last_name', 'contacts', ['last_name'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_contacts_first_name', 'contacts', ['first_name'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_contacts_email', 'contacts', ['email'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_contacts_user_email', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_contacts_user_name', table_name='contacts', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,76 @@
+"""Contacts extra_data jsonb
+
+Revision ID: 9d27b4f0e613
+Revises: 5a0c2e6b9f14
+Create Date: 2026-10-19 20:11:48.377052
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d27b4f0e613'
+down_revision: Union[str, None] = '5a0c2e6b9f14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Empty values become NULL and JSON objects are kept; anything else, including text
+# that is not valid JSON, is kept under a "note" key.
+TO_JSONB = """
+    CREATE FUNCTION contacts_extra_data_jsonb(value text) RETURNS jsonb LANGUAGE plpgsql IMMUTABLE AS $$
+    DECLARE
+        parsed jsonb;
+    BEGIN
+        IF coalesce(trim(value), '') = '' THEN
+            RETURN NULL;
+        END IF;
+        BEGIN
+            parsed := value::jsonb;
+        EXCEPTION WHEN invalid_text_representation THEN
+            parsed := NULL;
+        END;
+        IF jsonb_typeof(parsed) = 'object' THEN
+            RETURN parsed;
+        END IF;
+        RETURN jsonb_build_object('note', value);
+    END $$
+"""
+
+# SQLite keeps JSON as text, so only the values change.
+SQLITE_TO_JSON = """
+    UPDATE contacts SET extra_data = CASE
+        WHEN trim(extra_data) = '' THEN NULL
+        WHEN json_valid(extra_data) THEN CASE WHEN json_type(extra_data) = 'object' THEN json(extra_data)
+                                              ELSE json_object('note', extra_data) END
+        ELSE json_object('note', extra_data) END
+    WHERE extra_data IS NOT NULL
+"""
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        op.execute(SQLITE_TO_JSON)
+        return
+    op.execute("DROP FUNCTION IF EXISTS contacts_extra_data_jsonb(text)")
+    op.execute(TO_JSONB)
+    op.alter_column('contacts', 'extra_data', type_=postgresql.JSONB(), existing_type=sa.String(),
+                    existing_nullable=True, postgresql_using="contacts_extra_data_jsonb(extra_data)")
+    op.execute("DROP FUNCTION contacts_extra_data_jsonb(text)")
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_extra_data', 'contacts', ['extra_data'], postgresql_using='gin',
+                        postgresql_ops={'extra_data': 'jsonb_path_ops'}, postgresql_concurrently=True,
+                        if_not_exists=True)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contacts_extra_data', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+    op.alter_column('contacts', 'extra_data', type_=sa.String(), existing_type=postgresql.JSONB(),
+                    existing_nullable=True, postgresql_using='extra_data::text')
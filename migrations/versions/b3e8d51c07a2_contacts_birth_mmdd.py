@@ -0,0 +1,51 @@
+"""Contacts birth_mmdd
+
+Revision ID: b3e8d51c07a2
+Revises: 6361e9f211f1
+Create Date: 2026-10-19 13:40:22.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e8d51c07a2'
+down_revision: Union[str, None] = '6361e9f211f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('birth_mmdd', sa.SmallInteger(), nullable=True))
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        mmdd = "(EXTRACT(MONTH FROM birth_date) * 100 + EXTRACT(DAY FROM birth_date))::smallint"
+    else:
+        mmdd = "CAST(strftime('%m%d', birth_date) AS INTEGER)"
+    backfill = sa.text(f"""
+        UPDATE contacts SET birth_mmdd = {mmdd}
+        WHERE id > :after AND id <= :until AND birth_mmdd IS NULL AND birth_date IS NOT NULL
+    """)
+    last_id = sa.text("SELECT coalesce(max(id), 0) FROM contacts")
+    # Small committed batches keep row locks short on a live table. Each batch is an id range
+    # on the primary key, so none of them rescans the rows earlier batches already filled in.
+    # Rows inserted during the walk lie above the last id read; the outer loop picks them up.
+    with op.get_context().autocommit_block():
+        after = 0
+        while after < (last := bind.execute(last_id).scalar()):
+            for start in range(after, last, BATCH_SIZE):
+                bind.execute(backfill, {"after": start, "until": start + BATCH_SIZE})
+            after = last
+        op.create_index('ix_contacts_user_birthday', 'contacts', ['user_id', 'birth_mmdd'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contacts_user_birthday', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('contacts', 'birth_mmdd')
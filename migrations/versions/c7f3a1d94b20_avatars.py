@@ -0,0 +1,30 @@
+"""Avatars
+
+Revision ID: c7f3a1d94b20
+Revises: 9d27b4f0e613
+Create Date: 2026-10-19 21:02:14.508631
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7f3a1d94b20'
+down_revision: Union[str, None] = '9d27b4f0e613'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    for table in ('users', 'contacts'):
+        op.add_column(table, sa.Column('avatar', sa.String(), nullable=True))
+        op.add_column(table, sa.Column('avatar_thumbnail', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    for table in ('users', 'contacts'):
+        op.drop_column(table, 'avatar_thumbnail')
+        op.drop_column(table, 'avatar')
@@ -0,0 +1,52 @@
+"""Contacts version and tombstones
+
+Revision ID: e2a9c4d17b85
+Revises: c7f3a1d94b20
+Create Date: 2026-10-19 21:48:30.912274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a9c4d17b85'
+down_revision: Union[str, None] = 'c7f3a1d94b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing rows start at version 0; clients pick them up with their first, full, sync.
+    op.add_column('users', sa.Column('contacts_version', sa.BigInteger(), server_default='0', nullable=False))
+    if op.get_bind().dialect.name == 'postgresql':
+        op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True))
+    else:
+        # SQLite cannot add a column with a non-constant default; fill the existing rows instead.
+        op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute("UPDATE contacts SET updated_at = CURRENT_TIMESTAMP")
+    op.add_column('contacts', sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+    op.create_table('contact_tombstones',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('contact_id', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('version', sa.BigInteger(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+                    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_contact_tombstones_user_version', 'contact_tombstones', ['user_id', 'version'])
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_user_version', 'contacts', ['user_id', 'version'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contacts_user_version', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+    op.drop_index('ix_contact_tombstones_user_version', table_name='contact_tombstones')
+    op.drop_table('contact_tombstones')
+    op.drop_column('contacts', 'version')
+    op.drop_column('contacts', 'updated_at')
+    op.drop_column('users', 'contacts_version')
@@ -0,0 +1,66 @@
+"""Contacts phone_e164
+
+Revision ID: e41f7a9c3d58
+Revises: b3e8d51c07a2
+Create Date: 2026-10-19 16:05:37.211830
+
+"""
+import os
+import re
+from typing import Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41f7a9c3d58'
+down_revision: Union[str, None] = 'b3e8d51c07a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+# The setting the application reads as settings.phone_country_code.
+COUNTRY_CODE = os.environ.get('PHONE_COUNTRY_CODE', '')
+
+
+def normalize_phone(number: Optional[str]) -> Optional[str]:
+    """services.duplicates.normalize_phone as of this revision; later changes there must not alter the backfill."""
+    number = (number or '').strip()
+    digits = re.sub(r'\D', '', number)
+    if number.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    else:
+        if not COUNTRY_CODE:
+            return None
+        digits = COUNTRY_CODE + digits.lstrip('0')
+    if not 8 <= len(digits) <= 15 or digits.startswith('0'):
+        return None
+    return '+' + digits
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('phone_e164', sa.String(), nullable=True))
+    bind = op.get_bind()
+    select = sa.text("SELECT id, phone_number FROM contacts "
+                     "WHERE id > :after AND phone_number IS NOT NULL ORDER BY id LIMIT :limit")
+    update = sa.text("UPDATE contacts SET phone_e164 = :phone_e164 WHERE id = :id")
+    # Normalization lives in Python, so the backfill walks the table by id in committed batches.
+    with op.get_context().autocommit_block():
+        after = 0
+        while rows := bind.execute(select, {"after": after, "limit": BATCH_SIZE}).all():
+            values = [{"id": row.id, "phone_e164": normalize_phone(row.phone_number)} for row in rows]
+            values = [value for value in values if value["phone_e164"]]
+            if values:
+                bind.execute(update, values)
+            after = rows[-1].id
+        op.create_index('ix_contacts_user_phone', 'contacts', ['user_id', 'phone_e164'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contacts_user_phone', table_name='contacts', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('contacts', 'phone_e164')
@@ -0,0 +1,32 @@
+"""User shards
+
+Revision ID: f4b81d3c6a27
+Revises: e2a9c4d17b85
+Create Date: 2026-10-19 22:37:05.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b81d3c6a27'
+down_revision: Union[str, None] = 'e2a9c4d17b85'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Run on the main database and on every shard; shards use users.shard to mark their home rows.
+    op.add_column('users', sa.Column('shard', sa.SmallInteger(), nullable=True))
+    op.create_table('id_blocks',
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('next_id', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('name'))
+
+
+def downgrade() -> None:
+    op.drop_table('id_blocks')
+    op.drop_column('users', 'shard')
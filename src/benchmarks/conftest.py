@@ -0,0 +1,67 @@
+"""
+Baseline comparison for the hot-path benchmarks.
+
+Each benchmark's median is compared with ``baseline.json``. The run fails when a
+median is more than ``--regression-threshold`` (default 25%) slower than its
+baseline. ``--update-baseline`` rewrites the file from the current run.
+"""
+import json
+import platform
+from pathlib import Path
+
+import pytest
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+results_key = pytest.StashKey[dict]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("hot-path baselines")
+    group.addoption("--update-baseline", action="store_true", help="Write medians of this run to baseline.json")
+    group.addoption("--regression-threshold", type=float, default=0.25,
+                    help="Allowed slowdown against the baseline, as a fraction (default 0.25)")
+
+
+def pytest_configure(config):
+    config.stash[results_key] = {}
+
+
+@pytest.fixture(autouse=True)
+def _record_median(request):
+    yield
+    benchmark = request.node.funcargs.get("benchmark")
+    if benchmark is not None and benchmark.stats is not None:
+        request.config.stash[results_key][request.node.name] = benchmark.stats.stats.median
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    results = config.stash[results_key]
+    if not results:
+        return
+    if config.getoption("update_baseline"):
+        baseline = {"machine": platform.platform(), "python": platform.python_version(),
+                    "median_seconds": dict(sorted(results.items()))}
+        BASELINE_FILE.write_text(json.dumps(baseline, indent=2) + "\n")
+        return
+    if not BASELINE_FILE.exists():
+        return
+
+    threshold = config.getoption("regression_threshold")
+    baseline = json.loads(BASELINE_FILE.read_text())["median_seconds"]
+    regressions = []
+    for name, median in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected and median > expected * (1 + threshold):
+            regressions.append(f"{name}: {median * 1e6:.1f}us vs baseline {expected * 1e6:.1f}us "
+                               f"(+{(median / expected - 1) * 100:.0f}%)")
+
+    reporter = config.pluginmanager.get_plugin("terminalreporter")
+    if regressions:
+        reporter.section("hot-path regressions", red=True)
+        for line in regressions:
+            reporter.write_line(line)
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+    else:
+        reporter.write_line(f"hot-path benchmarks within {threshold:.0%} of baseline")
@@ -0,0 +1,107 @@
+"""
+Startup-time benchmark.
+
+Measures, in fresh interpreters, how long ``import main`` takes and how long a
+uvicorn worker needs from process start to its first answered request::
+
+    python -m benchmarks.startup --runs 5
+    FAST_START=true python -m benchmarks.startup --runs 5
+
+Results are printed as JSON so runs can be compared.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+# Imported on first use; ``import main`` must not pull any of them in.
+DEFERRED = ("redis", "passlib", "jose", "fastapi_mail")
+DEFERRED_SNIPPET = f"import sys, main; print(' '.join(sorted({{m.split('.')[0] for m in sys.modules}} & {set(DEFERRED)!r})))"
+
+
+def measure_import() -> float:
+    """
+    Time ``import main`` in a fresh interpreter.
+
+    :return: Import time in seconds.
+    :rtype: float
+    """
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], cwd=SRC_DIR, env=os.environ.copy())
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def eager_imports() -> list:
+    """
+    Lists the DEFERRED packages that ``import main`` loads anyway.
+
+    :return: Package names, empty when every deferred import is deferred.
+    :rtype: list
+    """
+    output = subprocess.check_output([sys.executable, "-c", DEFERRED_SNIPPET], cwd=SRC_DIR, env=os.environ.copy())
+    return output.decode().splitlines()[-1].split()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(timeout: float = 30.0) -> float:
+    """
+    Time from spawning a uvicorn worker until ``GET /`` answers.
+
+    :param timeout: Give up after this many seconds.
+    :type timeout: float
+    :return: Time to first request in seconds.
+    :rtype: float
+    """
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                               cwd=SRC_DIR, env=os.environ.copy())
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    response.read()
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"No response from uvicorn within {timeout} seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summarize(samples: list) -> dict:
+    return {"min": min(samples), "median": statistics.median(samples), "max": max(samples), "runs": len(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--skip-server", action="store_true", help="Only measure import time")
+    args = parser.parse_args()
+
+    result = {"fast_start": os.environ.get("FAST_START", "false"),
+              "import_seconds": summarize([measure_import() for _ in range(args.runs)]),
+              "eager_imports": eager_imports()}
+    if not args.skip_server:
+        result["first_request_seconds"] = summarize([measure_first_request() for _ in range(args.runs)])
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
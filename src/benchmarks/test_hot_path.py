@@ -0,0 +1,111 @@
+"""
+Micro-benchmarks for the work every request pays for::
+
+    pytest benchmarks
+    pytest benchmarks --update-baseline
+
+Not collected by the regular ``pytest`` run; see ``benchmarks/conftest.py`` for
+the baseline comparison.
+"""
+import asyncio
+from datetime import date
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import main
+from database.models import Base, Contact, User
+from repository.auth import Hash, create_access_token, get_current_user
+from repository.contacts import get_contacts
+from schemas import ContactResponse
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(username="deadpool", email="deadpool@example.com", password=Hash().get_password_hash("123456789"))
+    db.add(user)
+    db.flush()
+    db.add_all(Contact(first_name=f"Wade{i}", last_name=f"Wilson{i}", email=f"wade{i}@example.com",
+                       phone_number="+48500600700", birth_date=date(1990, 1, 1), user_id=user.id)
+               for i in range(100))
+    db.commit()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def user(session):
+    return session.query(User).first()
+
+
+def test_create_access_token(benchmark, loop):
+    benchmark(lambda: loop.run_until_complete(create_access_token(data={"sub": "deadpool@example.com"})))
+
+
+def test_get_current_user(benchmark, loop, session):
+    token = loop.run_until_complete(create_access_token(data={"sub": "deadpool@example.com"}))
+    result = benchmark(lambda: loop.run_until_complete(get_current_user(token, session)))
+    assert result.email == "deadpool@example.com"
+
+
+def test_verify_password(benchmark, user):
+    hash_handler = Hash()
+    assert benchmark.pedantic(hash_handler.verify_password, args=("123456789", user.password), rounds=5)
+
+
+def test_contact_response_validation(benchmark, session):
+    contacts = session.query(Contact).all()
+    adapter = TypeAdapter(List[ContactResponse])
+    assert len(benchmark(adapter.validate_python, contacts, from_attributes=True)) == 100
+
+
+def test_get_contacts(benchmark, loop, session, user):
+    result = benchmark(lambda: loop.run_until_complete(get_contacts(session, user, search_query="wilson1")))
+    assert len(result) == 11
+
+
+def test_middleware_stack(benchmark, loop):
+    app = FastAPI()
+
+    @app.get("/")
+    async def root():
+        return {}
+
+    app.middleware("http")(main.ban_ips)
+    app.middleware("http")(main.user_agent_ban_middleware)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+             "headers": [(b"host", b"bench"), (b"user-agent", b"benchmark")],
+             "client": ("127.0.0.1", 50000), "server": ("bench", 80)}
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    async def request():
+        messages = iter([{"type": "http.request", "body": b"", "more_body": False}])
+
+        async def receive():
+            return next(messages, {"type": "http.disconnect"})
+
+        await app(scope, receive, send)
+
+    benchmark(lambda: loop.run_until_complete(request()))
+    assert set(statuses) == {200}
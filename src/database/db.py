@@ -1,12 +1,23 @@
-from sqlalchemy import create_engine, Column, String, Integer
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, Column, String, Integer
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Depends, HTTPException, Request, status
+from starlette.requests import HTTPConnection
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
+import hashlib
+import hmac
+from http.cookies import SimpleCookie
 import os
+import time
+from itertools import cycle
+from pathlib import Path
 from sqlalchemy.sql.sqltypes import DateTime
 from datetime import datetime
 from sqlalchemy import *
 from conf.config import settings
+from database.slow_queries import SlowQueryLog
+from database import trigram  # registers word_similarity() on SQLite connections
+from database.shards import ShardRouter, ShardSession
 
 
 load_dotenv()
@@ -16,17 +27,188 @@ SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
 
 
 
+def engine_options(url: str) -> dict:
+    # SQLite connections are used from FastAPI's threadpool as well as the event loop thread.
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {}
+
+
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+shard_engines = [create_engine(url, **engine_options(url)) for url in settings.shard_urls]
+shard_router = ShardRouter(engine, shard_engines, settings.shard_mapping)
+SessionLocal = sessionmaker(class_=ShardSession, router=shard_router, autocommit=False, autoflush=False, bind=engine)
+
+replica_engines = [create_engine(url, **engine_options(url)) for url in settings.sqlalchemy_replica_urls]
+ReplicaSessions = cycle([sessionmaker(autocommit=False, autoflush=False, bind=replica) for replica in replica_engines])
+
+slow_query_log = SlowQueryLog(settings.slow_query_ms, explain=settings.slow_query_explain)
+if settings.slow_query_ms > 0:
+    for bind in [engine, *replica_engines, *shard_engines]:
+        slow_query_log.install(bind)
+
+# Carries the time of the requester's last commit, so any worker can send their next reads to the
+# primary; set on the response by LastWriteMiddleware.
+LAST_WRITE = "last-write"
 
 Base = declarative_base()
 
 
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / 'migrations'
+
+
+def check_schema_revision(bind=engine):
+    """
+    Verifies that the database is at the Alembic head revision.
+
+    :param bind: The engine to check.
+    :type bind: Engine
+    :raises RuntimeError: If the database revision does not match the migration scripts.
+    """
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    heads = set(ScriptDirectory(str(MIGRATIONS_DIR)).get_heads())
+    with bind.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    if current != heads:
+        raise RuntimeError(f"Database revision {sorted(current)} does not match migrations head {sorted(heads)}, "
+                           f"run 'alembic upgrade head'")
+
+
+def write_marker(at: float) -> str:
+    """
+    Signs a commit time for the ``last-write`` cookie and header.
+
+    :param at: The commit time, in seconds since the epoch.
+    :type at: float
+    :return: ``<time>.<signature>``.
+    :rtype: str
+    """
+    stamp = f"{at:.3f}"
+    signature = hmac.new(settings.secret_key.encode(), stamp.encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{stamp}.{signature}"
+
+
+def last_write(request: HTTPConnection) -> float | None:
+    """
+    Reads the requester's last commit time, from the header or the cookie.
+
+    :param request: The incoming request.
+    :type request: HTTPConnection
+    :return: The commit time, or None when absent or not signed by us.
+    :rtype: float | None
+    """
+    marker = request.headers.get(LAST_WRITE) or request.cookies.get(LAST_WRITE)
+    if not marker:
+        return None
+    try:
+        at = float(marker.rpartition(".")[0])
+    except ValueError:
+        return None
+    return at if hmac.compare_digest(marker, write_marker(at)) else None
+
+
+class LastWriteMiddleware:
+    """
+    ASGI middleware that hands a requester whose request committed the signed ``last-write``
+    marker, as header and cookie, so their next reads go to the primary until replicas have
+    caught up.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # request.state writes into this dict, so the commit listener's time shows up here.
+        state = scope.setdefault("state", {})
+
+        async def send_with_marker(message):
+            written = state.get("last_write")
+            if message["type"] == "http.response.start" and written is not None:
+                marker = write_marker(written)
+                cookie = SimpleCookie()
+                cookie[LAST_WRITE] = marker
+                cookie[LAST_WRITE].update({"max-age": int(settings.replica_lag_window) + 1, "path": "/",
+                                           "httponly": True, "samesite": "lax"})
+                message["headers"] = [*message.get("headers", []), (LAST_WRITE.encode(), marker.encode()),
+                                      (b"set-cookie", cookie.output(header="").strip().encode("latin-1"))]
+            await send(message)
+
+        await self.app(scope, receive, send_with_marker)
+
+
+def reads_from_primary(request: HTTPConnection) -> bool:
+    """
+    Checks whether the requester wrote recently and must not read from a lagging replica.
+
+    The commit time travels with the client, not with a worker or a token, so it holds
+    across workers, parallel connections and token refreshes.
+
+    :param request: The incoming request.
+    :type request: HTTPConnection
+    :return: True if reads should go to the primary.
+    :rtype: bool
+    """
+    # Replicas copy the main database only; with shards, contacts are read where they live.
+    if not replica_engines or shard_router.sharded:
+        return True
+    at = last_write(request)
+    return at is not None and time.time() - at < settings.replica_lag_window
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _remember_writer(session):
+    state = session.info.get("request_state")
+    if state is not None:
+        state.last_write = time.time()
+
+
 # Dependency
-def get_db():
+def get_db(request: HTTPConnection):
+    if "batch" in request.scope:
+        # Sub-requests of POST /api/batch share the batch's read session; the batch closes it.
+        route = request.scope.get("route")
+        if not getattr(getattr(route, "endpoint", None), "batchable", False):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="This route cannot be part of a batch")
+        yield request.scope["batch"]["session"]
+        return
     db = SessionLocal()
+    db.info["request_state"] = request.state
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    """
+    Read-only session dependency for GET routes.
+
+    Uses a replica when one is configured, unless the requester wrote within the
+    replica lag window. Otherwise it shares the request's primary session, which
+    does not open a connection until it is used. Sub-requests of a batch get the
+    batch's session.
+
+    :param request: The incoming request.
+    :type request: Request
+    :param db: The request's primary session.
+    :type db: Session
+    :return: A database session.
+    :rtype: Session
+    """
+    if "batch" in request.scope:
+        yield request.scope["batch"]["session"]
+        return
+    if reads_from_primary(request):
+        yield db
+        return
+    replica = next(ReplicaSessions)()
+    try:
+        yield replica
+    finally:
+        replica.close()
\ No newline at end of file
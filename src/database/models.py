@@ -1,13 +1,21 @@
-from sqlalchemy import Column, Boolean, Integer, String, Date, func, Table, UniqueConstraint
+from sqlalchemy import Column, BigInteger, Boolean, Integer, SmallInteger, String, Date, func, Table, UniqueConstraint, Index, Computed, DDL, JSON, event
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
-from passlib.context import CryptContext
-from database.db import engine
-from sqlalchemy.orm import relationship
+from database.db import engine, check_schema_revision
+from conf.config import settings
+from services.duplicates import normalize_phone
+from sqlalchemy.orm import relationship, synonym, validates
 from sqlalchemy.sql.schema import ForeignKey
 from sqlalchemy.sql.sqltypes import DateTime
 from datetime import datetime
 Base = declarative_base()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Ranked search needs trigram operators and a GiST index that also covers the integer user_id.
+for extension in ("pg_trgm", "btree_gist"):
+    event.listen(Base.metadata, "before_create",
+                 DDL(f"CREATE EXTENSION IF NOT EXISTS {extension}").execute_if(dialect="postgresql"))
+
+SEARCH_TEXT = "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(email, ''))"
 
 class User(Base):
     __tablename__ = "users"
@@ -18,18 +26,111 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     refresh_token = Column(String)
     confirmed = Column(Boolean, default=False)
+    avatar = Column(String)
+    avatar_thumbnail = Column(String)
+    # Last change version handed out for this user's contacts; see repository.contacts.next_version.
+    contacts_version = Column(BigInteger, nullable=False, default=0, server_default='0')
+    # Index of the shard holding the user's contacts; see database.shards.
+    shard = Column(SmallInteger)
 
 class Contact(Base):
     __tablename__ = "contacts"
+    __table_args__ = (
+        # Every contacts query filters on user_id first, so the user is the leading column.
+        Index('ix_contacts_user_name', 'user_id', 'last_name', 'first_name', 'id'),
+        Index('ix_contacts_user_email', 'user_id', 'email', unique=True),
+        Index('ix_contacts_user_birthday', 'user_id', 'birth_mmdd'),
+        Index('ix_contacts_user_phone', 'user_id', 'phone_e164'),
+        Index('ix_contacts_user_version', 'user_id', 'version'),
+        Index('ix_contacts_user_search', 'user_id', 'search_text', postgresql_using='gist',
+              postgresql_ops={'search_text': 'gist_trgm_ops'}),
+        # Serves extra_data @> '{...}'; SQLite filters through json_extract() instead.
+        Index('ix_contacts_extra_data', 'extra_data', postgresql_using='gin',
+              postgresql_ops={'extra_data': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    first_name = Column(String, index=True)
-    last_name = Column(String, index=True)
-    email = Column(String, unique=True, index=True)
+    first_name = Column(String)
+    last_name = Column(String)
+    email = Column(String)
     phone_number = Column(String, index=False)
+    # phone_number as typed; phone_e164 is what lookups match on.
+    phone_e164 = Column(String)
     birth_date = Column(Date)
-    extra_data = Column(String, nullable=True)
+    # Month and day of birth_date as MMDD, so "birthday in the next N days" is an index lookup.
+    birth_mmdd = Column(SmallInteger)
+    extra_data = Column(JSON().with_variant(JSONB(), 'postgresql'), nullable=True)
+    additional_info = synonym('extra_data')
+    # What ranked search matches against; maintained by the database.
+    search_text = Column(String, Computed(SEARCH_TEXT, persisted=True))
+    avatar = Column(String)
+    avatar_thumbnail = Column(String)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # The owner's contacts_version at the last change, so delta sync is a range scan.
+    version = Column(BigInteger, nullable=False, default=0, server_default='0')
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="contacts")
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    # On Postgres the table is hash-partitioned by user_id (migration 0b6e5d2f8a31). The ORM keys rows
+    # on both columns so its UPDATEs and DELETEs name the partition instead of probing all of them.
+    __mapper_args__ = {"primary_key": [id, user_id]}
+
+    @validates('phone_number')
+    def _set_phone_e164(self, key, value):
+        self.phone_e164 = normalize_phone(value)
+        return value
+
+    @validates('birth_date')
+    def _set_birth_mmdd(self, key, value):
+        self.birth_mmdd = birthday_key(value) if value else None
+        return value
+
+
+class ContactTombstone(Base):
+    """A deleted contact, kept so delta sync can tell clients to drop it."""
+    __tablename__ = "contact_tombstones"
+    __table_args__ = (
+        Index('ix_contact_tombstones_user_version', 'user_id', 'version'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    contact_id = Column(Integer, nullable=False)
+    user_id = Column(ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    version = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class IdBlock(Base):
+    """Next unreserved id of a sequence shared by all shards; see database.shards.IdAllocator."""
+    __tablename__ = "id_blocks"
+
+    name = Column(String, primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
+
+
+def birthday_key(day) -> int:
+    """
+    The MMDD key stored in ``Contact.birth_mmdd``.
+
+    :param day: Any date.
+    :type day: date
+    :return: ``month * 100 + day``, e.g. 1021 for October 21.
+    :rtype: int
+    """
+    return day.month * 100 + day.day
+
+
+def init_schema(bind=engine):
+    """
+    Prepares the database schema once per process.
+
+    In fast-start mode the schema is owned by Alembic, so only the revision is checked;
+    otherwise the tables are created if they do not exist.
+
+    :param bind: The engine to prepare.
+    :type bind: Engine
+    """
+    if settings.fast_start:
+        check_schema_revision(bind)
+    else:
+        Base.metadata.create_all(bind=bind)
@@ -0,0 +1,498 @@
+"""
+Horizontal sharding of contacts by user.
+
+The main database (``database.db.engine``) stays the directory: it holds every user
+and is shard 0. ``settings.shard_urls`` adds shards 1..N. A user's contacts and
+tombstones live on one shard, next to a copy of the user's row there. That copy owns
+the contacts' foreign key and ``contacts_version``, so a write still takes one row
+lock on the database it writes to (see ``repository.contacts.next_version``).
+
+Where a user lives:
+
+* ``users.shard`` on the main database, when set, is authoritative (directory mapping).
+* Otherwise, with ``settings.shard_mapping = 'hash'``, a consistent-hash ring over
+  ``user_id`` decides; adding a shard then only remaps about 1/N of the users.
+  With ``'directory'``, new users are placed by the ring and their shard is written
+  down, so later changes to the shard list never remap anyone; users without an entry
+  (created before sharding) stay on the main database.
+
+Sessions from ``SessionLocal`` are ``ShardSession``s. ``get_current_user`` routes the
+request's session to the user's shard; from then on contact tables go to that shard
+and everything else to the main database. Reads across users, such as the birthday
+queries, open one session per shard with ``shard_sessions``.
+
+Contact ids are handed out in blocks from the main database, so they are unique across
+shards and a user keeps their ids when moved::
+
+    python -m database.shards move 42 2     # move user 42 to shard 2, online
+    python -m database.shards pin           # write down the shard of every user without one
+
+Set ``SHARD_URLS='["sqlite:///shard1.db", "sqlite:///shard2.db"]'`` to try it with local
+SQLite files; ``ShardRouter.sqlite`` does the same for tests.
+"""
+import argparse
+import bisect
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import and_, create_engine, delete, func, inspect, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+SHARDED_TABLES = frozenset({"contacts", "contact_tombstones"})
+_SHARD = "shard"
+
+
+class UserMoved(Exception):
+    """The user was moved to another shard while the request was in flight; retrying succeeds."""
+
+    def __init__(self, user_id: int):
+        super().__init__(f"user {user_id} moved to another shard")
+        self.user_id = user_id
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring with ``points`` virtual nodes per shard."""
+
+    def __init__(self, shards: int, points: int = 100):
+        ring = sorted((_hash(f"{shard}:{point}"), shard) for shard in range(shards) for point in range(points))
+        self.hashes = [h for h, _ in ring]
+        self.shards = [shard for _, shard in ring]
+
+    def node(self, user_id: int) -> int:
+        index = bisect.bisect(self.hashes, _hash(str(user_id))) % len(self.hashes)
+        return self.shards[index]
+
+
+class IdAllocator:
+    """
+    Contact ids reserved ``block`` at a time from the main database's ``id_blocks`` table.
+
+    One round trip per block; ids are unique across shards but only roughly ordered
+    across workers.
+    """
+
+    def __init__(self, router: "ShardRouter", name: str = "contacts", block: int = 1000):
+        self.router = router
+        self.name = name
+        self.block = block
+        self.next = self.end = 0
+        self.lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self.lock:
+            if self.next >= self.end:
+                self.end = self._reserve()
+                self.next = self.end - self.block
+            self.next += 1
+            return self.next - 1
+
+    def _reserve(self) -> int:
+        from database.models import Contact, IdBlock
+        while True:
+            with self.router.main.begin() as connection:
+                end = connection.execute(update(IdBlock).where(IdBlock.name == self.name)
+                                         .values(next_id=IdBlock.next_id + self.block)
+                                         .returning(IdBlock.next_id)).scalar()
+                if end is not None:
+                    return end
+            # First reservation: start above every id already on any shard.
+            start = 1
+            for engine in self.router.engines:
+                with engine.connect() as connection:
+                    start = max(start, 1 + connection.execute(select(func.coalesce(func.max(Contact.id), 0))).scalar())
+            try:
+                with self.router.main.begin() as connection:
+                    connection.execute(insert(IdBlock).values(name=self.name, next_id=start + self.block))
+                return start + self.block
+            except IntegrityError:
+                continue  # another worker seeded it first
+
+
+class ShardRouter:
+    """
+    Maps users to shards and holds the shard engines.
+
+    :param main: The main database, which is the directory and shard 0.
+    :type main: Engine
+    :param shards: Engines of shards 1..N; none means sharding is off.
+    :type shards: list
+    :param mapping: ``hash`` or ``directory``.
+    :type mapping: str
+    """
+
+    def __init__(self, main, shards: list = (), mapping: str = "directory"):
+        if mapping not in ("hash", "directory"):
+            raise ValueError(f"shard mapping must be 'hash' or 'directory', not {mapping!r}")
+        self.main = main
+        self.engines = [main, *shards]
+        self.mapping = mapping
+        self.ring = HashRing(len(self.engines))
+        self.contact_ids = IdAllocator(self)
+
+    @classmethod
+    def sqlite(cls, directory, shards: int, mapping: str = "directory", main=None) -> "ShardRouter":
+        """
+        Test mode: a router over SQLite files in ``directory``, with the schema created.
+
+        :param directory: Where to put ``main.db`` and ``shard<N>.db``.
+        :type directory: str | Path
+        :param shards: How many shards besides the main database.
+        :type shards: int
+        :param mapping: ``hash`` or ``directory``.
+        :type mapping: str
+        :param main: An existing main engine to use instead of ``main.db``.
+        :type main: Engine
+        :rtype: ShardRouter
+        """
+        from database.models import Base
+        options = {"connect_args": {"check_same_thread": False}}
+        main = main or create_engine(f"sqlite:///{Path(directory) / 'main.db'}", **options)
+        engines = [create_engine(f"sqlite:///{Path(directory) / f'shard{n}.db'}", **options)
+                   for n in range(1, shards + 1)]
+        for engine in [main, *engines]:
+            Base.metadata.create_all(bind=engine)
+        return cls(main, engines, mapping)
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.engines) > 1
+
+    def unpinned_shard(self, user_id: int) -> int:
+        """Where a user without a ``users.shard`` entry lives."""
+        return self.ring.node(user_id) if self.mapping == "hash" else 0
+
+    def shard_of(self, user) -> int:
+        """
+        :param user: A user row from the main database.
+        :type user: User
+        :return: The index of the shard holding the user's contacts.
+        :rtype: int
+        """
+        return user.shard if user.shard is not None else self.unpinned_shard(user.id)
+
+    def dispose(self) -> None:
+        for engine in self.engines[1:]:
+            engine.dispose()
+
+
+class ShardSession(Session):
+    """
+    Session that sends the contact tables to the shard it was routed to.
+
+    Statements may pass ``bind_arguments={"home": True}`` to reach the shard's copy of
+    the user row instead of the directory's.
+    """
+
+    def __init__(self, *args, router: ShardRouter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+
+    def get_bind(self, mapper=None, *, home: bool = False, **kwargs):
+        shard = self.info.get(_SHARD)
+        if shard is not None and (home or (mapper is not None and inspect(mapper).local_table.name in SHARDED_TABLES)):
+            return self.router.engines[shard]
+        return super().get_bind(mapper, **kwargs)
+
+
+def _router(db: Session) -> ShardRouter | None:
+    router = getattr(db, "router", None) if isinstance(db, ShardSession) else None
+    return router if router is not None and router.sharded else None
+
+
+def route_session(db: Session, user) -> None:
+    """Sends the session's contact queries to ``user``'s shard. A no-op without sharding."""
+    router = _router(db)
+    if router is not None:
+        db.info[_SHARD] = router.shard_of(user)
+
+
+def session_shard(db: Session) -> int | None:
+    """The shard the session was routed to, or None."""
+    return db.info.get(_SHARD)
+
+
+def home_shard(db: Session, user) -> int:
+    """
+    :param user: A user row from the main database, or any row with its ``id`` and ``shard``.
+    :return: The shard holding the user's contacts; 0 without sharding.
+    :rtype: int
+    """
+    router = _router(db)
+    return router.shard_of(user) if router is not None else 0
+
+
+@contextmanager
+def shard_sessions(db: Session):
+    """
+    Sessions reading the contact tables of every shard, for queries across users.
+
+    Without sharding this is just ``{0: db}``. Otherwise each shard gets its own
+    session, closed on exit; rows loaded through it stay readable afterwards.
+
+    :param db: The request's main database session.
+    :type db: Session
+    :return: Shard index mapped to a session.
+    :rtype: dict
+    """
+    router = _router(db)
+    if router is None:
+        yield {0: db}
+        return
+    sessions = {}
+    try:
+        for shard in range(len(router.engines)):
+            sessions[shard] = ShardSession(bind=router.main, router=router, autoflush=False)
+            sessions[shard].info[_SHARD] = shard
+        yield sessions
+    finally:
+        for session in sessions.values():
+            session.close()
+
+
+def home_guard(db: Session, user_id: int):
+    """
+    Condition on ``users`` that holds only while the routed shard is the user's home.
+
+    A move rewrites ``users.shard`` on the old home under the row lock, so a request
+    routed before the move fails the condition instead of writing to the old shard.
+
+    :return: The condition, or None when the session is not routed.
+    """
+    router, shard = _router(db), session_shard(db)
+    if router is None or shard is None:
+        return None
+    from database.models import User
+    return func.coalesce(User.shard, router.unpinned_shard(user_id)) == shard
+
+
+def next_contact_id(db: Session) -> int | None:
+    """A cluster-wide contact id, or None to let the database assign one when not sharded."""
+    router = _router(db)
+    return router.contact_ids.allocate() if router is not None else None
+
+
+def place_user(db: Session, user) -> None:
+    """
+    Gives a new, flushed user a home shard: their row is copied there, and with the
+    directory mapping the shard is recorded on the main row.
+
+    :param db: The main database session creating the user.
+    :type db: Session
+    :param user: The new user.
+    :type user: User
+    """
+    router = _router(db)
+    if router is None:
+        return
+    shard = router.ring.node(user.id)
+    if router.mapping == "directory":
+        user.shard = shard
+    if shard != 0:
+        with router.engines[shard].begin() as connection:
+            _write_home_row(connection, user, shard)
+
+
+def _write_home_row(connection, user, shard: int, contacts_version: int = 0):
+    from database.models import User
+    row = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+    row.update(shard=shard, contacts_version=contacts_version)
+    connection.execute(delete(User).where(User.id == user.id))
+    connection.execute(insert(User).values(**row))
+
+
+def _copy_changes(source, target, user_id: int, since: int, batch_size: int, online: bool) -> tuple:
+    """
+    Copies contacts and tombstones with a version above ``since`` from ``source`` to ``target``.
+
+    The pass stops at the user's ``contacts_version`` as read when it starts. Every
+    version up to it is committed, because a write bumps the counter in its own
+    transaction; anything newer, including rows changed while the pass runs, is
+    left to the next pass.
+
+    Online copies commit after every batch; otherwise the caller owns both transactions.
+
+    :return: The version the pass stopped at and the number of rows copied.
+    :rtype: tuple
+    """
+    from database.models import Contact, ContactTombstone, User
+    columns = [column for column in Contact.__table__.columns if column.computed is None]
+    bound = source.execute(select(User.contacts_version).where(User.id == user_id)).scalar()
+    if bound is None:
+        raise ValueError(f"user {user_id} has no row on the source shard; was it moved meanwhile?")
+    if online:
+        source.rollback()
+    copied = 0
+    in_pass = and_(Contact.user_id == user_id, Contact.version <= bound)
+    after = None
+    while True:
+        position = Contact.version > since if after is None else \
+            or_(Contact.version > after[0], and_(Contact.version == after[0], Contact.id > after[1]))
+        rows = source.execute(select(*columns).where(in_pass, position)
+                              .order_by(Contact.version, Contact.id).limit(batch_size)).all()
+        if rows:
+            target.execute(delete(Contact).where(Contact.user_id == user_id,
+                                                 Contact.id.in_([row.id for row in rows])))
+            target.execute(insert(Contact), [row._asdict() for row in rows])
+            after, copied = (rows[-1].version, rows[-1].id), copied + len(rows)
+        if online:
+            # Keep no snapshot or lock across batches; the user is still writing to the source.
+            source.rollback()
+            target.commit()
+        if len(rows) < batch_size:
+            break
+    # Read after the contacts, so a delete that removed a row the scan copied is applied to it.
+    tombstones = source.execute(select(ContactTombstone.contact_id, ContactTombstone.user_id, ContactTombstone.version,
+                                       ContactTombstone.deleted_at)
+                                .where(ContactTombstone.user_id == user_id, ContactTombstone.version > since,
+                                       ContactTombstone.version <= bound)).all()
+    if tombstones:
+        target.execute(insert(ContactTombstone), [row._asdict() for row in tombstones])
+        target.execute(delete(Contact).where(Contact.user_id == user_id,
+                                             Contact.id.in_([row.contact_id for row in tombstones])))
+        copied += len(tombstones)
+    if online:
+        source.rollback()
+        target.commit()
+    return bound, copied
+
+
+def move_user(router: ShardRouter, user_id: int, target: int, batch_size: int = 1000) -> dict:
+    """
+    Moves a user's contacts to another shard while the user keeps using the API.
+
+    1. Copy everything in version order, in batches, without locks; repeat for what
+       changed meanwhile until a pass copies less than a batch.
+    2. Lock the user's row on the old shard and mark it moved, which blocks and then
+       fails any write there (``UserMoved``). Copy the last changes and the version
+       counter, commit the new shard, point the directory at it, release the old shard.
+    3. Delete the old copy in batches.
+
+    Reads keep going to the old shard until the directory changes. The pause for
+    writes lasts one catch-up pass.
+
+    :param router: The shard router.
+    :type router: ShardRouter
+    :param user_id: The user to move.
+    :type user_id: int
+    :param target: The index of the destination shard.
+    :type target: int
+    :param batch_size: Rows per copy and delete statement.
+    :type batch_size: int
+    :return: Counts of rows copied and removed, and the number of catch-up passes.
+    :rtype: dict
+    """
+    from database.models import Contact, ContactTombstone, User
+    if not 0 <= target < len(router.engines):
+        raise ValueError(f"no shard {target}; shards are 0..{len(router.engines) - 1}")
+    with Session(router.main) as directory:
+        user = directory.get(User, user_id)
+        if user is None:
+            raise ValueError(f"no user {user_id}")
+        source = router.shard_of(user)
+        if source == target:
+            return {"copied": 0, "removed": 0, "passes": 0}
+        directory.expunge(user)
+    stats = {"copied": 0, "removed": 0, "passes": 0}
+    source_engine, target_engine = router.engines[source], router.engines[target]
+
+    # Leftovers of an earlier, interrupted move are not visible to anyone; start clean.
+    with target_engine.begin() as connection:
+        connection.execute(delete(ContactTombstone).where(ContactTombstone.user_id == user_id))
+        connection.execute(delete(Contact).where(Contact.user_id == user_id))
+        if target != 0:
+            _write_home_row(connection, user, target)
+
+    since = -1
+    while True:
+        with source_engine.connect() as reader, target_engine.connect() as writer:
+            since, copied = _copy_changes(reader, writer, user_id, since, batch_size, online=True)
+        stats["copied"] += copied
+        stats["passes"] += 1
+        if copied < batch_size:
+            break
+
+    with source_engine.connect() as old, target_engine.connect() as new:
+        old.begin()
+        locked = old.execute(update(User).where(User.id == user_id).values(shard=target)
+                             .returning(User.contacts_version)).scalar()
+        if locked is None:
+            old.rollback()
+            raise ValueError(f"user {user_id} has no row on shard {source}; was it moved meanwhile?")
+        new.begin()
+        _, copied = _copy_changes(old, new, user_id, since, batch_size, online=False)
+        stats["copied"] += copied
+        new.execute(update(User).where(User.id == user_id).values(contacts_version=locked, shard=target))
+        new.commit()
+        if source != 0 and target != 0:
+            with router.main.begin() as connection:
+                connection.execute(update(User).where(User.id == user_id).values(shard=target))
+        # Only now do new requests leave the old shard; its lock is released last.
+        old.commit()
+    logger.info("moved user %s from shard %s to shard %s", user_id, source, target)
+
+    with source_engine.connect() as connection:
+        for model in (Contact, ContactTombstone):
+            while True:
+                ids = select(model.id).where(model.user_id == user_id).limit(batch_size).scalar_subquery()
+                removed = connection.execute(delete(model).where(model.user_id == user_id, model.id.in_(ids))).rowcount
+                connection.commit()
+                stats["removed"] += removed
+                if removed < batch_size:
+                    break
+        if source != 0:
+            connection.execute(delete(User).where(User.id == user_id))
+            connection.commit()
+    return stats
+
+
+def pin_users(router: ShardRouter, batch_size: int = 1000) -> int:
+    """
+    Records the current shard of every user without a ``users.shard`` entry.
+
+    Run before changing ``settings.shard_urls`` or the mapping, so nobody is remapped.
+
+    :return: The number of users pinned.
+    :rtype: int
+    """
+    from database.models import User
+    pinned = 0
+    with Session(router.main) as db:
+        while True:
+            users = db.query(User).filter(User.shard.is_(None)).order_by(User.id).limit(batch_size).all()
+            for user in users:
+                user.shard = router.unpinned_shard(user.id)
+            db.commit()
+            pinned += len(users)
+            if len(users) < batch_size:
+                return pinned
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m database.shards", description="Manage contact shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    move = commands.add_parser("move", help="Move a user to another shard, online")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    move.add_argument("--batch-size", type=int, default=1000)
+    commands.add_parser("pin", help="Record the shard of every user that has none")
+    args = parser.parse_args(argv)
+
+    from database.db import shard_router
+    if args.command == "move":
+        print(move_user(shard_router, args.user_id, args.shard, args.batch_size))
+    else:
+        print(f"pinned {pin_users(shard_router)} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("database.slow_queries")
+
+# {"scope": ASGI scope, "user_id": int}, set per request by QueryContextMiddleware and get_current_user.
+query_context: ContextVar = ContextVar("query_context", default=None)
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)")
+_SPACES = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Normalizes a statement so repeated executions with different values compare equal.
+
+    :param statement: SQL as sent to the driver.
+    :type statement: str
+    :return: The statement with whitespace collapsed and IN lists reduced to one placeholder.
+    :rtype: str
+    """
+    return _IN_LIST.sub("(?)", _SPACES.sub(" ", statement).strip())
+
+
+def redact(parameters):
+    """
+    Replaces parameter values with their type names.
+
+    :param parameters: DBAPI parameters (sequence or mapping).
+    :return: The same shape with values redacted.
+    """
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return None if parameters is None else f"<{type(parameters).__name__}>"
+
+
+class QueryContextMiddleware:
+    """ASGI middleware that exposes the request to the slow-query log."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            query_context.set({"scope": scope})
+        await self.app(scope, receive, send)
+
+
+def set_query_user(user_id: int) -> None:
+    """
+    Attaches the authenticated user to the current request's slow-query entries.
+
+    :param user_id: The user id.
+    :type user_id: int
+    """
+    context = query_context.get()
+    if context is not None:
+        context["user_id"] = user_id
+
+
+def _request_info():
+    context = query_context.get()
+    if context is None:
+        return None, None
+    route = context["scope"].get("route")
+    return getattr(route, "path", context["scope"].get("path")), context.get("user_id")
+
+
+class SlowQueryLog:
+    """
+    Logs statements slower than ``threshold_ms`` and aggregates them by fingerprint.
+
+    On PostgreSQL the first occurrence of each fingerprint also gets an
+    ``EXPLAIN (ANALYZE off, FORMAT JSON)`` plan.
+    """
+
+    def __init__(self, threshold_ms: float, explain: bool = True):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def install(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    # The start time lives on the statement's execution context, which is dropped with
+    # the statement, so one that fails leaves nothing behind on the connection.
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_start = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_slow_query_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        if elapsed < self.threshold:
+            return
+        key = fingerprint(statement)
+        with self.lock:
+            entry = self.stats.get(key)
+            first = entry is None
+            if first:
+                entry = self.stats[key] = {"fingerprint": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "plan": None}
+            entry["count"] += 1
+            entry["total_ms"] += elapsed * 1000
+            entry["max_ms"] = max(entry["max_ms"], elapsed * 1000)
+        if first and self.explain and not executemany:
+            entry["plan"] = self._explain(conn, cursor, statement, parameters)
+        route, user_id = _request_info()
+        logger.warning("slow query %.1f ms", elapsed * 1000, extra={
+            "duration_ms": elapsed * 1000, "route": route, "user_id": user_id, "fingerprint": key,
+            "parameters": redact(parameters), "plan": entry["plan"] if first else None,
+        })
+
+    @staticmethod
+    def _explain(conn, cursor, statement, parameters):
+        if conn.dialect.name != "postgresql" or not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        explain_cursor = cursor.connection.cursor()
+        # A savepoint keeps a failed EXPLAIN from aborting the caller's transaction.
+        explain_cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            explain_cursor.execute("EXPLAIN (ANALYZE off, FORMAT JSON) " + statement, parameters)
+            plan = explain_cursor.fetchone()[0]
+            explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            return plan
+        except Exception:
+            explain_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            logger.debug("EXPLAIN failed for %s", statement, exc_info=True)
+            return None
+        finally:
+            explain_cursor.close()
+
+    def report(self) -> list:
+        """
+        :return: Aggregated entries, slowest total time first.
+        :rtype: list
+        """
+        with self.lock:
+            return sorted((dict(entry) for entry in self.stats.values()), key=lambda e: e["total_ms"], reverse=True)
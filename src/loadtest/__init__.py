@@ -0,0 +1,18 @@
+"""
+End-to-end load test for the contacts API.
+
+Seeds users and contacts, drives the ASGI app in process (or a running server
+with ``--url``) through httpx with a configurable number of concurrent clients,
+and prints RPS and p50/p95/p99 latency per route as JSON::
+
+    python -m loadtest --users 20 --contacts 200 --concurrency 50 --requests 5000 --output run.json
+
+Seeding needs an empty database; ``--reset`` drops and recreates every table of
+``--database-url`` first. With ``--url`` the data is seeded directly into
+``--database-url``, which must be the database the server uses, and the access
+tokens are signed with this process's ``SECRET_KEY``, which must match the server's.
+
+Redis is replaced by :class:`loadtest.local_redis.LocalRedis`, so the in-process
+mode needs no network services. SQLite is used unless ``--database-url`` points
+at a local Postgres.
+"""
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+from datetime import datetime
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description="Load test the contacts API.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--contacts", type=int, default=100, help="Contacts per user")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--database-url", default="sqlite:///./loadtest.db",
+                        help="Database to seed; with --url, the one that server uses")
+    parser.add_argument("--reset", action="store_true",
+                        help="Drop and recreate every table in --database-url before seeding")
+    parser.add_argument("--url", help="Run against a server at this URL instead of in process. It must share "
+                                      "--database-url and SECRET_KEY with this process, or the seeded tokens fail")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+async def main(args) -> dict:
+    # Settings are read on import, so the database URL must be in place first.
+    os.environ["SQLALCHEMY_DATABASE_URL"] = args.database_url
+    # Access and httpx request logs share stdout with the report.
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import httpx
+    from fastapi_limiter import FastAPILimiter
+
+    from database.db import SessionLocal
+    from loadtest.local_redis import LocalRedis
+    from loadtest.runner import run
+    from loadtest.seed import seed
+    from main import app
+
+    with SessionLocal() as db:
+        users = await seed(db, args.users, args.contacts, reset=args.reset)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url)
+    else:
+        await FastAPILimiter.init(LocalRedis())
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest")
+    async with client:
+        report = await run(client, users, args.concurrency, args.requests)
+
+    report["config"] = {"users": args.users, "contacts_per_user": args.contacts, "requests": args.requests,
+                        "database": args.database_url.split(":", 1)[0], "target": args.url or "in-process",
+                        "python": platform.python_version(), "started_at": datetime.now().isoformat()}
+    return report
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = json.dumps(asyncio.run(main(arguments)), indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            f.write(result)
+    else:
+        sys.stdout.write(result + "\n")
@@ -0,0 +1,52 @@
+import time
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the redis.asyncio client.
+
+    Implements the commands the app uses. ``evalsha`` always returns 0, so
+    FastAPILimiter never rejects a request. Otherwise the 10 requests per
+    minute limit on the contacts listing would cap the measured throughput.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key) -> bool:
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline < time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    async def get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if ex is not None:
+            await self.expire(key, ex)
+        return True
+
+    async def expire(self, key, seconds):
+        if not self._alive(key):
+            return False
+        self.expires[key] = time.monotonic() + seconds
+        return True
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def script_load(self, script):
+        return "local"
+
+    async def evalsha(self, sha, numkeys, *args):
+        return 0
+
+    async def aclose(self):
+        self.data.clear()
+
+    close = aclose
@@ -0,0 +1,133 @@
+import asyncio
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import date
+from itertools import count
+
+import httpx
+
+_new_contact_ids = count(1_000_000)
+
+
+def list_contacts(user, rng):
+    return "GET", "/api/contacts/", {"params": {"limit": 20, "skip": rng.randint(0, 5) * 20}}
+
+
+def search_contacts(user, rng):
+    return "GET", "/api/contacts/", {"params": {"last_name": rng.choice(["Wil", "Par", "Sta"]), "limit": 20}}
+
+
+def read_contact(user, rng):
+    return "GET", f"/api/contacts/{rng.choice(user.contact_ids)}", {}
+
+
+def upcoming_birthdays(user, rng):
+    return "GET", "/api/contacts/upcoming_birthdays/", {}
+
+
+def secret(user, rng):
+    return "GET", "/secret", {}
+
+
+def create_contact(user, rng):
+    n = next(_new_contact_ids)
+    body = {"id": n, "first_name": "Load", "last_name": f"Test{n}", "email": f"new{n}@example.com",
+            "phone_number": "+48500600700", "birth_date": date.today().isoformat()}
+    return "POST", "/api/contacts/", {"json": body}
+
+
+# (weight, route name, request builder)
+DEFAULT_SCENARIO = [
+    (40, "GET /api/contacts/", list_contacts),
+    (10, "GET /api/contacts/?last_name=", search_contacts),
+    (25, "GET /api/contacts/{contact_id}", read_contact),
+    (10, "GET /api/contacts/upcoming_birthdays/", upcoming_birthdays),
+    (10, "GET /secret", secret),
+    (5, "POST /api/contacts/", create_contact),
+]
+
+
+def percentile(samples: list, q: float) -> float:
+    """
+    Nearest-rank percentile of already sorted samples.
+
+    :param samples: Sorted latencies.
+    :type samples: list
+    :param q: Percentile between 0 and 100.
+    :type q: float
+    :return: The percentile value.
+    :rtype: float
+    """
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+async def run(client: httpx.AsyncClient, users: list, concurrency: int, total: int,
+              scenario: list = DEFAULT_SCENARIO, seed: int = 0) -> dict:
+    """
+    Sends ``total`` requests from ``concurrency`` concurrent clients and aggregates latencies.
+
+    :param client: HTTP client bound to the app or a server URL.
+    :type client: httpx.AsyncClient
+    :param users: Seeded users to authenticate as.
+    :type users: List[SeededUser]
+    :param concurrency: Number of concurrent clients.
+    :type concurrency: int
+    :param total: Total number of requests.
+    :type total: int
+    :param scenario: Weighted request builders.
+    :type scenario: list
+    :param seed: Random seed for the request mix.
+    :type seed: int
+    :return: Overall and per-route statistics.
+    :rtype: dict
+    """
+    weights = [weight for weight, _, _ in scenario]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    remaining = iter(range(total))
+
+    async def worker(number: int):
+        rng = random.Random(seed + number)
+        for _ in remaining:
+            _, name, build = rng.choices(scenario, weights)[0]
+            user = rng.choice(users)
+            method, path, kwargs = build(user, rng)
+            headers = {"Authorization": f"Bearer {user.token}"}
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, headers=headers, **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append(time.perf_counter() - started)
+            errors[name] += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    every = [latency for route in latencies.values() for latency in route]
+    return {
+        "concurrency": concurrency,
+        "elapsed_seconds": elapsed,
+        "total": summarize(every, sum(errors.values()), elapsed),
+        "routes": {name: summarize(latencies[name], errors[name], elapsed) for name in sorted(latencies)},
+    }
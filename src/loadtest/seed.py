@@ -0,0 +1,67 @@
+import random
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from sqlalchemy.orm import Session
+
+from database.models import Base, Contact, User
+from repository.auth import Hash, create_access_token
+
+FIRST_NAMES = ["Wade", "Peter", "Natasha", "Bruce", "Tony", "Steve", "Wanda", "Logan", "Jean", "Scott"]
+LAST_NAMES = ["Wilson", "Parker", "Romanoff", "Banner", "Stark", "Rogers", "Maximoff", "Howlett", "Grey", "Summers"]
+
+
+@dataclass
+class SeededUser:
+    id: int
+    email: str
+    token: str
+    contact_ids: list = field(default_factory=list)
+
+
+async def seed(db: Session, users: int, contacts_per_user: int, password: str = "loadtest",
+               reset: bool = False) -> list:
+    """
+    Fills an empty database with users and contacts, creating the tables it lacks.
+
+    :param db: The database session.
+    :type db: Session
+    :param users: Number of confirmed users to create.
+    :type users: int
+    :param contacts_per_user: Number of contacts per user.
+    :type contacts_per_user: int
+    :param password: Password for every seeded user.
+    :type password: str
+    :param reset: Drop and recreate every table first, deleting whatever is there.
+    :type reset: bool
+    :return: The seeded users with access tokens and contact ids.
+    :rtype: List[SeededUser]
+    :raises RuntimeError: The database already has users and ``reset`` is not set.
+    """
+    bind = db.get_bind()
+    if reset:
+        Base.metadata.drop_all(bind=bind)
+    Base.metadata.create_all(bind=bind)
+    if db.query(User.id).first() is not None:
+        raise RuntimeError(f"{bind.url!r} already has users; seed an empty database or pass --reset to wipe it")
+    rng = random.Random(0)
+    hashed = Hash().get_password_hash(password)
+    today = date.today()
+
+    seeded = []
+    for n in range(users):
+        user = User(username=f"loaduser{n}", email=f"loaduser{n}@example.com", password=hashed, confirmed=True)
+        db.add(user)
+        db.flush()
+        contacts = [
+            Contact(first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                    email=f"contact{i}.user{n}@example.com", phone_number=f"+48{rng.randint(100000000, 999999999)}",
+                    birth_date=today + timedelta(days=rng.randint(-300, 60)), user_id=user.id)
+            for i in range(contacts_per_user)
+        ]
+        db.add_all(contacts)
+        db.flush()
+        token = await create_access_token(data={"sub": user.email}, expires_delta=24 * 3600)
+        seeded.append(SeededUser(user.id, user.email, token, [contact.id for contact in contacts]))
+    db.commit()
+    return seeded
@@ -1,19 +1,28 @@
 import re
 from typing import Callable
-import redis.asyncio as redis
 import uvicorn
 from fastapi import FastAPI, Depends, HTTPException, status, Security, Request
 from fastapi_limiter import FastAPILimiter
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from routes import contacts, auth
+from routes import contacts, auth, avatars, batch
+from routes.batch import batchable
 from repository.auth import create_access_token, create_refresh_token, get_email_form_refresh_token, get_current_user, Hash
-from database.db import get_db
-from database.models import User
+from database.db import LastWriteMiddleware, get_db, engine, shard_router, slow_query_log
+from database.shards import UserMoved
+from database.models import User, init_schema
+from database.slow_queries import QueryContextMiddleware
 from conf.config import settings
+from services.auth import close_redis
+from services.avatars import close_thumbnail_pool
+from services.changes import change_feed
+from services.compression import CompressionMiddleware, compression_stats
+from services.profiling import profiling_enabled, profile_request
+from services.log import RequestLogMiddleware, setup_logging
 from ipaddress import ip_address
 from typing import Callable
 import os, sys
@@ -22,6 +31,7 @@ import logging
 
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+setup_logging()
 
 app = FastAPI()
 user_agent_ban_list = [r"Gecko", r"Python-urllib"]
@@ -39,8 +49,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(LastWriteMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(QueryContextMiddleware)
+app.add_middleware(RequestLogMiddleware)
+
 app.include_router(contacts.router, prefix='/api')
 app.include_router(auth.router, prefix='/api/auth')
+app.include_router(avatars.router, prefix='/api')
+app.include_router(batch.router, prefix='/api')
 
 banned_ips = []
 
@@ -54,7 +71,8 @@ async def signup(body: UserModel, db: Session = Depends(get_db)):
     exist_user = db.query(User).filter(User.email == body.username).first()
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    new_user = User(email=body.username, password=hash_handler.get_password_hash(body.password))
+    # bcrypt takes tens of milliseconds of CPU; keep it off the event loop.
+    new_user = User(email=body.username, password=await run_in_threadpool(hash_handler.get_password_hash, body.password))
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
@@ -65,7 +83,7 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
     user = db.query(User).filter(User.email == body.username).first()
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
-    if not hash_handler.verify_password(body.password, user.password):
+    if not await run_in_threadpool(hash_handler.verify_password, body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
 # Generate JWT
     access_token = await create_access_token(data={"sub": user.email})
@@ -95,32 +113,77 @@ async def root():
     return {"message": "Hello World"}
 
 @app.get("/secret")
+@batchable
 async def read_item(current_user: User = Depends(get_current_user)):
     return {"message": 'secret router', "owner": current_user.email}
 
 @app.on_event("startup")
 async def startup():
+    for bind in shard_router.engines:
+        init_schema(bind)
+    import redis.asyncio as redis
     r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
                           decode_responses=True)
     await FastAPILimiter.init(r)
+    await change_feed.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Runs after uvicorn has drained in-flight requests.
+    if FastAPILimiter.redis is not None:
+        await FastAPILimiter.close()
+    await change_feed.stop()
+    await close_redis()
+    close_thumbnail_pool()
+    engine.dispose()
+    shard_router.dispose()
+    for entry in slow_query_log.report()[:10]:
+        logger.info(f"slow query x{entry['count']} total {entry['total_ms']:.0f} ms: {entry['fingerprint']}")
+    for entry in compression_stats.report()[:10]:
+        logger.info(f"compression {entry['route']} x{entry['count']} ratio {entry['ratio']:.1f} "
+                    f"cpu {entry['cpu_ms']:.0f} ms")
+
+
+@app.exception_handler(UserMoved)
+async def user_moved(request: Request, exc: UserMoved):
+    # The move finished while the request was in flight; the retry is routed to the new shard.
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"},
+                        content={"detail": "Your contacts were just moved, please retry"})
+
+class BanMiddleware:
+    """
+    Refuses banned client IPs and user agents.
+
+    Pure ASGI rather than ``@app.middleware("http")``: that wraps every response, change
+    streams included, in a task group and a memory stream of its own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            request = Request(scope)
+            if ban_ips(request) or user_agent_banned(request):
+                response = JSONResponse(status_code=status.HTTP_403_FORBIDDEN, content={"detail": "You are banned"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+def ban_ips(request: Request) -> bool:
+    ip = ip_address(request.client.host)
+    return ip in banned_ips
 
+def user_agent_banned(request: Request) -> bool:
+    user_agent = request.headers.get("user-agent", "")
+    return any(re.search(ban_pattern, user_agent) for ban_pattern in user_agent_ban_list)
 
-@app.middleware("http")
-async def ban_ips(request: Request, call_next: Callable):
-    ip = ip_address(request.client.host)
-    if ip in banned_ips:
-        return JSONResponse(status_code=status.HTTP_403_FORBIDDEN, content={"detail": "You are banned"})
-    response = await call_next(request)
-    return response
-
-@app.middleware("http")
-async def user_agent_ban_middleware(request: Request, call_next: Callable):
-    user_agent = request.headers.get("user-agent")
-    for ban_pattern in user_agent_ban_list:
-        if re.search(ban_pattern, user_agent):
-            return JSONResponse(status_code=status.HTTP_403_FORBIDDEN, content={"detail": "You are banned"})
-    response = await call_next(request)
-    return response
+app.add_middleware(BanMiddleware)
+
+# Added last so it wraps the whole stack; not installed at all unless configured.
+if profiling_enabled():
+    app.middleware("http")(profile_request)
 
 @app.get("/")
 def read_root():
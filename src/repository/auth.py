@@ -1,18 +1,21 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import Depends, HTTPException
-from passlib.context import CryptContext
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
 from starlette import status
 
-from database.db import get_db
+from database.db import get_read_db
 from database.models import User
+from database.shards import route_session
+from database.slow_queries import set_query_user
+from services.auth import get_pwd_context
 
 class Hash:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    @property
+    def pwd_context(self):
+        return get_pwd_context()
 
     def verify_password(self, plain_password, hashed_password):
         """
@@ -55,6 +58,7 @@ async def create_access_token(data: dict, expires_delta: Optional[float] = None)
     :return: A function that generates a new "access_token" with a specified validity period.
     :rtype: str
     """
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + timedelta(seconds=expires_delta)
@@ -76,6 +80,7 @@ async def create_refresh_token(data: dict, expires_delta: Optional[float] = None
     :return: Information is added to the dictionary about when the token was created (iat), when it expired (exp), and that it is a refresh token (scope).
     :rtype: str
     """
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + timedelta(seconds=expires_delta)
@@ -94,6 +99,7 @@ async def get_email_form_refresh_token(refresh_token: str):
     :return: The function is used to extract the user's email address. If the token is successfully decoded and has a valid scope, the function returns the user's email.
     :rtype: str
     """
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
         if payload['scope'] == 'refresh_token':
@@ -103,7 +109,7 @@ async def get_email_form_refresh_token(refresh_token: str):
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db), request: Request = None):
     """
     User authentication based on their access token.
     
@@ -111,9 +117,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     :type token: str
     :param db: The database session.
     :type db: Session
+    :param request: The incoming request; sub-requests of a batch reuse the batch's user.
+    :type request: Request
     :return: The user authentication function extracts the email address and uses it to query the database for user information.
     :rtype: HTTP
     """
+    if request is not None and "batch" in request.scope:
+        return request.scope["batch"]["user"]
+    from jose import JWTError, jwt
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -135,4 +146,6 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user: User = db.query(User).filter(User.email == email).first()
     if user is None:
         raise credentials_exception
+    set_query_user(user.id)
+    route_session(db, user)
     return user
@@ -1,14 +1,47 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from datetime import datetime, timedelta
+from sqlalchemy import Float, and_, or_, case, func, literal, insert, select, type_coerce, update
+from sqlalchemy.dialects.postgresql import JSONB
+from datetime import date, datetime, timedelta
 from database.models import User
-from database.models import Contact
+from database.models import Contact, ContactTombstone, birthday_key
+from database.shards import UserMoved, home_guard, home_shard, next_contact_id, session_shard, shard_sessions
 from schemas import ContactCreate, UserModel
 from typing import List
+from conf.config import settings
+from services.duplicates import normalize_phone
+from services.changes import record_change
+from services.suggest import PrefixIndex, suggest_indexes
 
 
 
 
+def next_version(db: Session, user_id: int) -> int:
+    """
+    Allocates the next change version for a user's contacts.
+
+    The UPDATE locks the user's row until the transaction ends. That serializes the
+    user's writes, so versions become visible in the order they were handed out, and
+    a client that has seen version N can never miss a change numbered N or lower.
+
+    :param db: The database session.
+    :type db: Session
+    :param user_id: The owner of the contacts being changed.
+    :type user_id: int
+    :return: The new version.
+    :rtype: int
+    :raises UserMoved: If the user was moved to another shard since the session was routed.
+    """
+    statement = update(User).where(User.id == user_id).values(contacts_version=User.contacts_version + 1) \
+        .returning(User.contacts_version).execution_options(synchronize_session=False)
+    guard = home_guard(db, user_id)
+    if guard is None:
+        return db.execute(statement).scalar_one()
+    # With shards, the counter lives on the user's row next to their contacts.
+    version = db.execute(statement.where(guard), bind_arguments={"home": True}).scalar()
+    if version is None:
+        raise UserMoved(user_id)
+    return version
+
 async def get_contact(db: Session, user: User, contact_id: int) -> Contact:
     """
     Retrieves a single contact with the specified ID for a specific user.
@@ -22,7 +55,7 @@ async def get_contact(db: Session, user: User, contact_id: int) -> Contact:
     :return: The contact with the specified ID, or None if it does not exist.
     :rtype: Contact | None
     """
-    return db.query(Contact).filter(and_(ContactCreate.id == contact_id, Contact.user_id == user.id)).first()
+    return db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
 
 async def get_contacts(db: Session, user: User, search_query: str = None) -> List[Contact]:
     """
@@ -47,6 +80,64 @@ async def get_contacts(db: Session, user: User, search_query: str = None) -> Lis
         query = query.filter(search_filter)    
     return query.all()
 
+async def list_contacts(db: Session, user: User, skip: int = 0, limit: int = 100, first_name: str = None,
+                        last_name: str = None, email: str = None, extra: dict = None) -> List[Contact]:
+    """
+    Retrieves a page of contacts for a specific user, ordered by name.
+
+    The ordering matches the ``ix_contacts_user_name`` index, so the database walks
+    the index for the user instead of sorting the whole address book.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The user to retrieve contacts for.
+    :type user: User
+    :param skip: The number of contacts to skip.
+    :type skip: int
+    :param limit: The maximum number of contacts to return.
+    :type limit: int
+    :param first_name: Filter by first name.
+    :type first_name: str
+    :param last_name: Filter by last name.
+    :type last_name: str
+    :param email: Filter by email.
+    :type email: str
+    :param extra: Filter by ``extra_data`` fields: a (possibly nested) document that ``extra_data`` must contain.
+    :type extra: dict
+    :return: A list of contacts.
+    :rtype: List[Contact]
+    """
+    query = db.query(Contact).filter(Contact.user_id == user.id)
+    if extra:
+        query = query.filter(extra_data_contains(db, extra))
+    if first_name:
+        query = query.filter(Contact.first_name.contains(first_name))
+    if last_name:
+        query = query.filter(Contact.last_name.contains(last_name))
+    if email:
+        query = query.filter(Contact.email.contains(email))
+    query = query.order_by(Contact.last_name, Contact.first_name, Contact.id)
+    return query.offset(skip).limit(limit).all()
+
+def extra_data_contains(db: Session, document: dict):
+    """
+    Filter for contacts whose ``extra_data`` contains ``document``.
+
+    On Postgres this is ``extra_data @> document``, which the GIN index serves. Elsewhere
+    each leaf of the document is compared through ``json_extract()``.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return type_coerce(Contact.extra_data, JSONB).contains(document)
+
+    def leaves(value, path):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from leaves(item, f'{path}."{key}"')
+        else:
+            yield path, value
+
+    return and_(*(func.json_extract(Contact.extra_data, path) == value for path, value in leaves(document, "$")))
+
 async def create_contact(db: Session, contact: ContactCreate, user: User) -> Contact:
     """
     Creates a new note for a specific user.
@@ -60,10 +151,13 @@ async def create_contact(db: Session, contact: ContactCreate, user: User) -> Con
     :return: The newly created contact.
     :rtype: Contact
     """
-    db_contact = Contact(first_name=contact.first_name, last_name=contact.last_name, email=contact.email, phone_number=contact.phone_number, birth_date=contact.birth_date, user=user)
+    db_contact = Contact(id=next_contact_id(db), first_name=contact.first_name, last_name=contact.last_name, email=contact.email, phone_number=contact.phone_number, birth_date=contact.birth_date, extra_data=contact.additional_info, user_id=user.id)
+    db_contact.version = next_version(db, user.id)
     db.add(db_contact)
+    record_change(db, user.id, db_contact, "created")
     db.commit()
     db.refresh(db_contact)
+    suggest_indexes.contact_saved(db_contact)
     return db_contact
 
 async def update_contact(db: Session, user: User, contact_id: int, contact: ContactCreate) -> Contact | None:
@@ -81,13 +175,17 @@ async def update_contact(db: Session, user: User, contact_id: int, contact: Cont
     :return: The updated contact, or None if it does not exist.
     :rtype: Contact | None
     """
-    db_contact = await get_contact(db, contact_id, user)
+    db_contact = await get_contact(db, user, contact_id)
     if not db_contact:
         return None
-    for key, value in contact.dict().items():
+    # The body's id is ignored, as in create_contact: the path names the contact.
+    for key, value in contact.model_dump(exclude={"id"}).items():
         setattr(db_contact, key, value)
+    db_contact.version = next_version(db, user.id)
+    record_change(db, user.id, contact_id, "updated")
     db.commit()
     db.refresh(db_contact)
+    suggest_indexes.contact_saved(db_contact)
     return db_contact
 
 async def delete_contact(db: Session, user: User, contact_id: int) -> Contact | None:
@@ -103,13 +201,41 @@ async def delete_contact(db: Session, user: User, contact_id: int) -> Contact |
     :return: The removed contact, or None if it does not exist.
     :rtype: Contact | None
     """
-    db_contact = await get_contact(db, contact_id, user)
+    db_contact = await get_contact(db, user, contact_id)
     if not db_contact:
         return None
     db.delete(db_contact)
+    db.add(ContactTombstone(contact_id=contact_id, user_id=user.id, version=next_version(db, user.id)))
+    record_change(db, user.id, contact_id, "deleted")
     db.commit()
+    suggest_indexes.contact_deleted(db_contact.user_id, contact_id)
     return {"message": "Contact deleted successfully"}
 
+async def update_contact_avatar(db: Session, user: User, contact_id: int, avatar: str, avatar_thumbnail: str | None) -> bool:
+    """
+    Points a contact at a newly stored avatar.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The owner of the contact.
+    :type user: User
+    :param contact_id: The ID of the contact to update.
+    :type contact_id: int
+    :param avatar: URL of the stored image.
+    :type avatar: str
+    :param avatar_thumbnail: URL of its thumbnail, if one was made.
+    :type avatar_thumbnail: str | None
+    :return: False if the contact does not exist.
+    :rtype: bool
+    """
+    updated = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)) \
+        .update({Contact.avatar: avatar, Contact.avatar_thumbnail: avatar_thumbnail, Contact.updated_at: datetime.utcnow(),
+                 Contact.version: next_version(db, user.id)}, synchronize_session=False)
+    if updated:
+        record_change(db, user.id, contact_id, "updated")
+    db.commit()
+    return updated > 0
+
 async def get_contacts_upcoming_birthdays(db: Session) -> Contact | None:
     """
     List of contacts with upcoming birthdays
@@ -121,7 +247,293 @@ async def get_contacts_upcoming_birthdays(db: Session) -> Contact | None:
     """    
     today = datetime.today().date()
     end_date = today + timedelta(days=7)
-    return db.query(Contact).filter(
-        (Contact.birth_date >= today) & (Contact.birth_date <= end_date)
-    ).all()
+    # Keyed by id: while a user is being moved, their contacts are on two shards.
+    contacts = {}
+    with shard_sessions(db) as sessions:
+        for session in sessions.values():
+            for contact in session.query(Contact).filter(
+                (Contact.birth_date >= today) & (Contact.birth_date <= end_date)
+            ):
+                contacts.setdefault(contact.id, contact)
+    return list(contacts.values())
+
+
+async def get_contacts_by_phone(db: Session, user: User, number: str) -> List[Contact] | None:
+    """
+    Reverse phone lookup: the user's contacts with this number, however it was written.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The user to search contacts for.
+    :type user: User
+    :param number: The phone number in any common notation.
+    :type number: str
+    :return: Matching contacts, or None if the number cannot be normalized.
+    :rtype: List[Contact] | None
+    """
+    phone_e164 = normalize_phone(number)
+    if phone_e164 is None:
+        return None
+    return db.query(Contact).filter(Contact.user_id == user.id, Contact.phone_e164 == phone_e164).all()
+
+async def search_contacts(db: Session, user: User, query: str, limit: int = 10) -> List[Contact]:
+    """
+    Typo-tolerant search over first name, last name and email, best match first.
+
+    Candidates come from a nearest-neighbour scan of the trigram index on
+    ``(user_id, search_text)``, ``settings.search_candidates`` per requested result.
+    They are then ranked by trigram word similarity, boosted when a name or the email
+    starts with the query.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The user to search contacts for.
+    :type user: User
+    :param query: The search text, e.g. "Jonh Smiht".
+    :type query: str
+    :param limit: The maximum number of contacts to return.
+    :type limit: int
+    :return: Matching contacts ordered by rank.
+    :rtype: List[Contact]
+    """
+    query = query.strip().lower()
+    if not query:
+        return []
+    similarity = func.word_similarity(query, Contact.search_text)
+    if db.get_bind().dialect.name == "postgresql":
+        # <<-> is pg_trgm's word-similarity distance; the GiST index can return rows in its order.
+        distance = literal(query).op("<<->", return_type=Float)(Contact.search_text)
+    else:
+        distance = 1 - similarity
+    candidates = (select(Contact.id).where(Contact.user_id == user.id)
+                  .order_by(distance).limit(limit * settings.search_candidates).subquery())
+
+    prefix = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    boosts = [(Contact.first_name, 0.3), (Contact.last_name, 0.3), (Contact.email, 0.2)]
+    starts = [func.lower(column).like(prefix, escape="\\") for column, _ in boosts]
+    rank = similarity + sum(case((start, boost), else_=0.0) for start, (_, boost) in zip(starts, boosts))
+    return (db.query(Contact).join(candidates, candidates.c.id == Contact.id)
+            .filter(Contact.user_id == user.id, or_(similarity >= settings.search_similarity_threshold, *starts))
+            .order_by(rank.desc(), Contact.id)
+            .limit(limit).all())
+
+async def suggest_contacts(db: Session, user: User, prefix: str, limit: int = 10) -> List[dict]:
+    """
+    Type-ahead: contacts whose first name, last name, full name or email starts with ``prefix``.
 
+    The user's prefix index is loaded with one query on first use and then kept up to
+    date by the write functions in this module.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The user to suggest contacts for.
+    :type user: User
+    :param prefix: What has been typed so far.
+    :type prefix: str
+    :param limit: The maximum number of suggestions.
+    :type limit: int
+    :return: Suggestions with ``id``, ``first_name``, ``last_name`` and ``email``.
+    :rtype: List[dict]
+    """
+    index = suggest_indexes.get(user.id)
+    if index is None:
+        rows = (db.query(Contact.id, Contact.first_name, Contact.last_name, Contact.email)
+                .filter(Contact.user_id == user.id).all())
+        index = PrefixIndex(rows)
+        suggest_indexes.put(user.id, index)
+    return index.search(prefix, limit)
+
+async def get_duplicate_candidates(db: Session, user: User) -> list:
+    """
+    The fields duplicate detection compares, for all of a user's contacts.
+
+    Selecting columns instead of entities keeps 100k contacts out of the identity map.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The user whose contacts to load.
+    :type user: User
+    :return: Rows with ``id``, ``first_name``, ``last_name``, ``email``, ``phone_number`` and ``birth_date``.
+    :rtype: List[Row]
+    """
+    return (db.query(Contact.id, Contact.first_name, Contact.last_name, Contact.email, Contact.phone_number,
+                     Contact.birth_date)
+            .filter(Contact.user_id == user.id).all())
+
+async def merge_contacts(db: Session, user: User, primary_id: int, duplicate_ids: List[int]) -> Contact | None:
+    """
+    Collapses duplicates into one contact in a single transaction.
+
+    The primary contact keeps its own values; fields it lacks are taken from the
+    duplicates in the order given, and their ``extra_data`` keys are added to its own.
+    The duplicates are then deleted.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The owner of the contacts.
+    :type user: User
+    :param primary_id: The ID of the contact to keep.
+    :type primary_id: int
+    :param duplicate_ids: The IDs of the contacts merged into it.
+    :type duplicate_ids: List[int]
+    :return: The merged contact, or None if any of the contacts does not exist.
+    :rtype: Contact | None
+    """
+    duplicate_ids = [contact_id for contact_id in dict.fromkeys(duplicate_ids) if contact_id != primary_id]
+    contacts = {contact.id: contact for contact in
+                db.query(Contact).filter(Contact.user_id == user.id, Contact.id.in_([primary_id, *duplicate_ids]))}
+    if len(contacts) != len(duplicate_ids) + 1:
+        return None
+    primary = contacts[primary_id]
+    primary.version = version = next_version(db, user.id)
+    merged = {}
+    for contact_id in duplicate_ids:
+        duplicate = contacts[contact_id]
+        for column in ("first_name", "last_name", "email", "phone_number", "birth_date"):
+            if not getattr(primary, column) and not merged.get(column) and getattr(duplicate, column):
+                merged[column] = getattr(duplicate, column)
+        if duplicate.extra_data:
+            merged["extra_data"] = {**duplicate.extra_data, **merged.get("extra_data", {}), **(primary.extra_data or {})}
+        db.delete(duplicate)
+        record_change(db, user.id, contact_id, "deleted")
+    record_change(db, user.id, primary_id, "updated")
+    # One multi-row INSERT for all the tombstones.
+    db.execute(insert(ContactTombstone), [{"contact_id": contact_id, "user_id": user.id, "version": version}
+                                          for contact_id in duplicate_ids])
+    try:
+        # Deletes go first, so taking over a duplicate's email does not hit the per-user unique index.
+        db.flush()
+        for column, value in merged.items():
+            setattr(primary, column, value)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(primary)
+    for contact_id in duplicate_ids:
+        suggest_indexes.contact_deleted(primary.user_id, contact_id)
+    suggest_indexes.contact_saved(primary)
+    return primary
+
+async def get_changes(db: Session, user: User, since: int | None) -> tuple:
+    """
+    Contacts changed and deleted after version ``since``.
+
+    :param db: The database session.
+    :type db: Session
+    :param user: The owner of the contacts.
+    :type user: User
+    :param since: The version the client has; None for a full download.
+    :type since: int | None
+    :return: The changed contacts in version order and the ids of deleted contacts.
+    :rtype: tuple
+    """
+    changed = db.query(Contact).filter(Contact.user_id == user.id)
+    if since is None:
+        return changed.order_by(Contact.id).all(), []
+    changed = changed.filter(Contact.version > since).order_by(Contact.version, Contact.id).all()
+    deleted = db.execute(select(ContactTombstone.contact_id).where(ContactTombstone.user_id == user.id,
+                                                                    ContactTombstone.version > since)).scalars()
+    # SQLite may reuse the id of a deleted contact; a live row supersedes its tombstone.
+    live = {contact.id for contact in changed}
+    return changed, sorted(set(deleted) - live)
+
+async def get_contacts_version(db: Session, user: User) -> int:
+    """
+    The last change version of the user's contacts.
+
+    :param db: The database session, routed to the user's shard if sharding is on.
+    :type db: Session
+    :param user: The owner of the contacts.
+    :type user: User
+    :return: The version, as read from the database holding the contacts.
+    :rtype: int
+    """
+    if not session_shard(db):
+        return user.contacts_version
+    return db.execute(select(User.contacts_version).where(User.id == user.id),
+                      bind_arguments={"home": True}).scalar_one()
+
+async def purge_tombstones(db: Session, before: datetime) -> int:
+    """
+    Removes tombstones older than ``before`` on every shard. Sync tokens issued before then must not be accepted.
+
+    :param db: The database session.
+    :type db: Session
+    :param before: Cut-off time.
+    :type before: datetime
+    :return: The number of tombstones removed.
+    :rtype: int
+    """
+    purged = 0
+    with shard_sessions(db) as sessions:
+        for session in sessions.values():
+            purged += session.query(ContactTombstone).filter(ContactTombstone.deleted_at < before).delete(
+                synchronize_session=False)
+            session.commit()
+    return purged
+
+def birthday_window(today: date, days: int) -> dict:
+    """
+    The birthdays falling within ``days`` days from ``today``, in calendar order.
+
+    February 29 birthdays are celebrated on February 28 in non-leap years.
+
+    :param today: The first day of the window.
+    :type today: date
+    :param days: Number of days after ``today`` included in the window.
+    :type days: int
+    :return: MMDD keys, as stored in ``Contact.birth_mmdd``, mapped to the date they are celebrated.
+    :rtype: Dict[int, date]
+    """
+    window = {}
+    for offset in range(days + 1):
+        day = today + timedelta(days=offset)
+        window[birthday_key(day)] = day
+        if (day.month, day.day) == (2, 28) and (day + timedelta(days=1)).month == 3:
+            window[229] = day
+    return window
+
+
+async def get_birthdays_by_owner(db: Session, after_user_id: int, window, limit: int) -> list:
+    """
+    One chunk of the daily birthday scan: the next ``limit`` confirmed users after ``after_user_id``
+    joined to their contacts whose birthday is in ``window``.
+
+    A user without matching contacts still yields one row with ``None`` as the contact,
+    so the caller always knows how far the chunk reached.
+
+    :param db: The database session.
+    :type db: Session
+    :param after_user_id: Keyset position; only users with a greater id are returned.
+    :type after_user_id: int
+    :param window: MMDD keys, e.g. from :func:`birthday_window`.
+    :type window: Iterable[int]
+    :param limit: Number of users in the chunk.
+    :type limit: int
+    :return: ``(user_id, email, username, contact)`` rows ordered by user id.
+    :rtype: List[Row]
+    """
+    with shard_sessions(db) as sessions:
+        if len(sessions) == 1:
+            users = (db.query(User.id, User.email, User.username)
+                     .filter(User.id > after_user_id, User.confirmed.is_(True))
+                     .order_by(User.id).limit(limit).subquery())
+            return (db.query(users.c.id, users.c.email, users.c.username, Contact)
+                    .outerjoin(Contact, and_(Contact.user_id == users.c.id, Contact.birth_mmdd.in_(list(window))))
+                    .order_by(users.c.id)
+                    .all())
+        # Users and contacts are in different databases: one query per shard for the chunk's owners there.
+        users = (db.query(User.id, User.email, User.username, User.shard)
+                 .filter(User.id > after_user_id, User.confirmed.is_(True))
+                 .order_by(User.id).limit(limit).all())
+        owners = {}
+        for user in users:
+            owners.setdefault(home_shard(db, user), []).append(user.id)
+        contacts = {}
+        for shard, user_ids in owners.items():
+            for contact in sessions[shard].query(Contact).filter(Contact.user_id.in_(user_ids),
+                                                                 Contact.birth_mmdd.in_(list(window))):
+                contacts.setdefault(contact.user_id, []).append(contact)
+    return [(user.id, user.email, user.username, contact)
+            for user in users for contact in contacts.get(user.id, [None])]
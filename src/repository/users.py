@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 
 from database.models import User
+from database.shards import place_user
 from schemas import UserModel
 
 async def get_user_by_email(email: str, db: Session) -> User:
@@ -29,6 +30,8 @@ async def create_user(body: UserModel, db: Session) -> User:
     """
     new_user = User(**body.dict())
     db.add(new_user)
+    db.flush()
+    place_user(db, new_user)
     db.commit()
     db.refresh(new_user)
     return new_user
@@ -62,4 +65,23 @@ async def confirmed_email(email: str, db: Session) -> None:
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
\ No newline at end of file
+    db.commit()
+
+async def update_avatar(email: str, avatar: str, avatar_thumbnail: str | None, db: Session) -> None:
+    """
+    Points a user at a newly stored avatar.
+
+    :param email: User email.
+    :type email: str
+    :param avatar: URL of the stored image.
+    :type avatar: str
+    :param avatar_thumbnail: URL of its thumbnail, if one was made.
+    :type avatar_thumbnail: str | None
+    :param db: The database session.
+    :type db: Session
+    :return: Sets the user's avatar fields in a single UPDATE.
+    :rtype: None
+    """
+    db.query(User).filter(User.email == email).update({User.avatar: avatar, User.avatar_thumbnail: avatar_thumbnail},
+                                                      synchronize_session=False)
+    db.commit()
@@ -0,0 +1,57 @@
+import re
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session, object_session
+
+from database.db import get_db
+from database.models import User
+from repository import auth
+from repository import users as repository_users
+from repository.contacts import get_contact, update_contact_avatar
+from schemas import AvatarResponse
+from services.avatars import store_avatar
+from services.storage import get_storage
+
+router = APIRouter()
+
+AVATAR_NAME = re.compile(r"^[0-9a-f]{64}(_[0-9]+)?\.(png|jpg|gif|webp)$")
+# Names are content hashes, so a URL never points at different bytes.
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def release_connections(db: Session, user: User):
+    # Uploads can be slow; nothing should hold a pooled connection while the body streams in.
+    object_session(user).close()
+    db.close()
+
+
+@router.put("/contacts/{contact_id}/avatar", response_model=AvatarResponse,
+            description="Upload the contact's avatar as multipart/form-data with one file field.")
+async def upload_contact_avatar(contact_id: int, request: Request, db: Session = Depends(get_db),
+                                current_user: User = Depends(auth.get_current_user)):
+    if await get_contact(db, current_user, contact_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+    release_connections(db, current_user)
+    stored = await store_avatar(request)
+    if not await update_contact_avatar(db, current_user, contact_id, stored["avatar"], stored["avatar_thumbnail"]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+    return stored
+
+
+@router.put("/users/me/avatar", response_model=AvatarResponse,
+            description="Upload your avatar as multipart/form-data with one file field.")
+async def upload_user_avatar(request: Request, db: Session = Depends(get_db),
+                             current_user: User = Depends(auth.get_current_user)):
+    release_connections(db, current_user)
+    stored = await store_avatar(request)
+    await repository_users.update_avatar(current_user.email, stored["avatar"], stored["avatar_thumbnail"], db)
+    return stored
+
+
+@router.get("/avatars/{name}", response_class=FileResponse)
+async def read_avatar(name: str):
+    path = get_storage().path(f"avatars/{name}")
+    if not AVATAR_NAME.match(name) or not path.is_file():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    return FileResponse(path, headers={"Cache-Control": IMMUTABLE})
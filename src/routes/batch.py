@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+from typing import List
+from urllib.parse import urlsplit
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.routing import Match
+
+from conf.config import settings
+from database.db import get_read_db
+from database.models import User
+from repository import auth
+from schemas import BatchItem, BatchItemResponse, BatchRequest
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Describe the batch request's own body, not the sub-request's.
+_BODY_HEADERS = (b"content-length", b"content-type")
+
+
+def batchable(endpoint):
+    """
+    Marks a route as safe to run inside ``POST /api/batch``.
+
+    Only routes that read through the session ``get_read_db`` hands out and return a
+    complete response qualify: the batch shares one, possibly replica, session between
+    its sub-requests and waits for every body to finish. ``get_db`` refuses the batch
+    session to anything else.
+    """
+    endpoint.batchable = True
+    return endpoint
+
+
+def _endpoint(request: Request, scope: dict):
+    for route in request.app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "endpoint", None)
+    return None
+
+
+async def dispatch(request: Request, item: BatchItem, batch: dict) -> dict:
+    """
+    Runs one sub-request against the app's router and captures its response.
+
+    Middleware, authentication and session setup are skipped: the sub-request runs
+    with the batch's user and session, which ``get_current_user`` and ``get_db``
+    pick up from ``scope["batch"]``.
+
+    :param request: The batch request.
+    :type request: Request
+    :param item: The sub-request.
+    :type item: BatchItem
+    :param batch: ``{"session": Session, "user": User}`` shared by all sub-requests.
+    :type batch: dict
+    :return: The sub-request's status, headers and decoded body.
+    :rtype: dict
+    """
+    url = urlsplit(item.url)
+    scope = {key: value for key, value in request.scope.items() if key not in ("route", "endpoint", "path_params")}
+    scope.update(method=item.method, path=url.path, raw_path=url.path.encode(), query_string=url.query.encode(),
+                 headers=[(k, v) for k, v in request.scope["headers"] if k not in _BODY_HEADERS], batch=batch)
+    endpoint = _endpoint(request, scope)
+    if endpoint is not None and not getattr(endpoint, "batchable", False):
+        return {"status": status.HTTP_400_BAD_REQUEST, "headers": {},
+                "body": {"detail": f"{url.path} cannot be part of a batch"}}
+    received = False
+    response = {"status": 500, "headers": [], "body": []}
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # There is no connection behind a sub-request to keep open.
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    try:
+        await asyncio.wait_for(request.app.router(scope, receive, send), settings.batch_item_timeout)
+    except asyncio.TimeoutError:
+        logger.warning("batch sub-request %s %s timed out", item.method, item.url)
+        return {"status": status.HTTP_504_GATEWAY_TIMEOUT, "headers": {}, "body": {"detail": "Request timed out"}}
+    except StarletteHTTPException as exc:
+        # Raised by the router itself for unknown paths and methods.
+        return {"status": exc.status_code, "headers": dict(exc.headers or {}), "body": {"detail": exc.detail}}
+    except Exception:
+        logger.exception("batch sub-request %s %s failed", item.method, item.url)
+        return {"status": 500, "headers": {}, "body": {"detail": "Internal Server Error"}}
+
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in response["headers"] if k != b"content-length"}
+    body = b"".join(response["body"])
+    if not body:
+        body = None
+    elif headers.get("content-type", "").startswith("application/json"):
+        body = json.loads(body)
+    else:
+        body = body.decode("utf-8", errors="replace")
+    return {"status": response["status"], "headers": headers, "body": body}
+
+
+@router.post("/batch", response_model=List[BatchItemResponse],
+             description="Run several GET requests in one round trip. Results come back in request order; "
+                         "each has the status, headers and body the request would have had on its own.")
+async def run_batch(body: BatchRequest, request: Request, db: Session = Depends(get_read_db),
+                    current_user: User = Depends(auth.get_current_user)):
+    if len(body.requests) > settings.batch_max_requests:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"No more than {settings.batch_max_requests} requests per batch")
+    # Routes query the session on the event loop thread without awaiting mid-query,
+    # so concurrent sub-requests can share it; only @batchable reads are allowed in a batch.
+    batch = {"session": db, "user": current_user}
+    return await asyncio.gather(*(dispatch(request, item, batch) for item in body.requests))
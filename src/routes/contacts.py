@@ -1,73 +1,198 @@
-from fastapi import APIRouter, Query, FastAPI, HTTPException, status, Depends
+import re
+
+from fastapi import APIRouter, Query, FastAPI, HTTPException, status, Depends, Request, Response, WebSocket, WebSocketDisconnect
 from sqlalchemy.orm import Session
-from schemas import ContactCreate, ContactResponse
-from database.db import get_db
-from repository.contacts import get_contact, create_contact, update_contact, delete_contact, get_contacts_upcoming_birthdays
+from fastapi.concurrency import run_in_threadpool
+from schemas import ContactChanges, ContactCreate, ContactResponse, ContactMerge, ContactSuggestion, DuplicateGroupResponse
+from database.db import get_db, get_read_db
+from repository.contacts import get_contact, list_contacts, create_contact, update_contact, delete_contact, get_contacts_upcoming_birthdays, get_duplicate_candidates, merge_contacts, get_contacts_by_phone, suggest_contacts, search_contacts, get_changes, get_contacts_version
+from services.changes import EventStreamResponse, change_feed, event_stream
+from services.duplicates import find_duplicates
+from services.sync import decode_token, encode_token
+from conf.config import settings
 from typing import List, Optional
 from database import models
 import database
 from datetime import date, timedelta
 from database.models import User, Contact
 from repository import auth
-from fastapi_limiter.depends import RateLimiter
-
-
+from routes.batch import batchable
 
-models.Base.metadata.create_all(bind=database.db.engine)
 
 app = FastAPI()
 router = APIRouter(prefix='/contacts')
 
+EXTRA_KEY = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def rate_limit(times: int, seconds: int):
+    """
+    ``RateLimiter`` dependency that imports fastapi_limiter.depends, and with it redis, on the first request.
+
+    :param times: Requests allowed per window.
+    :type times: int
+    :param seconds: Length of the window.
+    :type seconds: int
+    """
+    limiter = None
+
+    async def dependency(request: Request, response: Response):
+        nonlocal limiter
+        if limiter is None:
+            from fastapi_limiter.depends import RateLimiter
+            limiter = RateLimiter(times=times, seconds=seconds)
+        await limiter(request, response)
+
+    return dependency
+
+
+def extra_filters(request: Request) -> dict:
+    """Collects ``extra.<key>[.<key>...]=<value>`` query parameters into a nested document."""
+    document = {}
+    for name, value in request.query_params.multi_items():
+        if not name.startswith("extra."):
+            continue
+        *parents, leaf = keys = name[len("extra."):].split(".")
+        node = document
+        for key in parents:
+            node = node.setdefault(key, {})
+            if not isinstance(node, dict):
+                break
+        if not all(EXTRA_KEY.match(key) for key in keys) or not isinstance(node, dict) or isinstance(node.get(leaf), dict):
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid filter: {name}")
+        node[leaf] = value
+    return document
+
+
 @router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED)
 async def create_new_contact(contact: ContactCreate, db_session: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
     return await create_contact(db_session, contact, current_user)
 
-@router.get("/", response_model=List[ContactResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+@router.get("/", response_model=List[ContactResponse],
+            description='No more than 10 requests per minute. Filter on additional info with extra.<key>=<value>, '
+                        'e.g. extra.company=Acme or extra.address.city=Kyiv.',
+            dependencies=[Depends(rate_limit(times=10, seconds=60))])
+@batchable
 async def read_contacts(
     skip: int = 0,
     limit: int = 100,
     first_name: Optional[str] = Query(None, description="Filter by first name"),
     last_name: Optional[str] = Query(None, description="Filter by last name"),
     email: Optional[str] = Query(None, description="Filter by email"),
-    db: Session = Depends(get_db),
+    extra: dict = Depends(extra_filters),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(auth.get_current_user)
 ):
-    query = db.query(models.Contact).filter(Contact.user_id == current_user.id)
+    return await list_contacts(db, current_user, skip, limit, first_name, last_name, email, extra)
+
+@router.get("/search", response_model=List[ContactResponse])
+@batchable
+async def read_search(q: str = Query(min_length=1), limit: int = Query(10, ge=1, le=100),
+                      db: Session = Depends(get_read_db), current_user: User = Depends(auth.get_current_user)):
+    return await search_contacts(db, current_user, q, limit)
 
-    if first_name:
-        query = query.filter(models.Contact.first_name.contains(first_name))
-    if last_name:
-        query = query.filter(models.Contact.last_name.contains(last_name))
-    if email:
-        query = query.filter(models.Contact.email.contains(email))
+@router.get("/suggest", response_model=List[ContactSuggestion])
+async def read_suggestions(q: str = Query(min_length=1), limit: int = Query(10, ge=1, le=50),
+                           db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    # The primary: the index is cached and kept current from here on, so a lagging replica's
+    # snapshot would stay stale for as long as the index lives.
+    return await suggest_contacts(db, current_user, q, limit)
 
-    contacts = query.offset(skip).limit(limit).all()
+@router.get("/by-phone/{number}", response_model=List[ContactResponse])
+@batchable
+async def read_contacts_by_phone(number: str, db: Session = Depends(get_read_db), current_user: User = Depends(auth.get_current_user)):
+    contacts = await get_contacts_by_phone(db, current_user, number)
+    if contacts is None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid phone number")
     return contacts
 
+@router.get("/duplicates", response_model=List[DuplicateGroupResponse])
+@batchable
+async def read_duplicates(db: Session = Depends(get_read_db), current_user: User = Depends(auth.get_current_user)):
+    rows = await get_duplicate_candidates(db, current_user)
+    # Scoring a large address book is CPU work; keep it off the event loop.
+    return await run_in_threadpool(find_duplicates, rows)
+
+@router.post("/merge", response_model=ContactResponse)
+async def merge_duplicate_contacts(body: ContactMerge, db_session: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    merged = await merge_contacts(db_session, current_user, body.primary_id, body.duplicate_ids)
+    if not merged:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+    return merged
+
+@router.get("/changes", response_model=ContactChanges,
+            description="Contacts changed and deleted since a previous sync. Pass the returned token as since= "
+                        "next time; without a token, or with an expired one, everything is returned with reset=true.")
+async def read_changes(since: Optional[str] = Query(None), db: Session = Depends(get_db),
+                       current_user: User = Depends(auth.get_current_user)):
+    # The primary, not a replica: the token's version comes from the user row read there, and a
+    # lagging replica could hold back changes the token already claims. The version is taken
+    # before the rows are read, so anything committed meanwhile is sent again, never skipped.
+    token = encode_token(await get_contacts_version(db, current_user))
+    try:
+        version = decode_token(since)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid sync token")
+    changed, deleted = await get_changes(db, current_user, version)
+    return {"changed": changed, "deleted": deleted, "token": token, "reset": version is None}
+
+@router.get("/events", response_class=EventStreamResponse,
+            description="Server-sent events with the user's contact changes. EventSource cannot send headers, "
+                        "so the access token may also be passed as ?access_token=.")
+async def stream_changes(request: Request, access_token: Optional[str] = Query(None), db: Session = Depends(get_db)):
+    current_user = await auth.get_current_user(access_token or await auth.oauth2_scheme(request), db)
+    user_id = current_user.id
+    # The stream stays open for hours; it must not keep a pooled connection.
+    db.close()
+    return EventStreamResponse(event_stream(user_id),
+                               headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/events/ws")
+async def stream_changes_ws(websocket: WebSocket, access_token: str = Query(), db: Session = Depends(get_db)):
+    try:
+        current_user = await auth.get_current_user(access_token, db)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user_id = current_user.id
+    db.close()
+    await websocket.accept()
+    subscriber = change_feed.subscribe(user_id)
+    try:
+        while True:
+            # Heartbeats also find dead connections: sending to a closed socket raises.
+            for payload in await subscriber.next(settings.change_feed_heartbeat) or ['{"type": "ping"}']:
+                await websocket.send_text(payload)
+    except (WebSocketDisconnect, RuntimeError, OSError):
+        pass
+    finally:
+        change_feed.unsubscribe(subscriber)
+
 @router.get("/{contact_id}", response_model=ContactResponse)
-async def read_contact(contact_id: int, db_session: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
-    contact = await get_contact(db_session, contact_id, current_user)
+@batchable
+async def read_contact(contact_id: int, db_session: Session = Depends(get_read_db), current_user: User = Depends(auth.get_current_user)):
+    contact = await get_contact(db_session, current_user, contact_id)
     if not contact:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
     return contact
 
 @router.put("/{contact_id}", response_model=ContactResponse)
 async def update_existing_contact(contact_id: int, contact: ContactCreate, db_session: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
-    updated_contact = await update_contact(db_session, contact_id, contact, current_user)
+    updated_contact = await update_contact(db_session, current_user, contact_id, contact)
     if not updated_contact:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
     return updated_contact
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_existing_contact(contact_id: int, db_session: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
-    deleted = await delete_contact(db_session, contact_id, current_user)
+    deleted = await delete_contact(db_session, current_user, contact_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
     return {"message": "Contact deleted successfully"}
 
 @router.get("/upcoming_birthdays/", response_model=List[ContactResponse])
-def read_upcoming_birthdays(db: Session = Depends(get_db)):
+@batchable
+async def read_upcoming_birthdays(db: Session = Depends(get_read_db)):
     today = date.today()
     upcoming = today + timedelta(days=7)
     query = db.query(models.Contact).filter(
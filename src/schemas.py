@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
+from typing import Any, Dict, Literal, Optional, List
 from datetime import datetime, date
 
 class UserModel(BaseModel):
@@ -12,6 +12,8 @@ class UserDb(BaseModel):
     username: str
     email: str
     created_at: datetime
+    avatar: Optional[str] = None
+    avatar_thumbnail: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -27,16 +29,60 @@ class ContactCreate(BaseModel):
     email: str
     phone_number: str
     birth_date: date
-    additional_info: Optional[str] = None
+    additional_info: Optional[Dict[str, Any]] = None
 
 
 class ContactResponse(ContactCreate):
     id: int
+    phone_e164: Optional[str] = None
+    avatar: Optional[str] = None
+    avatar_thumbnail: Optional[str] = None
+    updated_at: Optional[datetime] = None
+    version: Optional[int] = None
     user_id: Optional[int] = None
 
     class Config:
         from_attributes = True
 
+class ContactChanges(BaseModel):
+    changed: List[ContactResponse]
+    deleted: List[int]
+    token: str
+    reset: bool = False
+
+class AvatarResponse(BaseModel):
+    avatar: str
+    avatar_thumbnail: Optional[str] = None
+
+class ContactSuggestion(BaseModel):
+    id: int
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    email: Optional[str] = None
+
+class DuplicateGroupResponse(BaseModel):
+    contact_ids: List[int]
+    score: float
+
+    class Config:
+        from_attributes = True
+
+class ContactMerge(BaseModel):
+    primary_id: int
+    duplicate_ids: List[int] = Field(min_length=1)
+
+class BatchItem(BaseModel):
+    method: Literal["GET"] = "GET"
+    url: str = Field(pattern=r"^/")
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem] = Field(min_length=1)
+
+class BatchItemResponse(BaseModel):
+    status: int
+    headers: Dict[str, str]
+    body: Any = None
+
 class TokenModel(BaseModel):
     access_token: str
     refresh_token: str
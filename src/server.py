@@ -0,0 +1,64 @@
+"""
+Production server entry point.
+
+Starts ``settings.server_workers`` uvicorn worker processes (one per CPU core when
+set to 0) that share one listening socket. uvloop and httptools are used when they
+are installed. On SIGTERM/SIGINT uvicorn stops accepting connections, waits up to
+``settings.server_graceful_timeout`` seconds for in-flight requests and then runs the
+app shutdown hook, which closes the database and Redis pools::
+
+    python server.py
+"""
+import importlib.util
+import os
+
+import uvicorn
+
+from conf.config import settings
+
+
+def is_installed(module: str) -> bool:
+    """
+    Check whether an optional module can be imported.
+
+    :param module: Module name.
+    :type module: str
+    :return: True if the module is installed.
+    :rtype: bool
+    """
+    return importlib.util.find_spec(module) is not None
+
+
+def worker_count() -> int:
+    """
+    Number of worker processes to start.
+
+    :return: ``settings.server_workers``, or the number of CPU cores when it is 0.
+    :rtype: int
+    """
+    return settings.server_workers or os.cpu_count() or 1
+
+
+def run():
+    workers = worker_count()
+    if workers > 1 and settings.change_feed_backend == "local":
+        # Each worker would only see the changes it wrote itself.
+        raise SystemExit("change_feed_backend 'local' only works with one worker; use 'redis' or 'postgres'")
+    uvicorn.run(
+        "main:app",
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        loop="uvloop" if is_installed("uvloop") else "asyncio",
+        http="httptools" if is_installed("httptools") else "h11",
+        timeout_keep_alive=settings.server_keep_alive,
+        backlog=settings.server_backlog,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        # main.setup_logging() owns logging; the access log comes from RequestLogMiddleware.
+        log_config=None,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    run()
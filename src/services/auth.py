@@ -1,23 +1,50 @@
+import logging
 import pickle
+from functools import lru_cache
 from typing import Optional
-from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from conf.config import settings
-import redis.asyncio as redis
 
-from database.db import get_db
+from database.db import get_read_db
 from repository import users as repository_users
 
+logger = logging.getLogger(__name__)
+
+
+# passlib, jose and redis are imported on first use to keep worker boot fast
+@lru_cache
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+@lru_cache
+def get_redis():
+    import redis.asyncio as redis
+    return redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+
+
+async def close_redis():
+    if get_redis.cache_info().currsize:
+        await get_redis().aclose()
+        get_redis.cache_clear()
+
+
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = "secret_key"
     ALGORITHM = "HS256"
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+
+    @property
+    def pwd_context(self):
+        return get_pwd_context()
+
+    @property
+    def r(self):
+        return get_redis()
 
     def verify_password(self, plain_password, hashed_password):
         return self.pwd_context.verify(plain_password, hashed_password)
@@ -27,6 +54,7 @@ class Auth:
 
 # define a function to generate a new access token
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
+        from jose import jwt
         to_encode = data.copy()
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
@@ -38,6 +66,7 @@ class Auth:
 
 # define a function to generate a new refresh token
     async def create_refresh_token(self, data: dict, expires_delta: Optional[float] = None):
+        from jose import jwt
         to_encode = data.copy()
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
@@ -48,6 +77,7 @@ class Auth:
         return encoded_refresh_token
 
     async def decode_refresh_token(self, refresh_token: str):
+        from jose import JWTError, jwt
         try:
             payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             if payload['scope'] == 'refresh_token':
@@ -57,7 +87,8 @@ class Auth:
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+        from jose import JWTError, jwt
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -75,18 +106,19 @@ class Auth:
                 raise credentials_exception
         except JWTError as e:
             raise credentials_exception
-        user = self.r.get(f"user:{email}")
+        user = await self.r.get(f"user:{email}")
         if user is None:
             user = await repository_users.get_user_by_email(email, db)
             if user is None:
                 raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
+            await self.r.set(f"user:{email}", pickle.dumps(user))
+            await self.r.expire(f"user:{email}", 900)
         else:
             user = pickle.loads(user)
         return user
 
     def create_email_token(self, data: dict):
+        from jose import jwt
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(days=7)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire})
@@ -94,12 +126,13 @@ class Auth:
         return token
     
     async def get_email_from_token(self, token: str):
+        from jose import JWTError, jwt
         try:
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             email = payload["sub"]
             return email
         except JWTError as e:
-            print(e)
+            logger.info("Invalid email verification token: %s", e)
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                                 detail="Invalid token for email verification")
 
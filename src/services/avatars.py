@@ -0,0 +1,209 @@
+"""
+Avatar uploads.
+
+The multipart body is parsed as it arrives and the file part is written chunk by chunk
+to a temporary file in the storage backend, hashing it on the way, so an upload never
+sits in memory. Files are stored under their SHA-256, which makes every URL immutable:
+a new avatar gets a new URL, and the old one can be cached forever.
+
+Thumbnails are resized with Pillow in a process pool, away from the event loop and the
+GIL. Without Pillow the original is stored and ``avatar_thumbnail`` stays empty.
+"""
+import asyncio
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from fastapi import HTTPException, Request, status
+from multipart.multipart import MultipartParser, parse_options_header
+
+from conf.config import settings
+from services.storage import get_storage
+
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+
+# Anything larger than the limit plus this much multipart framing is refused before reading.
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+def image_type(head: bytes) -> str | None:
+    """
+    The file extension for an image, from its first bytes.
+
+    :param head: At least the first 12 bytes of the file.
+    :type head: bytes
+    :return: ``png``, ``jpg``, ``gif`` or ``webp``, or None for anything else.
+    :rtype: str | None
+    """
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class _FilePart:
+    """Multipart callbacks that write the first file part to ``path``."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.file = None
+        self.done = False
+        self._headers = {}
+        self._field = b""
+        self._value = b""
+
+    def callbacks(self) -> dict:
+        return {"on_part_begin": self.on_part_begin, "on_header_field": self.on_header_field,
+                "on_header_value": self.on_header_value, "on_header_end": self.on_header_end,
+                "on_headers_finished": self.on_headers_finished, "on_part_data": self.on_part_data,
+                "on_part_end": self.on_part_end}
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if b"filename" in options and not self.done:
+            self.file = open(self.path, "wb")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.file is None:
+            return
+        chunk = data[start:end]
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Avatar is larger than {self.max_bytes} bytes")
+        if len(self.head) < 12:
+            self.head += chunk[:12 - len(self.head)]
+        self.sha256.update(chunk)
+        self.file.write(chunk)
+
+    def on_part_end(self):
+        if self.file is not None:
+            self.close()
+            self.done = True
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+async def receive_file(request: Request, path: str, max_bytes: int) -> _FilePart:
+    """
+    Streams the first file in a multipart/form-data body to ``path``.
+
+    :param request: The upload request.
+    :type request: Request
+    :param path: Where to write the file.
+    :type path: str
+    :param max_bytes: Largest accepted file; anything bigger is a 413.
+    :type max_bytes: int
+    :return: The received part, with its size, SHA-256 and first bytes.
+    :rtype: _FilePart
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Expected multipart/form-data")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Avatar is larger than {max_bytes} bytes")
+    part = _FilePart(path, max_bytes)
+    parser = MultipartParser(options[b"boundary"], part.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    finally:
+        part.close()
+    if not part.done:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="No file in the upload")
+    return part
+
+
+def make_thumbnail(source: str, target: str, size: int) -> None:
+    """
+    Writes a WebP thumbnail that fits in ``size`` x ``size``. Runs in a worker process.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.save(target, "WEBP", quality=85)
+
+
+# Workers are spawned rather than forked: forking a process that runs threads and an event loop is unsafe.
+@lru_cache
+def get_thumbnail_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=settings.avatar_thumbnail_workers,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def close_thumbnail_pool():
+    if get_thumbnail_pool.cache_info().currsize:
+        get_thumbnail_pool().shutdown(cancel_futures=True)
+        get_thumbnail_pool.cache_clear()
+
+
+async def store_avatar(request: Request) -> dict:
+    """
+    Receives an uploaded image, stores it and its thumbnail, and returns their URLs.
+
+    :param request: The upload request.
+    :type request: Request
+    :return: ``avatar`` and ``avatar_thumbnail`` URLs; the thumbnail is None without Pillow.
+    :rtype: dict
+    """
+    storage = get_storage()
+    path = storage.temp_path()
+    thumbnail_path = None
+    try:
+        part = await receive_file(request, path, settings.avatar_max_bytes)
+        extension = image_type(part.head)
+        if extension is None:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                detail="Avatar must be a PNG, JPEG, GIF or WebP image")
+        digest = part.sha256.hexdigest()
+        thumbnail = None
+        if HAS_PILLOW:
+            size = settings.avatar_thumbnail_size
+            thumbnail_path = storage.temp_path()
+            try:
+                await asyncio.get_running_loop().run_in_executor(get_thumbnail_pool(), make_thumbnail,
+                                                                 path, thumbnail_path, size)
+            except Exception:
+                raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Invalid image")
+            thumbnail = await storage.put(thumbnail_path, f"avatars/{digest}_{size}.webp")
+        avatar = await storage.put(path, f"avatars/{digest}.{extension}")
+    finally:
+        for leftover in (path, thumbnail_path):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+    return {"avatar": avatar, "avatar_thumbnail": thumbnail}
@@ -0,0 +1,135 @@
+"""
+Daily birthday digest.
+
+Walks all confirmed users in keyset chunks, one query per chunk, and emails each
+user who has contacts with a birthday in the coming week::
+
+    python -m services.birthdays            # once, e.g. from cron
+    python -m services.birthdays --daily    # keep running, once a day after midnight
+
+Progress is checkpointed to ``settings.birthday_state_file`` after every chunk, so an
+interrupted run picks up at the next user instead of emailing everyone twice.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy.orm import Session
+
+from conf.config import settings
+from repository.contacts import birthday_window, get_birthdays_by_owner
+from services.email import send_birthday_digest
+
+logger = logging.getLogger(__name__)
+
+
+def load_checkpoint(path: str, day: date) -> int:
+    """
+    :return: The last user id already handled on ``day``, or 0 when the day has not started.
+    :rtype: int
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return 0
+    return state["after_user_id"] if state.get("day") == day.isoformat() else 0
+
+
+def save_checkpoint(path: str, day: date, after_user_id: int) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"day": day.isoformat(), "after_user_id": after_user_id}, f)
+    os.replace(tmp, path)
+
+
+async def send_birthday_reminders(db: Session, today: date = None, days: int = None, chunk_size: int = None,
+                                  state_file: str = None, send=send_birthday_digest) -> dict:
+    """
+    Sends the birthday digests for ``today``, resuming after the last checkpointed user.
+
+    Memory is bounded by one chunk: the session is cleared after each one.
+
+    :param db: The database session.
+    :type db: Session
+    :param today: The day to send for. Defaults to the current date.
+    :type today: date
+    :param days: Length of the window after ``today``. Defaults to ``settings.birthday_window_days``.
+    :type days: int
+    :param chunk_size: Users per query. Defaults to ``settings.birthday_chunk_size``.
+    :type chunk_size: int
+    :param state_file: Checkpoint path. Defaults to ``settings.birthday_state_file``.
+    :type state_file: str
+    :param send: Coroutine sending one digest, ``send(email, username, birthdays) -> bool``.
+    :type send: Callable
+    :return: Counts of users scanned, digests sent, digests failed and contacts included.
+    :rtype: dict
+    """
+    today = today or date.today()
+    window = birthday_window(today, settings.birthday_window_days if days is None else days)
+    chunk_size = chunk_size or settings.birthday_chunk_size
+    state_file = state_file or settings.birthday_state_file
+    limit = asyncio.Semaphore(settings.birthday_send_concurrency)
+    stats = {"users": 0, "sent": 0, "failed": 0, "contacts": 0}
+
+    async def digest(email, username, contacts):
+        contacts.sort(key=lambda contact: (window[contact.birth_mmdd], contact.last_name or "", contact.first_name or ""))
+        birthdays = [{"name": f"{contact.first_name} {contact.last_name}",
+                      "date": window[contact.birth_mmdd].strftime("%A, %B %d")} for contact in contacts]
+        async with limit:
+            sent = await send(email, username, birthdays)
+        stats["sent" if sent else "failed"] += 1
+        stats["contacts"] += len(birthdays)
+
+    after = load_checkpoint(state_file, today)
+    if after:
+        logger.info("Resuming birthday digests for %s after user %s", today, after)
+    while True:
+        rows = await get_birthdays_by_owner(db, after, window, chunk_size)
+        if not rows:
+            break
+        sends = []
+        for (user_id, email, username), group in groupby(rows, key=lambda row: tuple(row[:3])):
+            contacts = [row[3] for row in group if row[3] is not None]
+            stats["users"] += 1
+            if contacts:
+                sends.append(digest(email, username, contacts))
+        await asyncio.gather(*sends)
+        after = rows[-1][0]
+        save_checkpoint(state_file, today, after)
+        db.expunge_all()
+    logger.info("Birthday digests for %s: %s", today, stats)
+    return stats
+
+
+async def run_daily() -> None:
+    from database.db import SessionLocal
+    while True:
+        with SessionLocal() as db:
+            await send_birthday_reminders(db)
+        tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((tomorrow - datetime.now()).total_seconds())
+
+
+async def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m services.birthdays", description="Email upcoming birthdays.")
+    parser.add_argument("--date", type=date.fromisoformat, help="Send for this day instead of today (YYYY-MM-DD)")
+    parser.add_argument("--daily", action="store_true", help="Keep running and send once a day")
+    args = parser.parse_args(argv)
+
+    if args.daily:
+        await run_daily()
+        return
+    from database.db import SessionLocal
+    with SessionLocal() as db:
+        await send_birthday_reminders(db, today=args.date)
+
+
+if __name__ == "__main__":
+    from services.log import setup_logging
+    setup_logging(settings.log_level)
+    asyncio.run(main())
@@ -0,0 +1,339 @@
+"""
+Per-user contact change feed.
+
+Write paths record a change on their session with ``record_change``. The change is
+published once the session commits and dropped if it rolls back. Each worker keeps a
+single upstream subscription and fans events out to its own subscribers:
+
+* ``local``: in-process only, for a single worker and for tests.
+* ``redis``: Redis pub/sub on ``settings.change_feed_channel``; the default.
+* ``postgres``: ``LISTEN`` on the same channel over one dedicated connection per worker;
+  ``NOTIFY`` goes through the engine's pool.
+
+When the upstream subscription drops, it is reopened, and every subscriber gets a
+``resync`` event, since changes published in between are lost.
+
+A subscriber is a small slotted object with a bounded list and at most one pending
+future. It holds no database connection and no upstream connection of its own, so
+one worker can hold tens of thousands of idle subscribers. A subscriber that falls
+more than ``settings.change_feed_buffer`` events behind gets one ``resync`` event
+instead, and should then fetch its contacts again.
+"""
+import asyncio
+import json
+import logging
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from starlette.responses import StreamingResponse
+
+from conf.config import settings
+from services.suggest import suggest_indexes
+
+logger = logging.getLogger(__name__)
+
+_PENDING = "change_feed.pending"
+# Seconds between attempts to reopen a lost upstream subscription.
+RECONNECT_DELAY = 1.0
+
+
+class Subscriber:
+    __slots__ = ("user_id", "buffer", "events", "overflowed", "waiter")
+
+    def __init__(self, user_id: int, buffer: int):
+        self.user_id = user_id
+        self.buffer = buffer
+        self.events = []
+        self.overflowed = False
+        self.waiter = None
+
+    def push(self, payload: str) -> None:
+        if len(self.events) < self.buffer:
+            self.events.append(payload)
+        else:
+            self.overflowed = True
+        self._wake()
+
+    def lost(self) -> None:
+        """Marks events as missed, so the next read returns a ``resync`` event."""
+        self.overflowed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def next(self, timeout: float) -> list:
+        """
+        Waits for events.
+
+        :param timeout: Seconds to wait before returning an empty list, e.g. to send a heartbeat.
+        :type timeout: float
+        :return: The pending event payloads, oldest first.
+        :rtype: list
+        """
+        if not self.events and not self.overflowed:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                return []
+            finally:
+                self.waiter = None
+        events, self.events = self.events, []
+        if self.overflowed:
+            self.overflowed = False
+            return [json.dumps({"type": "resync"})]
+        return events
+
+
+class ChangeFeed:
+
+    def __init__(self, backend: str, channel: str, buffer: int):
+        self.backend = backend
+        self.channel = channel
+        self.buffer = buffer
+        self.subscribers = {}
+        self.loop = None
+        self._listener = None
+        self._connection = None
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        self.loop = asyncio.get_running_loop()
+        subscriber = Subscriber(user_id, self.buffer)
+        self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self.subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.user_id]
+
+    def deliver(self, payload: str) -> None:
+        """Hands a published event to this worker's subscribers for its user."""
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        change = json.loads(payload)
+        user_id = change["user_id"]
+        # Every worker sees every change, whether or not anyone there is subscribed to the user.
+        suggest_indexes.contact_changed(user_id, change["id"])
+        for subscriber in self.subscribers.get(user_id, ()):
+            subscriber.push(payload)
+
+    def lost(self) -> None:
+        """Tells every subscriber of this worker that events may have been missed."""
+        suggest_indexes.clear()
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                subscriber.lost()
+
+    def publish(self, payloads: list) -> None:
+        """
+        Sends committed events to every worker. Safe to call from any thread.
+
+        :param payloads: JSON-encoded events.
+        :type payloads: list
+        """
+        if self.backend == "postgres":
+            self._notify(payloads)
+        elif self.loop is None or self.loop.is_closed():
+            # Nobody in this process ever subscribed or started the feed.
+            return
+        elif self.backend == "redis":
+            for payload in payloads:
+                future = asyncio.run_coroutine_threadsafe(self._redis().publish(self.channel, payload), self.loop)
+                future.add_done_callback(_log_failure)
+        else:
+            for payload in payloads:
+                self.loop.call_soon_threadsafe(self.deliver, payload)
+
+    async def start(self) -> None:
+        """Opens this worker's upstream subscription. Call once at startup."""
+        self.loop = asyncio.get_running_loop()
+        if self.backend == "redis":
+            self._listener = self.loop.create_task(self._listen_redis())
+        elif self.backend == "postgres":
+            self._listener = self.loop.create_task(self._listen_postgres())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        self._close_postgres()
+
+    @staticmethod
+    def _redis():
+        from services.auth import get_redis
+        return get_redis()
+
+    async def _listen_redis(self):
+        reconnecting = False
+        while True:
+            try:
+                pubsub = self._redis().pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                if reconnecting:
+                    self.lost()
+                async for message in pubsub.listen():
+                    self.deliver(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("change feed subscription lost, reconnecting")
+                reconnecting = True
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def _close_postgres(self):
+        if self._connection is not None:
+            self.loop.remove_reader(self._connection.fileno())
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _connect_postgres(self):
+        from database.db import engine
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        connection = engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    async def _listen_postgres(self):
+        # The connection is only ever used on the loop thread; publishing takes pooled connections.
+        reconnecting = False
+        while True:
+            try:
+                connection = await asyncio.to_thread(self._connect_postgres)
+            except Exception:
+                logger.exception("could not open the change feed subscription, retrying")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            if reconnecting:
+                self.lost()
+            self._connection = connection
+            dropped = self.loop.create_future()
+
+            # psycopg2 reads notifications when the socket becomes readable; no thread is needed.
+            def on_readable():
+                try:
+                    connection.poll()
+                except Exception as exc:
+                    if not dropped.done():
+                        dropped.set_exception(exc)
+                    return
+                while connection.notifies:
+                    self.deliver(connection.notifies.pop(0).payload)
+
+            self.loop.add_reader(connection.fileno(), on_readable)
+            try:
+                await dropped
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("change feed subscription lost, reconnecting")
+            finally:
+                self._close_postgres()
+            reconnecting = True
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _notify(self, payloads: list):
+        from database.db import engine
+        try:
+            with engine.begin() as connection:
+                for payload in payloads:
+                    connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                       {"channel": self.channel, "payload": payload})
+        except Exception:
+            logger.exception("could not publish %d contact changes", len(payloads))
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("could not publish a contact change", exc_info=future.exception())
+
+
+change_feed = ChangeFeed(settings.change_feed_backend, settings.change_feed_channel, settings.change_feed_buffer)
+
+
+async def event_stream(user_id: int):
+    """
+    Server-sent events for one user: a ``data:`` line per change and a comment as heartbeat.
+
+    :param user_id: The subscribing user.
+    :type user_id: int
+    :return: An async iterator of SSE frames.
+    """
+    subscriber = change_feed.subscribe(user_id)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            events = await subscriber.next(settings.change_feed_heartbeat)
+            yield "".join(f"data: {payload}\n\n" for payload in events) if events else ": ping\n\n"
+    finally:
+        change_feed.unsubscribe(subscriber)
+
+
+class EventStreamResponse(StreamingResponse):
+    """
+    ``StreamingResponse`` for long-lived, mostly idle streams.
+
+    Starlette's version runs each response in an anyio task group. Here the stream runs
+    in the request's own task and one plain task waits for the disconnect, then cancels it.
+    """
+
+    media_type = "text/event-stream"
+
+    async def __call__(self, scope, receive, send):
+        task = asyncio.current_task()
+        watcher = asyncio.ensure_future(self.listen_for_disconnect(receive))
+
+        def disconnected(_):
+            task.cancel()
+
+        watcher.add_done_callback(disconnected)
+        try:
+            await self.stream_response(send)
+        except asyncio.CancelledError:
+            # Our own cancellation ends the stream; anyone else's propagates.
+            if not watcher.done() or watcher.cancelled() or task.uncancel():
+                raise
+        finally:
+            watcher.remove_done_callback(disconnected)
+            watcher.cancel()
+        if self.background is not None:
+            await self.background()
+
+
+def record_change(db: Session, user_id: int, contact, change: str) -> None:
+    """
+    Queues a change event on the session; it is published when the session commits.
+
+    :param db: The session making the change.
+    :type db: Session
+    :param user_id: The owner of the contact.
+    :type user_id: int
+    :param contact: The contact, or its id. A new contact's id is read after it is flushed.
+    :type contact: Contact | int
+    :param change: ``created``, ``updated`` or ``deleted``.
+    :type change: str
+    """
+    db.info.setdefault(_PENDING, []).append((user_id, contact, change))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        change_feed.publish([json.dumps({"type": f"contact.{change}", "user_id": user_id,
+                                         "id": contact if isinstance(contact, int) else inspect(contact).identity[0]})
+                             for user_id, contact, change in pending])
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_changes(session, previous_transaction):
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,222 @@
+"""
+Response compression.
+
+Bodies are held back until ``settings.compression_min_size`` bytes have arrived. Smaller
+responses go out untouched, since compressing them costs more CPU than it saves bytes.
+Larger ones are compressed chunk by chunk as the application sends them, so streaming
+responses stay streaming. A response that already has a ``Content-Encoding``, such as
+a pre-compressed cache entry, is passed through as is.
+
+Brotli is used when the optional ``brotli`` package is installed and the client
+accepts it. Otherwise gzip is used.
+"""
+import importlib.util
+import threading
+import time
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from conf.config import settings
+
+HAS_BROTLI = importlib.util.find_spec("brotli") is not None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/xml", "image/svg+xml", "text/")
+# Event streams are flushed message by message; buffering them in a compressor would stall the client.
+INCOMPRESSIBLE_TYPES = ("text/event-stream",)
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """
+    Picks the response encoding from an ``Accept-Encoding`` header.
+
+    :param accept_encoding: The header value.
+    :type accept_encoding: str
+    :return: ``br``, ``gzip`` or None when the client accepts neither.
+    :rtype: str | None
+    """
+    offered = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        offered[name.strip()] = quality
+    for encoding in ("br", "gzip") if HAS_BROTLI else ("gzip",):
+        if offered.get(encoding, offered.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "").lower()
+    return ("content-encoding" not in headers and content_type.startswith(COMPRESSIBLE_TYPES)
+            and not content_type.startswith(INCOMPRESSIBLE_TYPES))
+
+
+class Encoder:
+    """
+    Streaming gzip or brotli compressor with a common interface.
+
+    ``flush`` emits everything compressed so far without ending the stream, so the
+    client can decode each chunk as soon as it arrives; the window is kept across flushes.
+    """
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            import brotli
+            self._compressor = brotli.Compressor(quality=settings.compression_brotli_quality)
+            self.compress, self.flush, self.finish = \
+                self._compressor.process, self._compressor.flush, self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(settings.compression_gzip_level, zlib.DEFLATED, 31)
+            self.compress, self.finish = self._compressor.compress, self._compressor.flush
+            self.flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class CompressionStats:
+    """Bytes in and out and compression CPU time, aggregated by route."""
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def record(self, route: str, encoding: str, bytes_in: int, bytes_out: int, cpu_ms: float) -> None:
+        with self.lock:
+            entry = self.stats.get(route)
+            if entry is None:
+                entry = self.stats[route] = {"route": route, "count": 0, "bytes_in": 0, "bytes_out": 0,
+                                             "cpu_ms": 0.0, "encodings": {}}
+            entry["count"] += 1
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["cpu_ms"] += cpu_ms
+            entry["encodings"][encoding] = entry["encodings"].get(encoding, 0) + 1
+
+    def report(self) -> list:
+        """
+        :return: Entries with their compression ratio, most bytes saved first.
+        :rtype: list
+        """
+        with self.lock:
+            entries = [dict(entry, encodings=dict(entry["encodings"]),
+                            ratio=entry["bytes_in"] / entry["bytes_out"] if entry["bytes_out"] else 0.0)
+                       for entry in self.stats.values()]
+        return sorted(entries, key=lambda e: e["bytes_in"] - e["bytes_out"], reverse=True)
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses responses of at least ``minimum_size`` bytes.
+
+    Each compressed response also leaves its numbers in ``scope["compression"]`` for
+    the access log.
+    """
+
+    def __init__(self, app, minimum_size: int = None, stats: CompressionStats = compression_stats):
+        self.app = app
+        self.minimum_size = settings.compression_min_size if minimum_size is None else minimum_size
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Responder(self, scope, send, encoding).send)
+
+
+class _Responder:
+
+    def __init__(self, middleware: CompressionMiddleware, scope, send, encoding: str):
+        self.middleware = middleware
+        self.scope = scope
+        self._send = send
+        self.encoding = encoding
+        self.start = None
+        self.buffer = []
+        self.buffered = 0
+        self.encoder = None
+        self.passthrough = False
+        self.bytes_in = self.bytes_out = 0
+        self.cpu = 0.0
+
+    async def send(self, message):
+        if self.passthrough:
+            await self._send(message)
+        elif message["type"] == "http.response.start":
+            self.start = message
+            if message["status"] in (204, 304) or not compressible(Headers(raw=message.get("headers", []))):
+                self.passthrough = True
+                await self._send(message)
+        elif message["type"] == "http.response.body" and self.encoder is None:
+            await self._hold(message)
+        elif message["type"] == "http.response.body":
+            await self._compress(message.get("body", b""), message.get("more_body", False))
+        else:
+            await self._send(message)
+
+    async def _hold(self, message):
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if self.buffered < self.middleware.minimum_size:
+            if more_body:
+                return
+            self.passthrough = True
+            await self._send(self.start)
+            await self._send({"type": "http.response.body", "body": b"".join(self.buffer)})
+            return
+        headers = MutableHeaders(raw=self.start.setdefault("headers", []))
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        del headers["content-length"]
+        self.encoder = Encoder(self.encoding)
+        body = b"".join(self.buffer)
+        self.buffer = []
+        if not more_body:
+            # The whole body is here, so the compressed length is known up front.
+            compressed = self._run(self.encoder.compress, body) + self._run(self.encoder.finish)
+            headers["content-length"] = str(len(compressed))
+            await self._send(self.start)
+            await self._emit(compressed, False, len(body))
+            return
+        await self._send(self.start)
+        await self._compress(body, True)
+
+    async def _compress(self, body: bytes, more_body: bool):
+        compressed = self._run(self.encoder.compress, body)
+        # Without a flush the compressor would hold the data back until the response ends.
+        compressed += self._run(self.encoder.flush if more_body else self.encoder.finish)
+        await self._emit(compressed, more_body, len(body))
+
+    async def _emit(self, compressed: bytes, more_body: bool, size: int):
+        self.bytes_in += size
+        self.bytes_out += len(compressed)
+        if compressed or not more_body:
+            await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+        if not more_body:
+            self._record()
+
+    def _run(self, function, *args) -> bytes:
+        # Thread CPU time, so time spent in other requests or threads is not counted.
+        started = time.thread_time()
+        try:
+            return function(*args)
+        finally:
+            self.cpu += time.thread_time() - started
+
+    def _record(self):
+        route = getattr(self.scope.get("route"), "path", self.scope.get("path"))
+        cpu_ms = self.cpu * 1000
+        self.scope["compression"] = {"encoding": self.encoding, "bytes_in": self.bytes_in,
+                                     "bytes_out": self.bytes_out, "cpu_ms": round(cpu_ms, 3)}
+        self.middleware.stats.record(route, self.encoding, self.bytes_in, self.bytes_out, cpu_ms)
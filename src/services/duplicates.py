@@ -0,0 +1,187 @@
+"""
+Duplicate contact detection.
+
+Comparing every pair of contacts is quadratic, so contacts are first grouped into
+blocks that share a key: normalized email, E.164 phone number or a phonetic key of
+the name. Only contacts within a block are compared, and within a large block only
+neighbours in name order (sorted neighbourhood), which keeps the work linear in the
+size of the address book.
+"""
+import re
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import List, Optional
+
+from conf.config import settings
+
+_SOUNDEX = {letter: digit for digit, letters in {"1": "bfpv", "2": "cgjkqsxz", "3": "dt", "4": "l",
+                                                    "5": "mn", "6": "r"}.items() for letter in letters}
+_NOT_DIGITS = re.compile(r"\D")
+
+EMAIL_WEIGHT = 0.6
+PHONE_WEIGHT = 0.5
+NAME_WEIGHT = 0.5
+BIRTH_DATE_WEIGHT = 0.3
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    email = (email or "").strip().lower()
+    return email or None
+
+
+def normalize_phone(number: Optional[str], country_code: str = None) -> Optional[str]:
+    """
+    Normalizes a phone number to E.164 (``+`` and up to 15 digits).
+
+    Numbers without an international prefix are taken to be national numbers of
+    ``country_code`` (``settings.phone_country_code`` by default), dropping the trunk ``0``.
+
+    :return: The E.164 number, or None when it cannot be one.
+    :rtype: str | None
+    """
+    number = (number or "").strip()
+    digits = _NOT_DIGITS.sub("", number)
+    if number.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    else:
+        country_code = settings.phone_country_code if country_code is None else country_code
+        if not country_code:
+            return None
+        digits = country_code + digits.lstrip("0")
+    if not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        return None
+    return "+" + digits
+
+
+@lru_cache(maxsize=4096)
+def soundex(name: Optional[str]) -> str:
+    letters = [c for c in (name or "").lower() if c in _SOUNDEX or c in "aeiouyhw"]
+    if not letters:
+        return ""
+    code, last = letters[0].upper(), _SOUNDEX.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = _SOUNDEX.get(letter, "")
+        if digit and digit != last:
+            code += digit
+        if letter not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+
+def phonetic_key(first_name: Optional[str], last_name: Optional[str]) -> Optional[str]:
+    """Soundex of both names; names without Latin letters fall back to their lower-cased spelling."""
+    key = soundex(first_name) + soundex(last_name)
+    if not key:
+        key = " ".join(part.strip().lower() for part in (first_name, last_name) if part and part.strip())
+    return key or None
+
+
+@dataclass
+class Candidate:
+    id: int
+    name: str
+    email: Optional[str]
+    phone: Optional[str]
+    birth_date: object
+    phonetic: Optional[str]
+
+    @classmethod
+    def from_row(cls, row):
+        name = " ".join(part.strip().lower() for part in (row.first_name, row.last_name) if part)
+        return cls(row.id, name, normalize_email(row.email), normalize_phone(row.phone_number), row.birth_date,
+                   phonetic_key(row.first_name, row.last_name))
+
+    def blocking_keys(self):
+        keys = [("email", self.email), ("phone", self.phone), ("name", self.phonetic)]
+        return [key for key in keys if key[1]]
+
+
+def score(a: Candidate, b: Candidate, threshold: float = 0.0) -> float:
+    """
+    Likelihood that two contacts are the same person, from 0 to 1.
+
+    An equal email is enough on its own; a shared phone number also needs a similar
+    name, and a similar name alone needs the same birth date. Names count only above
+    half similarity. Returns 0 without comparing names when the pair cannot reach
+    ``threshold`` anyway, which is what keeps large name blocks cheap.
+    """
+    total = 0.0
+    if a.email and a.email == b.email:
+        total += EMAIL_WEIGHT
+    if a.phone and a.phone == b.phone:
+        total += PHONE_WEIGHT
+    if a.birth_date and a.birth_date == b.birth_date:
+        total += BIRTH_DATE_WEIGHT
+    if total + NAME_WEIGHT < threshold:
+        return 0.0
+    if a.name and b.name:
+        similarity = SequenceMatcher(None, a.name, b.name).ratio()
+        total += NAME_WEIGHT * max(0.0, similarity - 0.5) * 2
+    return min(total, 1.0)
+
+
+@dataclass
+class DuplicateGroup:
+    contact_ids: List[int] = field(default_factory=list)
+    score: float = 1.0
+
+
+def find_duplicates(rows, threshold: float = 0.6, window: int = 10) -> List[DuplicateGroup]:
+    """
+    Groups a user's contacts that are likely the same person.
+
+    :param rows: Rows with ``id``, ``first_name``, ``last_name``, ``email``, ``phone_number`` and ``birth_date``.
+    :type rows: Iterable
+    :param threshold: Minimum :func:`score` for two contacts to be linked.
+    :type threshold: float
+    :param window: How many name-order neighbours each contact is compared with inside a block.
+    :type window: int
+    :return: Groups of two or more contacts, lowest id first; ``score`` is the weakest link in the group.
+    :rtype: List[DuplicateGroup]
+    """
+    blocks = {}
+    for row in rows:
+        candidate = Candidate.from_row(row)
+        for key in candidate.blocking_keys():
+            blocks.setdefault(key, []).append(candidate)
+
+    parent = {}
+    weakest = {}
+
+    def find(contact_id):
+        root = contact_id
+        while root in parent:
+            root = parent[root]
+        while contact_id != root:
+            parent[contact_id], contact_id = root, parent[contact_id]
+        return root
+
+    compared = set()
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        block.sort(key=lambda c: (c.name, c.id))
+        for i, a in enumerate(block):
+            for b in block[i + 1:i + 1 + window]:
+                pair = (a.id, b.id) if a.id < b.id else (b.id, a.id)
+                if pair in compared:
+                    continue
+                compared.add(pair)
+                pair_score = score(a, b, threshold)
+                if pair_score < threshold:
+                    continue
+                root_a, root_b = find(a.id), find(b.id)
+                link = min(pair_score, weakest.get(root_a, 1.0), weakest.get(root_b, 1.0))
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+                weakest[min(root_a, root_b)] = link
+
+    groups = {}
+    for contact_id in list(parent):
+        root = find(contact_id)
+        groups.setdefault(root, {root}).add(contact_id)
+    return sorted((DuplicateGroup(sorted(ids), round(weakest[root], 3)) for root, ids in groups.items()),
+                  key=lambda group: group.contact_ids[0])
@@ -1,28 +1,37 @@
+import logging
+from functools import lru_cache
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
 from pydantic import EmailStr
 from conf.config import settings
 
 from services.auth import auth_service
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Desired Name",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+logger = logging.getLogger(__name__)
+
+
+# fastapi_mail pulls in jinja2 and aiosmtplib, so it is imported on the first email only
+@lru_cache
+def get_conf():
+    from fastapi_mail import ConnectionConfig
+    return ConnectionConfig(
+        MAIL_USERNAME=settings.mail_username,
+        MAIL_PASSWORD=settings.mail_password,
+        MAIL_FROM=settings.mail_from,
+        MAIL_PORT=settings.mail_port,
+        MAIL_SERVER=settings.mail_server,
+        MAIL_FROM_NAME="Desired Name",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=True,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+        TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
+    )
 
 
 async def send_email(email: EmailStr, username: str, host: str):
+    from fastapi_mail import FastMail, MessageSchema, MessageType
+    from fastapi_mail.errors import ConnectionErrors
     try:
         token_verification = auth_service.create_email_token({"sub": email})
         message = MessageSchema(
@@ -32,7 +41,38 @@ async def send_email(email: EmailStr, username: str, host: str):
             subtype=MessageType.html
         )
 
-        fm = FastMail(conf)
+        fm = FastMail(get_conf())
         await fm.send_message(message, template_name="email_template.html")
     except ConnectionErrors as err:
-        print(err)
+        logger.error("Could not send confirmation email: %s", err)
+
+
+async def send_birthday_digest(email: EmailStr, username: str, birthdays: list) -> bool:
+    """
+    Sends one email listing a user's upcoming contact birthdays.
+
+    :param email: The recipient.
+    :type email: EmailStr
+    :param username: The recipient's name, used in the greeting.
+    :type username: str
+    :param birthdays: ``{"name": ..., "date": ...}`` entries, soonest first.
+    :type birthdays: list
+    :return: Whether the email was handed to the mail server.
+    :rtype: bool
+    """
+    from fastapi_mail import FastMail, MessageSchema, MessageType
+    from fastapi_mail.errors import ConnectionErrors
+    try:
+        message = MessageSchema(
+            subject="Upcoming birthdays",
+            recipients=[email],
+            template_body={"username": username, "birthdays": birthdays},
+            subtype=MessageType.html
+        )
+
+        fm = FastMail(get_conf())
+        await fm.send_message(message, template_name="birthday_digest.html")
+        return True
+    except ConnectionErrors as err:
+        logger.error("Could not send birthday digest to %s: %s", email, err)
+        return False
@@ -0,0 +1,142 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from conf.config import settings
+
+request_id: ContextVar = ContextVar("request_id", default=None)
+
+access_logger = logging.getLogger("access")
+
+# LogRecord attributes that are not user-supplied extras.
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id while still on the logging thread of the caller."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats in ``prepare``, i.e. on the event loop. Here the
+    record is queued as-is and only the request id is captured up front.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id and any ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RESERVED)
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level: str = None) -> None:
+    """
+    Routes all logging through a queue to a background thread that formats JSON lines to stdout.
+
+    Safe to call more than once; only the first call installs the handlers.
+
+    :param level: Root log level, ``settings.log_level`` by default.
+    :type level: str
+    """
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level or settings.log_level)
+    # uvicorn installs its own synchronous handlers; send its records through the queue too.
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+
+
+def should_log_access(status: int, duration_ms: float) -> bool:
+    if status >= 500 or duration_ms >= settings.access_log_slow_ms:
+        return True
+    return random.random() < settings.access_log_sample_rate
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware that assigns a request id and writes a sampled access log entry with timings.
+
+    The id is taken from ``X-Request-ID`` when the client sends one and is echoed back
+    in the response. Server errors and slow requests are always logged; the rest
+    according to ``settings.access_log_sample_rate``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope["headers"]).get(b"x-request-id")
+        rid = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex
+        token = request_id.set(rid)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if should_log_access(status, duration_ms):
+                route = scope.get("route")
+                extra = {
+                    "method": scope["method"], "path": scope["path"], "route": getattr(route, "path", None),
+                    "status": status, "duration_ms": round(duration_ms, 3),
+                    "client": scope["client"][0] if scope.get("client") else None,
+                }
+                if "compression" in scope:
+                    extra["compression"] = scope["compression"]
+                access_logger.info("%s %s %s", scope["method"], scope["path"], status, extra=extra)
+            request_id.reset(token)
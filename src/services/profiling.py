@@ -0,0 +1,100 @@
+import cProfile
+import hmac
+import importlib.util
+import random
+import re
+import time
+from pathlib import Path
+from typing import Callable
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+from conf.config import settings
+
+PROFILE_HEADER = "x-profile"
+PROFILE_FILE_HEADER = "X-Profile-File"
+
+HAS_PYINSTRUMENT = importlib.util.find_spec("pyinstrument") is not None
+
+# cProfile hooks the whole thread, so only one request is profiled at a time.
+_active = False
+
+
+def profiling_enabled() -> bool:
+    """
+    Whether the profiling middleware should be installed at all.
+
+    :return: True if an admin token or a sampling rate is configured.
+    :rtype: bool
+    """
+    return bool(settings.profiling_token) or settings.profiling_sample_rate > 0
+
+
+def should_profile(request: Request) -> bool:
+    """
+    Decides whether to profile a request.
+
+    :param request: The incoming request.
+    :type request: Request
+    :return: True if the admin header carries the profiling token, or the request was sampled.
+    :rtype: bool
+    """
+    token = request.headers.get(PROFILE_HEADER)
+    if token and settings.profiling_token and hmac.compare_digest(token, settings.profiling_token):
+        return True
+    return random.random() < settings.profiling_sample_rate
+
+
+def _profile_path(request: Request, suffix: str) -> Path:
+    directory = Path(settings.profiling_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", request.url.path).strip("_") or "root"
+    return directory / f"{int(time.time() * 1000)}-{request.method}-{slug}{suffix}"
+
+
+async def _run_pyinstrument(request: Request, call_next: Callable):
+    from pyinstrument import Profiler
+
+    profiler = Profiler(async_mode="enabled")
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+    path = _profile_path(request, ".html")
+    # Rendering walks the whole sample tree and the file can be megabytes; keep both off the loop.
+    await run_in_threadpool(lambda: path.write_text(profiler.output_html()))
+    return response, path
+
+
+async def _run_cprofile(request: Request, call_next: Callable):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.disable()
+    path = _profile_path(request, ".prof")
+    await run_in_threadpool(profiler.dump_stats, path)
+    return response, path
+
+
+async def profile_request(request: Request, call_next: Callable):
+    """
+    Profiles the request when triggered and names the written file in ``X-Profile-File``.
+
+    Uses pyinstrument (HTML flame view) when installed, cProfile (``.prof`` stats, open
+    with ``snakeviz`` or ``pstats``) otherwise. Only installed when :func:`profiling_enabled`.
+    """
+    global _active
+    if _active or not should_profile(request):
+        return await call_next(request)
+    _active = True
+    try:
+        run = _run_pyinstrument if HAS_PYINSTRUMENT else _run_cprofile
+        response, path = await run(request, call_next)
+    finally:
+        _active = False
+    response.headers[PROFILE_FILE_HEADER] = path.name
+    return response
@@ -0,0 +1,84 @@
+"""
+Where uploaded files end up.
+
+A backend hands out temporary paths to stream uploads into and then stores a finished
+file under a key. ``settings.avatar_storage`` picks the backend.
+"""
+import os
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from fastapi.concurrency import run_in_threadpool
+
+from conf.config import settings
+
+
+class LocalStorage:
+    """
+    Files under ``root``, served by the app at ``base_url``.
+
+    Uploads are written to ``root/.incoming`` and renamed into place, so a file is
+    never visible half-written and committing it costs no copy.
+    """
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+
+    def temp_path(self) -> str:
+        incoming = self.root / ".incoming"
+        incoming.mkdir(parents=True, exist_ok=True)
+        return str(incoming / uuid.uuid4().hex)
+
+    async def put(self, path: str, key: str) -> str:
+        """
+        Moves a finished temporary file to ``key``.
+
+        :return: The public URL of the stored file.
+        :rtype: str
+        """
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+        return f"{self.base_url}/{key.split('/', 1)[-1]}"
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+
+class CloudinaryStorage(LocalStorage):
+    """
+    Spools uploads to a local temporary directory and hands the finished file to Cloudinary.
+
+    Needs the optional ``cloudinary`` package and the ``cloudinary_*`` settings.
+    """
+
+    def __init__(self, spool_dir: str):
+        super().__init__(spool_dir, "")
+        import cloudinary
+        cloudinary.config(cloud_name=settings.cloudinary_name, api_key=settings.cloudinary_api_key,
+                          api_secret=settings.cloudinary_api_secret, secure=True)
+
+    async def put(self, path: str, key: str) -> str:
+        import cloudinary.uploader
+        try:
+            # Content-hash keys never change, so an existing upload is reused as is.
+            result = await run_in_threadpool(cloudinary.uploader.upload, path, public_id=key.rsplit(".", 1)[0],
+                                             overwrite=False, resource_type="image")
+        finally:
+            os.remove(path)
+        return result["secure_url"]
+
+
+@lru_cache
+def get_storage() -> LocalStorage:
+    """
+    The storage backend named by ``settings.avatar_storage``: ``local`` or ``cloudinary``.
+
+    :return: The configured storage.
+    :rtype: LocalStorage
+    """
+    if settings.avatar_storage == "cloudinary":
+        return CloudinaryStorage(os.path.join(settings.avatar_dir, ".spool"))
+    return LocalStorage(settings.avatar_dir, settings.avatar_base_url)
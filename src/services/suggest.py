@@ -0,0 +1,152 @@
+"""
+Type-ahead suggestions from an in-process prefix index.
+
+Each user's index is a sorted list of ``(term, contact_id)`` pairs, where the terms are
+the lower-cased first name, last name, full name and email. A prefix query is a
+binary search to the first term with the prefix followed by a short scan.
+
+Indexes are built from the primary on the first suggestion request for a user and
+kept up to date by the contacts repository. Every committed change also reaches every
+worker through the change feed, which drops the user's index there unless that worker
+made the change itself; a lost feed drops them all. ``settings.suggest_ttl`` is the
+backstop for writes that never reach the feed. The cache holds at most
+``settings.suggest_cache_entries`` terms across all users, evicting the least recently
+used indexes first.
+"""
+import time
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from typing import List, Optional
+
+from conf.config import settings
+
+
+def suggestion_terms(first_name: Optional[str], last_name: Optional[str], email: Optional[str]) -> set:
+    parts = [(first_name or "").strip().lower(), (last_name or "").strip().lower(), (email or "").strip().lower()]
+    full_name = " ".join(part for part in parts[:2] if part)
+    return {term for term in (*parts, full_name) if term}
+
+
+class PrefixIndex:
+
+    def __init__(self, contacts=()):
+        self.contacts = {}
+        self.entries = []
+        # Contact ids written through this index whose change-feed events have not arrived yet.
+        self.applied = Counter()
+        for contact in contacts:
+            self.entries.extend((term, contact.id) for term in self._store(contact))
+        self.entries.sort()
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def _store(self, contact) -> set:
+        self.contacts[contact.id] = {"id": contact.id, "first_name": contact.first_name,
+                                     "last_name": contact.last_name, "email": contact.email}
+        return suggestion_terms(contact.first_name, contact.last_name, contact.email)
+
+    def add(self, contact) -> None:
+        self.remove(contact.id)
+        for term in self._store(contact):
+            insort(self.entries, (term, contact.id))
+
+    def remove(self, contact_id: int) -> None:
+        suggestion = self.contacts.pop(contact_id, None)
+        if suggestion is None:
+            return
+        for term in suggestion_terms(suggestion["first_name"], suggestion["last_name"], suggestion["email"]):
+            i = bisect_left(self.entries, (term, contact_id))
+            if i < len(self.entries) and self.entries[i] == (term, contact_id):
+                del self.entries[i]
+
+    def search(self, prefix: str, limit: int = 10) -> List[dict]:
+        """
+        :return: Up to ``limit`` contacts with a term starting with ``prefix``, in term order.
+        :rtype: List[dict]
+        """
+        prefix = prefix.strip().lower()
+        found = {}
+        i = bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and len(found) < limit:
+            term, contact_id = self.entries[i]
+            if not term.startswith(prefix):
+                break
+            found.setdefault(contact_id, self.contacts[contact_id])
+            i += 1
+        return list(found.values())
+
+
+class SuggestIndexes:
+    """Per-user :class:`PrefixIndex` cache with a lifetime and an LRU bound on the total number of entries."""
+
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.size = 0
+        self._indexes = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[PrefixIndex]:
+        entry = self._indexes.get(user_id)
+        ttl = settings.suggest_ttl if self.ttl is None else self.ttl
+        if entry is None or time.monotonic() - entry[0] > ttl:
+            self.drop(user_id)
+            return None
+        self._indexes.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id: int, index: PrefixIndex) -> None:
+        self.drop(user_id)
+        self._indexes[user_id] = (time.monotonic(), index)
+        self.size += len(index.entries)
+        self._evict()
+
+    def drop(self, user_id: int) -> None:
+        entry = self._indexes.pop(user_id, None)
+        if entry:
+            self.size -= len(entry[1].entries)
+
+    def _evict(self) -> None:
+        max_entries = settings.suggest_cache_entries if self.max_entries is None else self.max_entries
+        # An index larger than the whole budget evicts itself and is rebuilt on every request.
+        while self.size > max_entries:
+            self.drop(next(iter(self._indexes)))
+
+    def _apply(self, user_id: int, contact_id: int, change) -> None:
+        entry = self._indexes.get(user_id)
+        if entry:
+            index = entry[1]
+            before = len(index.entries)
+            change(index)
+            index.applied[contact_id] += 1
+            self.size += len(index.entries) - before
+            self._evict()
+
+    def contact_saved(self, contact) -> None:
+        self._apply(contact.user_id, contact.id, lambda index: index.add(contact))
+
+    def contact_deleted(self, user_id: int, contact_id: int) -> None:
+        self._apply(user_id, contact_id, lambda index: index.remove(contact_id))
+
+    def contact_changed(self, user_id: int, contact_id: int) -> None:
+        """
+        A change committed by any worker, from the change feed. Drops the user's index
+        unless this worker already applied the change to it.
+        """
+        entry = self._indexes.get(user_id)
+        if entry is None:
+            return
+        applied = entry[1].applied
+        if applied[contact_id] > 0:
+            applied[contact_id] -= 1
+            if not applied[contact_id]:
+                del applied[contact_id]
+        else:
+            self.drop(user_id)
+
+    def clear(self) -> None:
+        self._indexes.clear()
+        self.size = 0
+
+
+suggest_indexes = SuggestIndexes()
@@ -0,0 +1,103 @@
+"""
+Delta sync tokens.
+
+A token carries the user's contact version when it was issued and the issue time,
+signed with ``settings.secret_key`` so a client cannot move either.
+Deletions are remembered as tombstones for ``settings.sync_token_max_age_days``;
+:func:`purge_expired_tombstones` drops the older ones::
+
+    python -m services.sync purge            # once, e.g. from cron
+    python -m services.sync purge --daily    # keep running, once a day after midnight
+
+An older token could miss deletions, so it is treated like no token at all and the
+client gets a full download.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from conf.config import settings
+from repository.contacts import purge_tombstones
+
+logger = logging.getLogger(__name__)
+
+
+def _sign(payload: str) -> str:
+    return hmac.new(settings.secret_key.encode(), payload.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def encode_token(version: int, issued: float = None) -> str:
+    payload = f"{version}.{int(time.time() if issued is None else issued)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def decode_token(token: str | None) -> int | None:
+    """
+    The version a sync token stands for.
+
+    :param token: The ``since`` token from a previous sync.
+    :type token: str | None
+    :return: The version, or None if there is no token or it has expired.
+    :rtype: int | None
+    :raises ValueError: If the token is malformed or not signed by us.
+    """
+    if not token:
+        return None
+    payload, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise ValueError(f"bad signature on sync token {token!r}")
+    version, _, issued = payload.partition(".")
+    version, issued = int(version), int(issued)
+    if version < 0:
+        raise ValueError(f"negative version in sync token {token!r}")
+    if issued < time.time() - settings.sync_token_max_age_days * 86400:
+        return None
+    return version
+
+
+async def purge_expired_tombstones(db: Session) -> int:
+    """
+    Removes the tombstones that only expired tokens could still need.
+
+    :param db: The database session.
+    :type db: Session
+    :return: The number of tombstones removed.
+    :rtype: int
+    """
+    # deleted_at is naive UTC.
+    return await purge_tombstones(db, datetime.utcnow() - timedelta(days=settings.sync_token_max_age_days))
+
+
+async def purge(daily: bool = False) -> None:
+    from database.db import SessionLocal
+    while True:
+        with SessionLocal() as db:
+            purged = await purge_expired_tombstones(db)
+        logger.info("Purged %s expired sync tombstones", purged)
+        if not daily:
+            return
+        tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((tomorrow - datetime.now()).total_seconds())
+
+
+async def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m services.sync", description="Delta sync maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    purge_command = commands.add_parser("purge", help="Remove the tombstones no unexpired sync token can need")
+    purge_command.add_argument("--daily", action="store_true", help="Keep running and purge once a day")
+    args = parser.parse_args(argv)
+
+    if args.command == "purge":
+        await purge(daily=args.daily)
+
+
+if __name__ == "__main__":
+    from services.log import setup_logging
+    setup_logging(settings.log_level)
+    asyncio.run(main())
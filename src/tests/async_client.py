@@ -0,0 +1,74 @@
+import asyncio
+import logging
+
+import httpx
+
+_SLOW_CALLBACK = "Executing %s took %.3f seconds"
+
+
+class AsyncAppClient(httpx.AsyncClient):
+    """
+    In-process client that talks to the ASGI app on the test's own event loop.
+
+    Unlike ``TestClient`` it does not hop to a portal thread, so several requests
+    can be in flight at once::
+
+        async with AsyncAppClient(app) as client:
+            responses = await client.concurrently(20, "GET", "/api/contacts/", headers=headers)
+    """
+
+    def __init__(self, app, **kwargs):
+        transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 50000))
+        super().__init__(transport=transport, base_url="http://test", **kwargs)
+
+    async def concurrently(self, n: int, method: str, url: str, **kwargs) -> list:
+        """
+        Sends the same request ``n`` times at once.
+
+        :return: Responses in the order the requests were created.
+        :rtype: List[httpx.Response]
+        """
+        return await asyncio.gather(*(self.request(method, url, **kwargs) for _ in range(n)))
+
+
+class LoopBlockDetector(logging.Handler):
+    """
+    Fails when any event-loop callback runs longer than ``threshold`` seconds::
+
+        async with LoopBlockDetector(0.05):
+            await client.concurrently(10, "POST", "/api/auth/login", data=form)
+
+    Uses asyncio debug mode, which times every callback and reports the slow
+    ones through the ``asyncio`` logger. Entering and leaving yield to the loop
+    once, so the test's own task step is timed along with everything else.
+    """
+
+    def __init__(self, threshold: float = 0.05):
+        super().__init__(logging.WARNING)
+        self.threshold = threshold
+        self.blocks = []
+
+    def emit(self, record):
+        if record.msg == _SLOW_CALLBACK:
+            handle, seconds = record.args
+            self.blocks.append((seconds, handle))
+
+    async def __aenter__(self):
+        # Close the current task step first; the work done before entering is not ours to judge.
+        await asyncio.sleep(0)
+        self.loop = asyncio.get_running_loop()
+        self.saved = self.loop.get_debug(), self.loop.slow_callback_duration
+        self.loop.set_debug(True)
+        self.loop.slow_callback_duration = self.threshold
+        logging.getLogger("asyncio").addHandler(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.sleep(0)
+        logging.getLogger("asyncio").removeHandler(self)
+        self.loop.set_debug(self.saved[0])
+        self.loop.slow_callback_duration = self.saved[1]
+        if exc_type is None and self.blocks:
+            worst = "\n".join(f"  {seconds * 1000:.0f} ms in {handle}" for seconds, handle in sorted(self.blocks, reverse=True)[:5])
+            raise AssertionError(f"event loop blocked longer than {self.threshold * 1000:.0f} ms "
+                                 f"{len(self.blocks)} time(s):\n{worst}")
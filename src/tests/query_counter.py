@@ -0,0 +1,57 @@
+import re
+from collections import Counter
+
+from sqlalchemy import event
+
+from database.slow_queries import fingerprint
+
+
+# The conftest fixtures turn each session commit into savepoint statements; they are not the route's work.
+TRANSACTION_CONTROL = re.compile(r"^\s*(BEGIN|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b", re.IGNORECASE)
+
+
+class QueryCounter:
+    """
+    Records every statement an engine runs while the context is active, apart from
+    transaction control::
+
+        with QueryCounter(engine) as queries:
+            client.get("/api/contacts/")
+        assert queries.count == 2, queries.report()
+    """
+
+    def __init__(self, engine, n_plus_one: int = 3):
+        self.engine = engine
+        self.n_plus_one = n_plus_one
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if not TRANSACTION_CONTROL.match(statement):
+            self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def duplicates(self) -> dict:
+        """
+        :return: Fingerprints that ran more than once, with their counts.
+        :rtype: dict
+        """
+        counts = Counter(fingerprint(statement) for statement in self.statements)
+        return {sql: n for sql, n in counts.items() if n > 1}
+
+    def report(self) -> str:
+        lines = [f"{self.count} queries"]
+        lines += [f"  {n}: {statement}" for n, statement in enumerate(self.statements, 1)]
+        for sql, n in self.duplicates().items():
+            kind = "N+1" if n >= self.n_plus_one else "duplicate"
+            lines.append(f"  {kind} x{n}: {sql}")
+        return "\n".join(lines)
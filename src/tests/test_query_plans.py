@@ -0,0 +1,97 @@
+import re
+import unittest
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from database.models import Contact, User
+from repository.contacts import (birthday_window, create_contact, delete_contact, get_birthdays_by_owner, get_changes,
+                                 get_contacts_by_phone, list_contacts, merge_contacts, search_contacts, update_contact)
+from schemas import ContactCreate
+
+
+@pytest.mark.usefixtures("database")
+class TestContactsQueryPlans(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.session = self.db
+        self.user = User(username="deadpool", email="deadpool@example.com", password="secret")
+        self.session.add(self.user)
+        self.session.commit()
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._record)
+
+    def tearDown(self):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def _plan(self, statement, parameters):
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        return " | ".join(row[-1] for row in rows)
+
+    async def test_list_contacts_uses_user_name_index(self):
+        await list_contacts(self.session, self.user, skip=10, limit=20)
+        plan = self._plan(*self.statements[-1])
+        self.assertIn("ix_contacts_user_name", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    async def test_list_contacts_filtered_uses_user_name_index(self):
+        await list_contacts(self.session, self.user, first_name="Wade", last_name="Wil")
+        plan = self._plan(*self.statements[-1])
+        self.assertIn("ix_contacts_user_name", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    async def test_email_lookup_uses_user_email_index(self):
+        self.session.query(Contact).filter(Contact.user_id == self.user.id,
+                                           Contact.email == "wade@example.com").first()
+        plan = self._plan(*self.statements[-1])
+        self.assertIn("ix_contacts_user_email", plan)
+
+    async def test_birthday_chunk_uses_user_birthday_index(self):
+        await get_birthdays_by_owner(self.session, 0, birthday_window(date(2026, 10, 19), 7), 100)
+        plan = self._plan(*self.statements[-1])
+        self.assertIn("ix_contacts_user_birthday", plan)
+
+    async def test_phone_lookup_uses_user_phone_index(self):
+        await get_contacts_by_phone(self.session, self.user, "+48 500 600 700")
+        plan = self._plan(*self.statements[-1])
+        self.assertIn("ix_contacts_user_phone", plan)
+
+    async def test_user_paths_filter_on_the_partition_key(self):
+        # On Postgres contacts is hash-partitioned by user_id; a statement without it scans every partition.
+        body = {"first_name": "Wade", "last_name": "Wilson", "email": "wade@example.com",
+                "phone_number": "+48500600700", "birth_date": date(1990, 1, 1)}
+        contact = await create_contact(self.session, ContactCreate(id=0, **body), self.user)
+        other = await create_contact(self.session, ContactCreate(id=0, **{**body, "email": "w@example.com"}), self.user)
+        await update_contact(self.session, self.user, contact.id, ContactCreate(id=contact.id, **body))
+        await search_contacts(self.session, self.user, "wade")
+        await get_changes(self.session, self.user, 0)
+        await merge_contacts(self.session, self.user, contact.id, [other.id])
+        await delete_contact(self.session, self.user, contact.id)
+        statements = [statement for statement, _ in self.statements
+                      if re.search(r"\b(FROM|UPDATE|JOIN) contacts\b", statement)]
+        self.assertGreater(len(statements), 5)
+        for statement in statements:
+            self.assertIn("contacts.user_id = ?", statement)
+
+    def test_phone_is_normalized_on_write(self):
+        contact = Contact(first_name="Wade", last_name="Wilson", phone_number="0048 (500) 600-700", user=self.user)
+        self.assertEqual(contact.phone_e164, "+48500600700")
+        contact.phone_number = "not a number"
+        self.assertIsNone(contact.phone_e164)
+
+    def test_email_is_unique_per_user(self):
+        other = User(username="colossus", email="colossus@example.com", password="secret")
+        self.session.add(other)
+        self.session.add(Contact(first_name="Wade", last_name="Wilson", email="wade@example.com", user=self.user))
+        self.session.add(Contact(first_name="Wade", last_name="Wilson", email="wade@example.com", user=other))
+        self.session.commit()
+        self.assertEqual(self.session.query(Contact).count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import hashlib
+import io
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi_limiter import FastAPILimiter
+
+from conf.config import settings
+from database.models import Contact, User
+from loadtest.local_redis import LocalRedis
+from main import app
+from repository.auth import create_access_token
+from services.avatars import HAS_PILLOW, close_thumbnail_pool, image_type
+from services.storage import get_storage
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+
+
+def fake_thumbnail(source, target, size):
+    Path(target).write_bytes(b"RIFF\x00\x00\x00\x00WEBP" + str(size).encode())
+
+
+class TestImageType(unittest.TestCase):
+
+    def test_detects_by_magic_bytes(self):
+        self.assertEqual(image_type(PNG), "png")
+        self.assertEqual(image_type(b"\xff\xd8\xff\xe0rest"), "jpg")
+        self.assertEqual(image_type(b"GIF89a......"), "gif")
+        self.assertEqual(image_type(b"RIFF\x10\x00\x00\x00WEBPVP8 "), "webp")
+        self.assertIsNone(image_type(b"<svg xmlns="))
+
+
+@pytest.mark.usefixtures("database")
+class TestRouteAvatars(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.media = tempfile.mkdtemp()
+        self.settings = patch.multiple(settings, avatar_dir=self.media, avatar_max_bytes=1024)
+        self.settings.start()
+        get_storage.cache_clear()
+        await FastAPILimiter.init(LocalRedis())
+
+        with self.session_factory() as db:
+            user = User(username="deadpool", email="deadpool@example.com", password="secret", confirmed=True)
+            db.add(user)
+            db.flush()
+            contact = Contact(first_name="Wade", last_name="Wilson", email="wade@example.com",
+                              phone_number="+48500600700", birth_date=date(1990, 1, 1), user_id=user.id)
+            db.add(contact)
+            db.commit()
+            self.contact_id = contact.id
+
+        token = await create_access_token(data={"sub": "deadpool@example.com"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 50000))
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        close_thumbnail_pool()
+        self.settings.stop()
+        get_storage.cache_clear()
+        shutil.rmtree(self.media)
+
+    async def upload(self, url, content, filename="avatar.png"):
+        return await self.client.put(url, headers=self.headers, files={"file": (filename, content, "image/png")})
+
+    def stored(self, model, **filters):
+        with self.session_factory() as db:
+            row = db.query(model).filter_by(**filters).one()
+            return row.avatar, row.avatar_thumbnail
+
+    @patch("services.avatars.HAS_PILLOW", False)
+    async def test_contact_avatar_is_stored_under_its_hash(self):
+        response = await self.upload(f"/api/contacts/{self.contact_id}/avatar", PNG)
+        self.assertEqual(response.status_code, 200, response.text)
+        digest = hashlib.sha256(PNG).hexdigest()
+        self.assertEqual(response.json(), {"avatar": f"/api/avatars/{digest}.png", "avatar_thumbnail": None})
+        self.assertEqual(self.stored(Contact, id=self.contact_id), (f"/api/avatars/{digest}.png", None))
+        self.assertEqual((Path(self.media) / "avatars" / f"{digest}.png").read_bytes(), PNG)
+        self.assertEqual(list((Path(self.media) / ".incoming").iterdir()), [])
+
+    @patch("services.avatars.HAS_PILLOW", False)
+    async def test_served_with_immutable_cache_headers(self):
+        url = (await self.upload("/api/users/me/avatar", PNG)).json()["avatar"]
+        response = await self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, PNG)
+        self.assertEqual(response.headers["cache-control"], "public, max-age=31536000, immutable")
+        self.assertEqual(self.stored(User, email="deadpool@example.com")[0], url)
+        self.assertEqual((await self.client.get("/api/avatars/..%2Fsecret.png")).status_code, 404)
+        self.assertEqual((await self.client.get(f"/api/avatars/{'0' * 64}.png")).status_code, 404)
+
+    @patch("services.avatars.make_thumbnail", fake_thumbnail)
+    @patch("services.avatars.HAS_PILLOW", True)
+    async def test_thumbnail_is_made_in_the_pool(self):
+        # The fake is pickled by reference, so the spawned worker runs it too.
+        response = await self.upload("/api/users/me/avatar", PNG)
+        digest = hashlib.sha256(PNG).hexdigest()
+        self.assertEqual(response.json()["avatar_thumbnail"], f"/api/avatars/{digest}_128.webp")
+        self.assertTrue((Path(self.media) / "avatars" / f"{digest}_128.webp").is_file())
+
+    @unittest.skipUnless(HAS_PILLOW, "Pillow is not installed")
+    async def test_thumbnail_is_resized(self):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (400, 200), "red").save(buffer, "PNG")
+        response = await self.upload("/api/users/me/avatar", buffer.getvalue())
+        self.assertEqual(response.status_code, 200, response.text)
+        name = response.json()["avatar_thumbnail"].rsplit("/", 1)[1]
+        with Image.open(Path(self.media) / "avatars" / name) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ("WEBP", (128, 64)))
+
+    async def test_rejects_large_or_non_image_files(self):
+        url = f"/api/contacts/{self.contact_id}/avatar"
+        self.assertEqual((await self.upload(url, PNG * 10)).status_code, 413)
+        self.assertEqual((await self.upload(url, b"<svg></svg>", "avatar.svg")).status_code, 415)
+        self.assertEqual((await self.upload("/api/contacts/999/avatar", PNG)).status_code, 404)
+        self.assertEqual(self.stored(Contact, id=self.contact_id), (None, None))
+        self.assertEqual(list((Path(self.media) / ".incoming").iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+import tempfile
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from fastapi import HTTPException
+from fastapi_limiter import FastAPILimiter
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+from conf.config import settings
+
+from async_client import AsyncAppClient
+from database.db import get_db
+from database.models import Base, Contact, User
+from loadtest.local_redis import LocalRedis
+from main import app
+from query_counter import QueryCounter
+from repository.auth import create_access_token
+
+
+class TestRouteBatch(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        # A file, not StaticPool, so connection checkouts can be counted.
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmp.name}/batch.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=self.engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        await FastAPILimiter.init(LocalRedis())
+
+        with session_factory() as db:
+            user = User(username="deadpool", email="deadpool@example.com", password="secret", confirmed=True)
+            db.add(user)
+            db.flush()
+            db.add_all(Contact(first_name=f"Wade{i}", last_name="Wilson", email=f"wade{i}@example.com",
+                               phone_number="+48500600700", birth_date=date.today(), user_id=user.id)
+                       for i in range(3))
+            db.commit()
+            self.contact_id = db.query(Contact).first().id
+
+        token = await create_access_token(data={"sub": "deadpool@example.com"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = AsyncAppClient(app)
+        self.checkouts = 0
+        event.listen(self.engine, "checkout", self._checkout)
+
+    def _checkout(self, *args):
+        self.checkouts += 1
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        app.dependency_overrides.pop(get_db, None)
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    async def batch(self, *urls, headers=None):
+        return await self.client.post("/api/batch", headers=self.headers if headers is None else headers,
+                                      json={"requests": [{"url": url} for url in urls]})
+
+    async def test_results_in_order_with_one_session(self):
+        with QueryCounter(self.engine) as queries:
+            response = await self.batch("/api/contacts/?limit=2", "/api/contacts/upcoming_birthdays/", "/secret",
+                                        f"/api/contacts/{self.contact_id}")
+        self.assertEqual(response.status_code, 200, response.text)
+        results = response.json()
+        self.assertEqual([r["status"] for r in results], [200, 200, 200, 200])
+        self.assertEqual(len(results[0]["body"]), 2)
+        self.assertEqual(len(results[1]["body"]), 3)
+        self.assertEqual(results[2]["body"], {"message": "secret router", "owner": "deadpool@example.com"})
+        self.assertEqual(results[3]["body"]["id"], self.contact_id)
+        self.assertEqual(results[3]["headers"]["content-type"], "application/json")
+        # One authentication for the batch, then one query per sub-request that needs the database.
+        self.assertEqual(queries.count, 4, queries.report())
+        self.assertEqual(self.checkouts, 1)
+
+    async def test_errors_are_reported_per_request(self):
+        response = await self.batch("/api/contacts/999", "/api/missing", "/api/contacts/?limit=x",
+                                    "/api/contacts/?limit=1")
+        self.assertEqual([r["status"] for r in response.json()], [404, 404, 422, 200])
+        self.assertEqual(response.json()[0]["body"], {"detail": "Contact not found"})
+
+    async def test_rejects_writes_oversized_and_anonymous_batches(self):
+        response = await self.client.post("/api/batch", headers=self.headers,
+                                          json={"requests": [{"method": "DELETE", "url": "/api/contacts/1"}]})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual((await self.batch(*["/secret"] * 21)).status_code, 422)
+        self.assertEqual((await self.batch("/secret", headers={})).status_code, 401)
+
+    async def test_only_batchable_routes_run(self):
+        # Streaming never finishes, and these two write through the session.
+        response = await asyncio.wait_for(self.batch("/api/contacts/events", "/api/auth/refresh_token",
+                                                     "/api/auth/confirmed_email/token", "/api/contacts/?limit=1"), 5)
+        self.assertEqual([r["status"] for r in response.json()], [400, 400, 400, 200])
+        self.assertEqual(response.json()[0]["body"], {"detail": "/api/contacts/events cannot be part of a batch"})
+
+    async def test_slow_sub_requests_time_out(self):
+        async def hang(*args):
+            await asyncio.Event().wait()
+
+        with patch("routes.contacts.search_contacts", hang), patch.object(settings, "batch_item_timeout", 0.1):
+            response = await self.batch("/api/contacts/search?q=wade", f"/api/contacts/{self.contact_id}")
+        self.assertEqual([r["status"] for r in response.json()], [504, 200])
+
+    def test_get_db_keeps_the_batch_session_from_other_routes(self):
+        request = Request({"type": "http", "batch": {"session": object()}, "route": None})
+        with self.assertRaises(HTTPException) as raised:
+            next(get_db(request))
+        self.assertEqual(raised.exception.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi_limiter import FastAPILimiter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from async_client import AsyncAppClient, LoopBlockDetector
+from database.db import get_db
+from database.models import Base, Contact, User
+from loadtest.local_redis import LocalRedis
+import main
+from main import app
+from repository.auth import Hash, create_access_token
+from services.auth import auth_service
+
+PASSWORD = "123456789"
+# Shorter than the default 30 s, so a checkout that waits on the loop fails the test quickly.
+POOL_TIMEOUT = 1.0
+
+
+class TestLoopBlockDetector(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        blocking_app = FastAPI()
+
+        @blocking_app.get("/sleep")
+        async def sleep():
+            time.sleep(0.2)
+            return {}
+
+        self.client = AsyncAppClient(blocking_app)
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_flags_blocking_handler(self):
+        with self.assertRaisesRegex(AssertionError, "event loop blocked"):
+            async with LoopBlockDetector(0.1):
+                await self.client.get("/sleep")
+
+
+class TestRouteConcurrency(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.password_hash = Hash().get_password_hash(PASSWORD)
+
+    async def asyncSetUp(self):
+        # A file, not StaticPool: concurrent requests must not share one connection.
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmp.name}/concurrency.db",
+                                    connect_args={"check_same_thread": False}, pool_timeout=POOL_TIMEOUT)
+        Base.metadata.create_all(bind=self.engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        await FastAPILimiter.init(LocalRedis())
+
+        with session_factory() as db:
+            user = User(username="deadpool", email="deadpool@example.com", password=self.password_hash, confirmed=True)
+            db.add(user)
+            db.flush()
+            db.add_all(Contact(first_name=f"Wade{i}", last_name="Wilson", email=f"wade{i}@example.com",
+                               phone_number="+48500600700", birth_date=date.today(), user_id=user.id) for i in range(5))
+            db.commit()
+
+        token = await create_access_token(data={"sub": "deadpool@example.com"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = AsyncAppClient(app)
+        # The first request pays for lazy imports; keep it out of the measured window.
+        await self.client.get("/api/contacts/", headers=self.headers)
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        app.dependency_overrides.pop(get_db, None)
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    async def test_concurrent_reads(self):
+        # Stay within the default pool (5 + 10 overflow). The threshold is well above scheduling
+        # noise on a busy machine and well below POOL_TIMEOUT, which a checkout wait would take.
+        async with LoopBlockDetector(POOL_TIMEOUT / 2):
+            responses = await self.client.concurrently(15, "GET", "/api/contacts/", headers=self.headers)
+        self.assertEqual({r.status_code for r in responses}, {200})
+        self.assertEqual({len(r.json()) for r in responses}, {5})
+
+    @unittest.expectedFailure
+    async def test_concurrent_reads_above_the_pool_size(self):
+        # Routes use their sessions on the loop thread, and a request returns its connection only in
+        # get_db's teardown. The 16th checkout therefore blocks the loop until POOL_TIMEOUT and fails.
+        async with LoopBlockDetector(POOL_TIMEOUT / 2):
+            responses = await self.client.concurrently(16, "GET", "/api/contacts/", headers=self.headers)
+        self.assertEqual({r.status_code for r in responses}, {200})
+
+    async def test_concurrent_logins_hash_off_the_loop(self):
+        loop_thread = threading.get_ident()
+        hashed_on = []
+        verify_password = auth_service.verify_password
+
+        def record_thread(*args):
+            hashed_on.append(threading.get_ident())
+            return verify_password(*args)
+
+        form = {"username": "deadpool@example.com", "password": PASSWORD}
+        with patch.object(auth_service, "verify_password", record_thread):
+            responses = await self.client.concurrently(4, "POST", "/api/auth/login", data=form)
+        self.assertEqual({r.status_code for r in responses}, {200}, [r.text for r in responses])
+        self.assertEqual(len(hashed_on), 4)
+        self.assertNotIn(loop_thread, hashed_on)
+
+    async def test_concurrent_root_logins_hash_off_the_loop(self):
+        loop_thread = threading.get_ident()
+        hashed_on = []
+        verify_password = main.hash_handler.verify_password
+
+        def record_thread(*args):
+            hashed_on.append(threading.get_ident())
+            return verify_password(*args)
+
+        form = {"username": "deadpool@example.com", "password": PASSWORD}
+        with patch.object(main.hash_handler, "verify_password", record_thread):
+            responses = await self.client.concurrently(4, "POST", "/login", data=form)
+        self.assertEqual({r.status_code for r in responses}, {200}, [r.text for r in responses])
+        self.assertEqual(len(hashed_on), 4)
+        self.assertNotIn(loop_thread, hashed_on)
+
+if __name__ == '__main__':
+    unittest.main()
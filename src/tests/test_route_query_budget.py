@@ -0,0 +1,177 @@
+import tempfile
+import unittest
+from datetime import date
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+from fastapi_limiter import FastAPILimiter
+
+from conf.config import settings
+from database.models import Contact, User
+from loadtest.local_redis import LocalRedis
+from main import app
+from query_counter import QueryCounter
+from repository.auth import Hash, create_access_token, create_refresh_token
+from services.auth import auth_service
+from services.storage import get_storage
+from services.suggest import suggest_indexes
+
+PASSWORD = "123456789"
+
+
+@pytest.mark.usefixtures("database")
+class TestRouteQueryBudget(unittest.IsolatedAsyncioTestCase):
+    """Exact number of statements each route may run. Raise a budget only on purpose."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.password_hash = Hash().get_password_hash(PASSWORD)
+
+    async def asyncSetUp(self):
+        await FastAPILimiter.init(LocalRedis())
+
+        with self.session_factory() as db:
+            user = User(username="deadpool", email="deadpool@example.com", password=self.password_hash, confirmed=True)
+            db.add(user)
+            db.flush()
+            db.add_all(Contact(first_name=f"Wade{i}", last_name="Wilson", email=f"wade{i}@example.com",
+                               phone_number="+48500600700", birth_date=date.today(), user_id=user.id)
+                       for i in range(5))
+            # A non-default lifetime keeps the token different from the ones the routes issue.
+            self.refresh_token = await create_refresh_token(data={"sub": user.email}, expires_delta=3600)
+            user.refresh_token = self.refresh_token
+            db.commit()
+            self.contact_id = db.query(Contact).first().id
+
+        token = await create_access_token(data={"sub": "deadpool@example.com"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 50000))
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def assertQueries(self, budget, method, url, status_code=200, **kwargs):
+        with QueryCounter(self.engine) as queries:
+            response = await self.client.request(method, url, **kwargs)
+        self.assertEqual(response.status_code, status_code, response.text)
+        self.assertEqual(queries.count, budget, queries.report())
+        self.assertFalse([n for n in queries.duplicates().values() if n >= queries.n_plus_one], queries.report())
+        return response
+
+    def contact_body(self, **fields):
+        body = {"id": self.contact_id, "first_name": "Wade", "last_name": "Wilson", "email": "wade@example.com",
+                "phone_number": "+48500600700", "birth_date": date.today().isoformat()}
+        body.update(fields)
+        return body
+
+    # routes/contacts.py
+
+    async def test_create_contact(self):
+        await self.assertQueries(4, "POST", "/api/contacts/", 201, headers=self.headers,
+                                 json=self.contact_body(email="new@example.com"))
+
+    async def test_read_contacts(self):
+        response = await self.assertQueries(2, "GET", "/api/contacts/", headers=self.headers)
+        self.assertEqual(len(response.json()), 5)
+
+    async def test_read_contacts_by_extra_data(self):
+        response = await self.assertQueries(2, "GET", "/api/contacts/?extra.company=Acme", headers=self.headers)
+        self.assertEqual(response.json(), [])
+
+    async def test_read_contact(self):
+        await self.assertQueries(2, "GET", f"/api/contacts/{self.contact_id}", headers=self.headers)
+
+    async def test_update_contact(self):
+        await self.assertQueries(5, "PUT", f"/api/contacts/{self.contact_id}", headers=self.headers,
+                                 json=self.contact_body(first_name="Deadpool"))
+
+    async def test_delete_contact(self):
+        await self.assertQueries(5, "DELETE", f"/api/contacts/{self.contact_id}", 204, headers=self.headers)
+
+    async def test_search_contacts(self):
+        response = await self.assertQueries(2, "GET", "/api/contacts/search?q=Wlison&limit=3", headers=self.headers)
+        self.assertEqual(len(response.json()), 3)
+
+    async def test_read_suggestions(self):
+        suggest_indexes.clear()
+        # The first call loads the prefix index; later ones only authenticate.
+        await self.assertQueries(2, "GET", "/api/contacts/suggest?q=wade", headers=self.headers)
+        await self.client.post("/api/contacts/", headers=self.headers, json=self.contact_body(first_name="Wanda",
+                                                                                              email="wanda@example.com"))
+        response = await self.assertQueries(1, "GET", "/api/contacts/suggest?q=wa&limit=3", headers=self.headers)
+        self.assertEqual([s["first_name"] for s in response.json()], ["Wade0", "Wade1", "Wade2"])
+        response = await self.assertQueries(1, "GET", "/api/contacts/suggest?q=wan", headers=self.headers)
+        self.assertEqual([s["first_name"] for s in response.json()], ["Wanda"])
+
+    async def test_read_contacts_by_phone(self):
+        response = await self.assertQueries(2, "GET", "/api/contacts/by-phone/0048 500 600 700", headers=self.headers)
+        self.assertEqual(len(response.json()), 5)
+
+    async def test_read_duplicates(self):
+        response = await self.assertQueries(2, "GET", "/api/contacts/duplicates", headers=self.headers)
+        self.assertEqual(len(response.json()[0]["contact_ids"]), 5)
+
+    async def test_merge_contacts(self):
+        duplicate_ids = [self.contact_id + 1, self.contact_id + 2]
+        await self.assertQueries(7, "POST", "/api/contacts/merge", headers=self.headers,
+                                 json={"primary_id": self.contact_id, "duplicate_ids": duplicate_ids})
+
+    async def test_read_changes(self):
+        response = await self.assertQueries(2, "GET", "/api/contacts/changes", headers=self.headers)
+        self.assertEqual(len(response.json()["changed"]), 5)
+        # Changed contacts and tombstones are two range scans on (user_id, version).
+        await self.assertQueries(3, "GET", f"/api/contacts/changes?since={response.json()['token']}",
+                                 headers=self.headers)
+
+    async def test_read_upcoming_birthdays(self):
+        response = await self.assertQueries(1, "GET", "/api/contacts/upcoming_birthdays/")
+        self.assertEqual(len(response.json()), 5)
+
+    # routes/avatars.py
+
+    async def test_upload_avatars(self):
+        png = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+        with tempfile.TemporaryDirectory() as media, patch.object(settings, "avatar_dir", media), \
+                patch("services.avatars.HAS_PILLOW", False):
+            get_storage.cache_clear()
+            await self.assertQueries(4, "PUT", f"/api/contacts/{self.contact_id}/avatar", headers=self.headers,
+                                     files={"file": ("a.png", png)})
+            await self.assertQueries(2, "PUT", "/api/users/me/avatar", headers=self.headers,
+                                     files={"file": ("a.png", png)})
+        get_storage.cache_clear()
+
+    # routes/batch.py
+
+    async def test_batch(self):
+        # Authenticates once; each sub-request then runs only its own queries.
+        urls = ["/api/contacts/", "/api/contacts/upcoming_birthdays/", "/secret", f"/api/contacts/{self.contact_id}"]
+        await self.assertQueries(4, "POST", "/api/batch", headers=self.headers,
+                                 json={"requests": [{"url": url} for url in urls]})
+
+    # routes/auth.py
+
+    async def test_signup(self):
+        with patch("routes.auth.send_email", AsyncMock()):
+            await self.assertQueries(3, "POST", "/api/auth/signup", 201,
+                                     json={"username": "colossus", "email": "colossus@example.com", "password": PASSWORD})
+
+    async def test_login(self):
+        await self.assertQueries(2, "POST", "/api/auth/login",
+                                 data={"username": "deadpool@example.com", "password": PASSWORD})
+
+    async def test_refresh_token(self):
+        await self.assertQueries(2, "GET", "/api/auth/refresh_token",
+                                 headers={"Authorization": f"Bearer {self.refresh_token}"})
+
+    async def test_confirmed_email(self):
+        token = auth_service.create_email_token({"sub": "deadpool@example.com"})
+        await self.assertQueries(1, "GET", f"/api/auth/confirmed_email/{token}")
+
+    async def test_request_email(self):
+        await self.assertQueries(1, "POST", "/api/auth/request_email", json={"email": "deadpool@example.com"})
+
+
+if __name__ == '__main__':
+    unittest.main()
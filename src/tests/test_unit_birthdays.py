@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+from datetime import date
+from unittest.mock import AsyncMock
+
+import pytest
+
+from database.models import Contact, User
+from query_counter import QueryCounter
+from repository.contacts import birthday_window
+from services.birthdays import load_checkpoint, save_checkpoint, send_birthday_reminders
+
+TODAY = date(2026, 10, 19)
+
+
+class TestBirthdayWindow(unittest.TestCase):
+
+    def test_wraps_year(self):
+        self.assertEqual(list(birthday_window(date(2026, 12, 30), 3)), [1230, 1231, 101, 102])
+
+    def test_leap_day_in_common_year(self):
+        window = birthday_window(date(2027, 2, 27), 2)
+        self.assertEqual(list(window), [227, 228, 229, 301])
+        self.assertEqual(window[229], date(2027, 2, 28))
+
+    def test_leap_day_in_leap_year(self):
+        self.assertEqual(list(birthday_window(date(2028, 2, 28), 1)), [228, 229])
+
+
+@pytest.mark.usefixtures("database")
+class TestSendBirthdayReminders(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        birthdays = {1: [date(1990, 10, 21), date(1985, 1, 1)], 2: [], 3: [date(2000, 10, 19), date(1970, 10, 26)],
+                     4: [date(1999, 10, 20)], 5: [date(1999, 10, 27)]}
+        for n, dates in birthdays.items():
+            user = User(id=n, username=f"user{n}", email=f"user{n}@example.com", password="x", confirmed=n != 4)
+            self.db.add(user)
+            self.db.add_all(Contact(first_name="Wade", last_name=f"Wilson{i}", email=f"wade{i}.{n}@example.com",
+                                    birth_date=day, user_id=n) for i, day in enumerate(dates))
+        self.db.commit()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state_file = f"{self.tmp.name}/state.json"
+        self.send = AsyncMock(return_value=True)
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    async def run_job(self, chunk_size=2):
+        return await send_birthday_reminders(self.db, today=TODAY, days=7, chunk_size=chunk_size,
+                                             state_file=self.state_file, send=self.send)
+
+    async def test_one_digest_per_user_with_birthdays(self):
+        stats = await self.run_job()
+        self.assertEqual(stats, {"users": 4, "sent": 2, "failed": 0, "contacts": 3})
+        sent = {call.args[0]: call.args[2] for call in self.send.await_args_list}
+        self.assertEqual(set(sent), {"user1@example.com", "user3@example.com"})
+        self.assertEqual([b["name"] for b in sent["user3@example.com"]], ["Wade Wilson0", "Wade Wilson1"])
+        self.assertEqual(sent["user1@example.com"][0]["date"], "Wednesday, October 21")
+
+    async def test_one_query_per_chunk(self):
+        with QueryCounter(self.engine) as queries:
+            await self.run_job(chunk_size=2)
+        # Two full chunks of confirmed users and the empty one that ends the scan.
+        self.assertEqual(queries.count, 3, queries.report())
+
+    async def test_resumes_after_checkpoint(self):
+        save_checkpoint(self.state_file, TODAY, 1)
+        stats = await self.run_job()
+        self.assertEqual(stats["sent"], 1)
+        self.assertEqual(self.send.await_args.args[0], "user3@example.com")
+        self.assertEqual(load_checkpoint(self.state_file, TODAY), 5)
+
+    async def test_checkpoint_from_another_day_is_ignored(self):
+        save_checkpoint(self.state_file, date(2026, 10, 18), 5)
+        self.assertEqual((await self.run_job())["sent"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import asyncio
+import gc
+import json
+import socket
+import tracemalloc
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from starlette.websockets import WebSocketDisconnect
+
+from database.models import User
+from main import app
+from repository.auth import create_access_token
+from repository.contacts import create_contact, delete_contact, merge_contacts
+from routes.contacts import stream_changes
+from schemas import ContactCreate
+from services.changes import ChangeFeed, Subscriber, change_feed, record_change
+from services.suggest import PrefixIndex, suggest_indexes
+
+
+IDLE_STREAMS = 200
+
+
+def setUpModule():
+    # No Redis here; deliver in-process.
+    global _local_backend
+    _local_backend = patch.object(change_feed, "backend", "local")
+    _local_backend.start()
+
+
+def tearDownModule():
+    _local_backend.stop()
+
+
+def contact_body(**fields):
+    body = {"id": 0, "first_name": "Wade", "last_name": "Wilson", "email": "wade@example.com",
+            "phone_number": "+48500600700", "birth_date": date(1990, 1, 1)}
+    body.update(fields)
+    return ContactCreate(**body)
+
+
+class TestSubscriber(unittest.IsolatedAsyncioTestCase):
+
+    async def test_times_out_with_no_events(self):
+        self.assertEqual(await Subscriber(1, 10).next(0.01), [])
+
+    async def test_wakes_on_push(self):
+        subscriber = Subscriber(1, 10)
+        waiting = asyncio.create_task(subscriber.next(5))
+        await asyncio.sleep(0)
+        subscriber.push("a")
+        subscriber.push("b")
+        self.assertEqual(await waiting, ["a", "b"])
+
+    async def test_overflow_asks_for_resync(self):
+        subscriber = Subscriber(1, 3)
+        for i in range(5):
+            subscriber.push(str(i))
+        self.assertEqual(await subscriber.next(1), ['{"type": "resync"}'])
+        subscriber.push("5")
+        self.assertEqual(await subscriber.next(1), ["5"])
+
+    async def test_lost_events_ask_for_resync(self):
+        subscriber = Subscriber(1, 10)
+        waiting = asyncio.create_task(subscriber.next(5))
+        await asyncio.sleep(0)
+        subscriber.lost()
+        self.assertEqual(await waiting, ['{"type": "resync"}'])
+
+    async def test_changes_drop_suggestion_indexes(self):
+        feed = ChangeFeed("local", "contact_changes", 100)
+        suggest_indexes.put(1, PrefixIndex())
+        suggest_indexes.put(2, PrefixIndex())
+        feed.deliver('{"type": "contact.updated", "user_id": 1, "id": 7}')
+        self.assertIsNone(suggest_indexes.get(1))
+        self.assertIsNotNone(suggest_indexes.get(2))
+        feed.lost()
+        self.assertIsNone(suggest_indexes.get(2))
+
+class FakeListenConnection:
+    """A psycopg2 connection stand-in whose socket can be made readable or broken."""
+
+    def __init__(self, broken: bool):
+        self.socket, self.peer = socket.socketpair()
+        self.broken = broken
+        self.notifies = []
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def poll(self):
+        self.socket.recv(1024)
+        if self.broken:
+            raise OSError("server closed the connection unexpectedly")
+
+    def close(self):
+        self.socket.close()
+        self.peer.close()
+
+
+class TestPostgresListener(unittest.IsolatedAsyncioTestCase):
+
+    @patch("services.changes.RECONNECT_DELAY", 0)
+    async def test_reconnects_and_asks_for_resync(self):
+        feed = ChangeFeed("postgres", "contact_changes", 100)
+        connections = [FakeListenConnection(broken=True), FakeListenConnection(broken=False)]
+        opened = iter(connections)
+        with patch.object(feed, "_connect_postgres", lambda: next(opened)):
+            subscriber = feed.subscribe(1)
+            await feed.start()
+            await asyncio.sleep(0.05)
+            connections[0].peer.send(b"x")
+            self.assertEqual(await subscriber.next(1), ['{"type": "resync"}'])
+            connections[1].notifies.append(type("Notify", (), {"payload": '{"user_id": 1, "id": 7}'})())
+            connections[1].peer.send(b"x")
+            self.assertEqual(await subscriber.next(1), ['{"user_id": 1, "id": 7}'])
+            await feed.stop()
+        self.assertIsNone(feed._connection)
+
+
+@pytest.mark.usefixtures("database")
+class TestRecordChange(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.user = User(username="deadpool", email="deadpool@example.com", password="secret")
+        self.db.add(self.user)
+        self.db.commit()
+        self.subscriber = change_feed.subscribe(self.user.id)
+
+    async def asyncTearDown(self):
+        change_feed.unsubscribe(self.subscriber)
+
+    async def changes(self):
+        return [json.loads(payload) for payload in await self.subscriber.next(1)]
+
+    async def test_write_paths_publish_after_commit(self):
+        contact = await create_contact(self.db, contact_body(), self.user)
+        other = await create_contact(self.db, contact_body(email="wade2@example.com"), self.user)
+        self.assertEqual(await self.changes(), [
+            {"type": "contact.created", "user_id": self.user.id, "id": contact.id},
+            {"type": "contact.created", "user_id": self.user.id, "id": other.id}])
+        await merge_contacts(self.db, self.user, contact.id, [other.id])
+        self.assertEqual([(c["type"], c["id"]) for c in await self.changes()],
+                         [("contact.deleted", other.id), ("contact.updated", contact.id)])
+        await delete_contact(self.db, self.user, contact.id)
+        self.assertEqual(await self.changes(), [{"type": "contact.deleted", "user_id": self.user.id, "id": contact.id}])
+
+    async def test_rollback_drops_changes(self):
+        record_change(self.db, self.user.id, 7, "updated")
+        self.db.rollback()
+        self.db.commit()
+        self.assertEqual(await self.subscriber.next(0.01), [])
+
+    async def test_other_users_changes_are_not_delivered(self):
+        record_change(self.db, self.user.id + 1, 7, "updated")
+        self.db.commit()
+        self.assertEqual(await self.subscriber.next(0.01), [])
+
+
+@pytest.mark.usefixtures("database")
+class TestChangeStreams(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        with self.session_factory() as db:
+            db.add(User(username="deadpool", email="deadpool@example.com", password="secret", confirmed=True))
+            db.commit()
+        self.token = await create_access_token(data={"sub": "deadpool@example.com"})
+
+    async def test_server_sent_events(self):
+        db = self.session_factory()
+        request = Request({"type": "http", "method": "GET", "path": "/api/contacts/events", "headers": []})
+        response = await stream_changes(request, self.token, db)
+        self.assertEqual(response.media_type, "text/event-stream")
+        frames = response.body_iterator
+        self.assertEqual(await anext(frames), "retry: 5000\n\n")
+        with self.session_factory() as writer:
+            user = writer.query(User).one()
+            contact = await create_contact(writer, contact_body(), user)
+            expected = {"type": "contact.created", "user_id": user.id, "id": contact.id}
+        self.assertEqual(json.loads((await anext(frames)).removeprefix("data: ")), expected)
+        await frames.aclose()
+        self.assertEqual(change_feed.subscribers, {})
+
+    async def test_idle_streams_are_small(self):
+        # Through the whole app, middleware included: that is what an idle connection costs a worker.
+        disconnect = asyncio.Event()
+        started = asyncio.Semaphore(0)
+
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message["body"]:
+                started.release()
+
+        def stream():
+            scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                     "scheme": "http", "path": "/api/contacts/events", "raw_path": b"/api/contacts/events",
+                     "root_path": "", "query_string": f"access_token={self.token}".encode(),
+                     "headers": [(b"host", b"test"), (b"user-agent", b"test")], "client": ("127.0.0.1", 50000),
+                     "server": ("test", 80), "state": {}}
+            return asyncio.create_task(app(scope, receive, send))
+
+        # Debug mode, on by default in IsolatedAsyncioTestCase, keeps a traceback per task.
+        asyncio.get_running_loop().set_debug(False)
+        # The first stream pays for lazy imports and caches.
+        streams = [stream()]
+        await started.acquire()
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        streams += [stream() for _ in range(IDLE_STREAMS)]
+        for _ in range(IDLE_STREAMS):
+            await started.acquire()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        self.assertLess(used / IDLE_STREAMS, 40 * 1024)
+        disconnect.set()
+        await asyncio.wait_for(asyncio.gather(*streams), 5)
+        self.assertEqual(change_feed.subscribers, {})
+
+
+@pytest.mark.usefixtures("database")
+class TestChangeWebSocket(unittest.TestCase):
+
+    def setUp(self):
+        with self.session_factory() as db:
+            db.add(User(username="deadpool", email="deadpool@example.com", password="secret", confirmed=True))
+            db.commit()
+        self.token = asyncio.run(create_access_token(data={"sub": "deadpool@example.com"}))
+
+    def test_websocket(self):
+        client = TestClient(app)
+        with client.websocket_connect(f"/api/contacts/events/ws?access_token={self.token}") as websocket:
+            with self.session_factory() as writer:
+                asyncio.run(create_contact(writer, contact_body(), writer.query(User).one()))
+            self.assertEqual(json.loads(websocket.receive_text())["type"], "contact.created")
+        with self.assertRaises(WebSocketDisconnect):
+            with client.websocket_connect("/api/contacts/events/ws?access_token=bad") as websocket:
+                websocket.receive_text()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import gzip
+import json
+import unittest
+import zlib
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+
+from services.compression import CompressionMiddleware, CompressionStats, negotiate
+
+CONTACTS = [{"first_name": "Wade", "last_name": "Wilson", "email": f"wade{i}@example.com"} for i in range(200)]
+
+
+class TestNegotiate(unittest.TestCase):
+
+    @patch("services.compression.HAS_BROTLI", True)
+    def test_prefers_brotli_when_available(self):
+        self.assertEqual(negotiate("gzip, deflate, br"), "br")
+        self.assertEqual(negotiate("gzip, br;q=0"), "gzip")
+        self.assertEqual(negotiate("*"), "br")
+
+    @patch("services.compression.HAS_BROTLI", False)
+    def test_falls_back_to_gzip(self):
+        self.assertEqual(negotiate("br, gzip;q=0.5"), "gzip")
+        self.assertIsNone(negotiate("br"))
+        self.assertIsNone(negotiate("gzip;q=0, identity"))
+        self.assertIsNone(negotiate(""))
+
+
+class TestCompressionMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        app = FastAPI()
+        self.chunks = 0
+
+        @app.get("/contacts")
+        async def contacts():
+            return CONTACTS
+
+        @app.get("/small")
+        async def small():
+            return {"message": "Hello World"}
+
+        @app.get("/stream")
+        async def stream():
+            async def rows():
+                for contact in CONTACTS:
+                    self.chunks += 1
+                    yield json.dumps(contact).encode() + b"\n"
+            return StreamingResponse(rows(), media_type="application/x-ndjson; charset=utf-8")
+
+        @app.get("/export")
+        async def export():
+            async def rows():
+                for contact in CONTACTS:
+                    yield json.dumps(contact).encode() + b"\n"
+            return StreamingResponse(rows(), media_type="application/json")
+
+        @app.get("/cached")
+        async def cached():
+            return Response(gzip.compress(json.dumps(CONTACTS).encode()), media_type="application/json",
+                            headers={"Content-Encoding": "gzip"})
+
+        self.stats = CompressionStats()
+        app.add_middleware(CompressionMiddleware, minimum_size=1024, stats=self.stats)
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test",
+                                        headers={"Accept-Encoding": "gzip"})
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_compresses_large_json(self):
+        response = await self.client.get("/contacts")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertEqual(int(response.headers["content-length"]), response.num_bytes_downloaded)
+        self.assertEqual(response.json(), CONTACTS)
+        [entry] = self.stats.report()
+        self.assertEqual((entry["route"], entry["count"], entry["encodings"]), ("/contacts", 1, {"gzip": 1}))
+        self.assertEqual(entry["bytes_in"], len(response.content))
+        self.assertGreater(entry["ratio"], 5)
+        self.assertGreaterEqual(entry["cpu_ms"], 0)
+
+    async def test_small_responses_are_left_alone(self):
+        response = await self.client.get("/small")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.json(), {"message": "Hello World"})
+        self.assertEqual(self.stats.report(), [])
+
+    async def test_streams_chunk_by_chunk(self):
+        async with self.client.stream("GET", "/export") as response:
+            self.assertEqual(response.headers["content-encoding"], "gzip")
+            self.assertNotIn("content-length", response.headers)
+            body = b"".join([chunk async for chunk in response.aiter_bytes()])
+        self.assertEqual(len(body.splitlines()), len(CONTACTS))
+        self.assertGreater(self.stats.report()[0]["ratio"], 5)
+
+    async def test_each_chunk_is_decodable_on_arrival(self):
+        chunks = [json.dumps(CONTACTS[i::5]).encode() for i in range(5)]
+        sent, decoded = [], []
+        decoder = zlib.decompressobj(31)
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"application/json")]})
+            for i, chunk in enumerate(chunks):
+                await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+                # What the client can decode right after this chunk, before the response ends.
+                decoded.append(decoder.decompress(b"".join(m.get("body", b"") for m in sent[1:])))
+                sent[1:] = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+        await CompressionMiddleware(app, minimum_size=1024, stats=self.stats)(scope, None, send)
+        self.assertEqual(decoded, chunks)
+
+    async def test_skips_other_types_and_clients_without_gzip(self):
+        response = await self.client.get("/stream")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(self.chunks, len(CONTACTS))
+        response = await self.client.get("/contacts", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", response.headers)
+
+    async def test_precompressed_responses_pass_through(self):
+        response = await self.client.get("/cached")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.json(), CONTACTS)
+        self.assertEqual(self.stats.report(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
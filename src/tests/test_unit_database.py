@@ -0,0 +1,41 @@
+import unittest
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from conf.config import settings
+from database.models import User, init_schema
+
+
+class TestInitSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.fast_start = settings.fast_start
+
+    def tearDown(self):
+        settings.fast_start = self.fast_start
+        self.engine.dispose()
+
+    def test_creates_tables(self):
+        settings.fast_start = False
+        init_schema(self.engine)
+        self.assertIn("contacts", inspect(self.engine).get_table_names())
+
+    def test_fast_start_requires_migrated_database(self):
+        settings.fast_start = True
+        with self.assertRaises(RuntimeError):
+            init_schema(self.engine)
+        self.assertNotIn("contacts", inspect(self.engine).get_table_names())
+
+
+@pytest.mark.parametrize("run", [1, 2])
+def test_session_changes_are_rolled_back(session, run):
+    assert session.query(User).count() == 0
+    session.add(User(username="deadpool", email="deadpool@example.com", password="secret"))
+    session.commit()
+    assert session.query(User).count() == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
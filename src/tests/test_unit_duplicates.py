@@ -0,0 +1,93 @@
+import unittest
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from database.models import Contact, User
+from repository.contacts import merge_contacts
+from services.duplicates import find_duplicates, normalize_email, normalize_phone, phonetic_key, soundex
+
+
+def row(id, first_name, last_name, email=None, phone_number=None, birth_date=None):
+    return SimpleNamespace(id=id, first_name=first_name, last_name=last_name, email=email,
+                           phone_number=phone_number, birth_date=birth_date)
+
+
+class TestNormalization(unittest.TestCase):
+
+    def test_email(self):
+        self.assertEqual(normalize_email("  Wade@Example.COM "), "wade@example.com")
+        self.assertIsNone(normalize_email(""))
+
+    def test_phone(self):
+        self.assertEqual(normalize_phone("+48 500-600-700"), "+48500600700")
+        self.assertEqual(normalize_phone("0048 500 600 700"), "+48500600700")
+        self.assertEqual(normalize_phone("(050) 123 45 67", country_code="380"), "+380501234567")
+        self.assertIsNone(normalize_phone("050 123 45 67", country_code=""))
+        self.assertIsNone(normalize_phone("+12"))
+
+    def test_soundex(self):
+        for name, code in {"Robert": "R163", "Rupert": "R163", "Ashcraft": "A261", "Tymczak": "T522", "Lee": "L000"}.items():
+            self.assertEqual(soundex(name), code)
+
+    def test_phonetic_key_falls_back_to_spelling(self):
+        self.assertEqual(phonetic_key("Тарас", "Шевченко"), "тарас шевченко")
+
+
+class TestFindDuplicates(unittest.TestCase):
+
+    def test_groups_by_email_phone_and_name(self):
+        rows = [
+            row(1, "Wade", "Wilson", "wade@example.com"),
+            row(2, "W.", "Wilson", "WADE@example.com "),
+            row(3, "Peter", "Parker", phone_number="+48 500 600 700"),
+            row(4, "Pete", "Parker", phone_number="0048500600700"),
+            row(5, "Natasha", "Romanoff", birth_date=date(1984, 11, 22)),
+            row(6, "Natasha", "Romanof", birth_date=date(1984, 11, 22)),
+            row(7, "Natasha", "Romanoff"),
+            row(8, "Bruce", "Banner", phone_number="+48500600700"),
+        ]
+        groups = find_duplicates(rows)
+        self.assertEqual([group.contact_ids for group in groups], [[1, 2], [3, 4], [5, 6]])
+        self.assertTrue(all(0.6 <= group.score <= 1.0 for group in groups))
+
+    def test_links_are_transitive(self):
+        rows = [row(1, "Wade", "Wilson", "wade@example.com"),
+                row(2, "Wade", "Wilson", "wade@example.com", "+48500600700"),
+                row(3, "Wade", "Wilson", phone_number="+48 500 600 700")]
+        self.assertEqual([group.contact_ids for group in find_duplicates(rows)], [[1, 2, 3]])
+
+    def test_large_address_book(self):
+        rows = [row(i, f"First{i % 5000}", f"Last{i}", f"user{i % 90000}@example.com", f"+48{500000000 + i}")
+                for i in range(100000)]
+        groups = find_duplicates(rows)
+        self.assertEqual(len(groups), 10000)
+        self.assertEqual(groups[0].contact_ids, [0, 90000])
+
+
+@pytest.mark.usefixtures("database")
+class TestMergeContacts(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.user = User(username="deadpool", email="deadpool@example.com", password="secret")
+        self.db.add(self.user)
+        self.db.add_all([Contact(id=1, first_name="Wade", last_name="Wilson", phone_number="", user=self.user),
+                         Contact(id=2, first_name="W.", last_name="Wilson", email="wade@example.com",
+                                 phone_number="+48500600700", user=self.user),
+                         Contact(id=3, first_name="Wade", last_name="W", birth_date=date(1991, 2, 1), user=self.user)])
+        self.db.commit()
+
+    async def test_fills_missing_fields_and_deletes_duplicates(self):
+        merged = await merge_contacts(self.db, self.user, 1, [2, 3])
+        self.assertEqual((merged.first_name, merged.email, merged.phone_number, merged.birth_mmdd),
+                         ("Wade", "wade@example.com", "+48500600700", 201))
+        self.assertEqual([contact.id for contact in self.db.query(Contact)], [1])
+
+    async def test_unknown_contact_changes_nothing(self):
+        self.assertIsNone(await merge_contacts(self.db, self.user, 1, [2, 99]))
+        self.assertEqual(self.db.query(Contact).count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
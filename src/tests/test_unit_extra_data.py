@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+from starlette.requests import Request
+
+from database.models import Contact, User
+from repository.contacts import extra_data_contains, list_contacts
+from routes.contacts import extra_filters
+
+
+def request(query_string):
+    return Request({"type": "http", "query_string": query_string.encode(), "headers": []})
+
+
+class TestExtraFilters(unittest.TestCase):
+
+    def test_builds_nested_document(self):
+        document = extra_filters(request("limit=5&extra.company=Acme&extra.address.city=Kyiv&extra.address.zip=01001"))
+        self.assertEqual(document, {"company": "Acme", "address": {"city": "Kyiv", "zip": "01001"}})
+
+    def test_rejects_unsafe_or_conflicting_keys(self):
+        for query in ('extra.a"b=1', "extra.=1", "extra.a=1&extra.a.b=2", "extra.a.b=2&extra.a=1"):
+            with self.assertRaises(HTTPException, msg=query):
+                extra_filters(request(query))
+
+    def test_postgres_uses_containment(self):
+        db = MagicMock()
+        db.get_bind.return_value.dialect.name = "postgresql"
+        sql = str(extra_data_contains(db, {"company": "Acme"}).compile(dialect=postgresql.dialect()))
+        self.assertEqual(sql, "contacts.extra_data @> %(param_1)s::JSONB")
+
+
+@pytest.mark.usefixtures("database")
+class TestListContactsByExtraData(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.user = User(username="deadpool", email="deadpool@example.com", password="secret")
+        self.db.add(self.user)
+        self.db.flush()
+        documents = [{"company": "Acme", "address": {"city": "Kyiv"}}, {"company": "Acme", "address": {"city": "Lviv"}},
+                     {"company": "Initech"}, None]
+        self.db.add_all(Contact(first_name=f"Wade{i}", last_name="Wilson", email=f"wade{i}@example.com",
+                                additional_info=document, user_id=self.user.id) for i, document in enumerate(documents))
+        self.db.commit()
+
+    async def names(self, extra):
+        return [contact.first_name for contact in await list_contacts(self.db, self.user, extra=extra)]
+
+    async def test_filters_on_json_fields(self):
+        self.assertEqual(await self.names({"company": "Acme"}), ["Wade0", "Wade1"])
+        self.assertEqual(await self.names({"company": "Acme", "address": {"city": "Lviv"}}), ["Wade1"])
+        self.assertEqual(await self.names({"address": {"city": "Odesa"}}), [])
+
+    async def test_additional_info_is_stored_as_extra_data(self):
+        contact = self.db.query(Contact).filter(Contact.first_name == "Wade2").one()
+        self.assertEqual(contact.extra_data, {"company": "Initech"})
+
+
+if __name__ == '__main__':
+    unittest.main()
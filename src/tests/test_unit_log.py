@@ -0,0 +1,74 @@
+import json
+import logging
+import queue
+import unittest
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+
+from conf.config import settings
+from services.log import (DeferredQueueHandler, JsonFormatter, RequestIdFilter, RequestLogMiddleware, access_logger,
+                          request_id)
+
+
+class TestJsonFormatter(unittest.TestCase):
+
+    def test_formats_extras_and_request_id(self):
+        record = logging.LogRecord("access", logging.INFO, __file__, 1, "%s %s", ("GET", "/"), None)
+        record.request_id = "abc"
+        record.duration_ms = 1.5
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "GET /")
+        self.assertEqual(entry["request_id"], "abc")
+        self.assertEqual(entry["duration_ms"], 1.5)
+        self.assertEqual(entry["level"], "INFO")
+
+    def test_queue_handler_defers_formatting(self):
+        records = queue.SimpleQueue()
+        handler = DeferredQueueHandler(records)
+        handler.addFilter(RequestIdFilter())
+        logger = logging.getLogger("tests.deferred")
+        logger.addHandler(handler)
+        token = request_id.set("req-1")
+        try:
+            logger.warning("contact %s", 7)
+        finally:
+            request_id.reset(token)
+            logger.removeHandler(handler)
+        record = records.get_nowait()
+        self.assertEqual((record.msg, record.args, record.request_id), ("contact %s", (7,), "req-1"))
+
+
+class TestRequestLogMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        app = FastAPI()
+
+        @app.get("/ping")
+        async def ping():
+            return {"request_id": request_id.get()}
+
+        app.add_middleware(RequestLogMiddleware)
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_request_id_is_propagated(self):
+        with self.assertLogs(access_logger, "INFO") as logs:
+            response = await self.client.get("/ping", headers={"X-Request-ID": "given"})
+        self.assertEqual(response.headers["x-request-id"], "given")
+        self.assertEqual(response.json(), {"request_id": "given"})
+        self.assertEqual(logs.records[0].status, 200)
+        self.assertEqual(logs.records[0].route, "/ping")
+
+    async def test_access_log_is_sampled(self):
+        with patch.object(settings, "access_log_sample_rate", 0.0), \
+                self.assertNoLogs(access_logger, "INFO"):
+            response = await self.client.get("/ping")
+        self.assertEqual(len(response.headers["x-request-id"]), 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+
+from conf.config import settings
+from services import profiling
+
+
+class TestProfileRequest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = patch.multiple(settings, profiling_token="s3cret", profiling_sample_rate=0.0,
+                                 profiling_dir=self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        app = FastAPI()
+
+        @app.get("/api/contacts/")
+        async def contacts():
+            return [{"id": n} for n in range(100)]
+
+        app.middleware("http")(profiling.profile_request)
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        self.directory.cleanup()
+
+    async def test_admin_header_writes_profile(self):
+        response = await self.client.get("/api/contacts/", headers={"X-Profile": "s3cret"})
+        self.assertEqual(response.status_code, 200)
+        name = response.headers[profiling.PROFILE_FILE_HEADER]
+        self.assertTrue((Path(self.directory.name) / name).is_file())
+        self.assertIn("GET-api_contacts", name)
+
+    async def test_wrong_token_is_not_profiled(self):
+        response = await self.client.get("/api/contacts/", headers={"X-Profile": "guess"})
+        self.assertNotIn(profiling.PROFILE_FILE_HEADER, response.headers)
+        self.assertEqual(list(Path(self.directory.name).iterdir()), [])
+
+    async def test_sampling(self):
+        with patch.object(settings, "profiling_sample_rate", 1.0):
+            response = await self.client.get("/api/contacts/")
+        self.assertIn(profiling.PROFILE_FILE_HEADER, response.headers)
+
+    def test_disabled_by_default(self):
+        with patch.multiple(settings, profiling_token="", profiling_sample_rate=0.0):
+            self.assertFalse(profiling.profiling_enabled())
+
+
+if __name__ == '__main__':
+    unittest.main()
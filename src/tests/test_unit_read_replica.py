@@ -0,0 +1,101 @@
+import time
+import unittest
+from itertools import cycle
+from unittest.mock import MagicMock, patch
+
+import httpx
+from fastapi import FastAPI
+from starlette.requests import Request
+
+from database import db
+
+
+class TestReadReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.replica_session = MagicMock()
+        patcher = patch.multiple(db, replica_engines=[MagicMock()], ReplicaSessions=cycle([lambda: self.replica_session]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.primary_session = MagicMock()
+
+    def _request(self, header=None, cookie=None):
+        headers = []
+        if header:
+            headers.append((b"last-write", header.encode()))
+        if cookie:
+            headers.append((b"cookie", f"last-write={cookie}".encode()))
+        return Request({"type": "http", "headers": headers})
+
+    def _read_session(self, request):
+        dependency = db.get_read_db(request, self.primary_session)
+        return next(dependency)
+
+    def test_reads_go_to_replica(self):
+        self.assertIs(self._read_session(self._request()), self.replica_session)
+
+    def test_recent_writer_reads_from_primary(self):
+        marker = db.write_marker(time.time())
+        self.assertIs(self._read_session(self._request(header=marker)), self.primary_session)
+        # The cookie comes back on any connection to any worker.
+        self.assertIs(self._read_session(self._request(cookie=marker)), self.primary_session)
+
+    def test_forged_marker_is_ignored(self):
+        stamp = db.write_marker(time.time()).rpartition(".")[0]
+        self.assertIs(self._read_session(self._request(header=f"{stamp}.{'0' * 32}")), self.replica_session)
+        self.assertIs(self._read_session(self._request(header="garbage")), self.replica_session)
+
+    def test_writer_returns_to_replica_after_lag_window(self):
+        marker = db.write_marker(time.time() - db.settings.replica_lag_window - 1)
+        self.assertIs(self._read_session(self._request(header=marker)), self.replica_session)
+
+    def test_no_replicas_uses_primary(self):
+        with patch.object(db, "replica_engines", []):
+            self.assertIs(self._read_session(self._request()), self.primary_session)
+
+    def test_commit_records_write_time(self):
+        request = self._request()
+        session = db.SessionLocal()
+        session.info["request_state"] = request.state
+        db._remember_writer(session)
+        session.close()
+        self.assertAlmostEqual(request.state.last_write, time.time(), delta=5)
+
+
+
+class TestLastWriteMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        app = FastAPI()
+
+        @app.post("/write")
+        async def write(request: Request):
+            request.state.last_write = time.time()
+            return {}
+
+        @app.get("/read")
+        async def read():
+            return {}
+
+        transport = httpx.ASGITransport(app=db.LastWriteMiddleware(app))
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_marks_responses_to_writes(self):
+        response = await self.client.post("/write")
+        marker = response.headers[db.LAST_WRITE]
+        self.assertAlmostEqual(db.last_write(Request({"type": "http", "headers": [(b"last-write", marker.encode())]})),
+                               time.time(), delta=5)
+        self.assertEqual(response.cookies[db.LAST_WRITE], marker)
+        self.assertIn("HttpOnly", response.headers["set-cookie"])
+
+    async def test_leaves_reads_alone(self):
+        response = await self.client.get("/read")
+        self.assertNotIn(db.LAST_WRITE, response.headers)
+        self.assertNotIn("set-cookie", response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from database.models import Contact, User
+from database.trigram import trigrams, word_similarity
+from repository.contacts import search_contacts
+
+
+class TestTrigrams(unittest.TestCase):
+
+    def test_pads_words_like_pg_trgm(self):
+        self.assertEqual(trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams("a.b"), {"  a", " a ", "  b", " b "})
+
+    def test_word_similarity(self):
+        self.assertEqual(word_similarity("smith", "john smith"), 1.0)
+        self.assertGreater(word_similarity("jonh smiht", "john smith"), 0.3)
+        self.assertEqual(word_similarity("zzz", "john smith"), 0.0)
+        self.assertEqual(word_similarity("john", None), 0.0)
+
+
+@pytest.mark.usefixtures("database")
+class TestSearchContacts(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.user = User(username="deadpool", email="deadpool@example.com", password="secret")
+        other = User(username="colossus", email="colossus@example.com", password="secret")
+        self.db.add_all([self.user, other])
+        self.db.flush()
+        people = [("John", "Smith", "john.smith@example.com"), ("Jane", "Doe", "jane@example.com"),
+                  ("Smitty", "Werben", "smitty@example.com"), ("Wade", "Wilson", "50%@example.com")]
+        self.db.add_all(Contact(first_name=first, last_name=last, email=email, user_id=self.user.id)
+                        for first, last, email in people)
+        self.db.add(Contact(first_name="John", last_name="Smith", email="js@example.com", user_id=other.id))
+        self.db.commit()
+
+    async def names(self, query, limit=10):
+        return [(c.first_name, c.last_name) for c in await search_contacts(self.db, self.user, query, limit)]
+
+    async def test_tolerates_typos(self):
+        self.assertEqual(await self.names("Jonh Smiht"), [("John", "Smith")])
+
+    async def test_prefix_matches_rank_first(self):
+        self.assertEqual(await self.names("smit"), [("Smitty", "Werben"), ("John", "Smith")])
+        self.assertEqual(await self.names("smit", limit=1), [("Smitty", "Werben")])
+
+    async def test_like_wildcards_are_literal(self):
+        self.assertEqual(await self.names("50%"), [("Wade", "Wilson")])
+        self.assertEqual(await self.names("%"), [])
+
+    async def test_postgres_orders_candidates_by_trigram_distance(self):
+        db = MagicMock()
+        db.get_bind.return_value.dialect.name = "postgresql"
+        await search_contacts(db, self.user, "jonh", 5)
+        candidates = db.query.return_value.join.call_args.args[0]
+        sql = str(candidates.compile(dialect=postgresql.dialect()))
+        self.assertIn("<<-> contacts.search_text", sql)
+        self.assertIn("WHERE contacts.user_id =", sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import asyncio
+import tempfile
+import threading
+import unittest
+from datetime import date, timedelta
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from database.models import Contact, ContactTombstone, User
+from database.shards import HashRing, ShardRouter, ShardSession, UserMoved, move_user, pin_users, route_session
+from repository.contacts import (create_contact, delete_contact, get_changes, get_contacts_upcoming_birthdays,
+                                 get_contacts_version, list_contacts, update_contact)
+from repository.users import create_user
+from schemas import ContactCreate, UserModel
+from services.birthdays import send_birthday_reminders
+
+
+def contact_body(**fields):
+    body = {"id": 0, "first_name": "Wade", "last_name": "Wilson", "email": "wade@example.com",
+            "phone_number": "+48500600700", "birth_date": date(1990, 1, 1)}
+    body.update(fields)
+    return ContactCreate(**body)
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_spreads_users_evenly(self):
+        ring = HashRing(4)
+        counts = [0] * 4
+        for user_id in range(10000):
+            counts[ring.node(user_id)] += 1
+        self.assertTrue(all(1500 < count < 3500 for count in counts), counts)
+
+    def test_adding_a_shard_remaps_few_users(self):
+        before, after = HashRing(3), HashRing(4)
+        moved = sum(before.node(user_id) != after.node(user_id) for user_id in range(10000))
+        # Ideally 1/4; a modulo mapping would move 3/4.
+        self.assertLess(moved, 3500)
+        self.assertTrue(all(after.node(user_id) == 3 for user_id in range(10000)
+                            if before.node(user_id) != after.node(user_id)))
+
+
+class TestShards(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.router = ShardRouter.sqlite(self.tmp.name, 2)
+        self.sessions = sessionmaker(class_=ShardSession, router=self.router, bind=self.router.main, autoflush=False)
+
+    async def asyncTearDown(self):
+        self.router.dispose()
+        self.router.main.dispose()
+        self.tmp.cleanup()
+
+    async def signup(self, name: str) -> User:
+        with self.sessions() as db:
+            return await create_user(UserModel(username=name, email=f"{name}@example.com", password="secret"), db)
+
+    def session(self, user_id: int) -> tuple:
+        # What get_current_user does for a request.
+        db = self.sessions()
+        user = db.get(User, user_id)
+        route_session(db, user)
+        return db, user
+
+    def count(self, shard: int, model, user_id: int) -> int:
+        with Session(self.router.engines[shard]) as db:
+            return db.query(model).filter(model.user_id == user_id).count()
+
+    async def test_contacts_live_on_the_users_shard(self):
+        users = [await self.signup(f"user{i}") for i in range(12)]
+        for user in users:
+            db, user = self.session(user.id)
+            with db:
+                await create_contact(db, contact_body(), user)
+        for user in users:
+            home = self.router.ring.node(user.id)
+            self.assertEqual(user.shard, home)
+            self.assertEqual([self.count(shard, Contact, user.id) for shard in range(3)],
+                             [int(shard == home) for shard in range(3)])
+        self.assertEqual({user.shard for user in users}, {0, 1, 2})
+
+    async def test_contact_ids_are_unique_across_shards(self):
+        ids = []
+        for i in range(12):
+            db, user = self.session((await self.signup(f"user{i}")).id)
+            with db:
+                ids.append((await create_contact(db, contact_body(), user)).id)
+        self.assertEqual(len(set(ids)), 12)
+
+    async def test_move_user_online(self):
+        user = await self.signup("deadpool")
+        source = user.shard
+        target = (source + 1) % 3
+        db, user = self.session(user.id)
+        contacts = [await create_contact(db, contact_body(email=f"wade{i}@example.com"), user) for i in range(5)]
+        await delete_contact(db, user, contacts[0].id)
+        since = await get_contacts_version(db, user)
+        ids = sorted(contact.id for contact in contacts[1:])
+
+        stats = move_user(self.router, user.id, target, batch_size=2)
+        self.assertEqual(stats["copied"], 5)
+        self.assertEqual(stats["removed"], 5)
+        self.assertEqual(self.count(source, Contact, user.id), 0)
+        self.assertEqual(self.count(target, Contact, user.id), 4)
+        self.assertEqual(self.count(target, ContactTombstone, user.id), 1)
+
+        # A request routed before the move can no longer write to the old shard.
+        with self.assertRaises(UserMoved):
+            await create_contact(db, contact_body(email="late@example.com"), user)
+        db.close()
+
+        db, user = self.session(user.id)
+        with db:
+            self.assertEqual(user.shard, target)
+            self.assertEqual(sorted(c.id for c in await list_contacts(db, user, 0, 10)), ids)
+            self.assertEqual(await get_contacts_version(db, user), since)
+            self.assertEqual(await get_changes(db, user, since), ([], []))
+            await update_contact(db, user, ids[0], contact_body(id=ids[0], first_name="Deadpool",
+                                                                email="wade1@example.com"))
+            changed, deleted = await get_changes(db, user, since)
+            self.assertEqual([c.id for c in changed], [ids[0]])
+
+    async def test_move_copies_rows_sharing_a_version(self):
+        # What every contact looks like right after the delta sync migration.
+        db, user = self.session((await self.signup("deadpool")).id)
+        user_id, source = user.id, user.shard
+        with db:
+            for i in range(3):
+                await create_contact(db, contact_body(email=f"wade{i}@example.com"), user)
+        with Session(self.router.engines[source]) as db:
+            db.execute(update(Contact).where(Contact.user_id == user_id).values(version=0))
+            db.commit()
+        target = (source + 1) % 3
+        stats = move_user(self.router, user_id, target, batch_size=2)
+        self.assertLessEqual(stats["passes"], 2)
+        self.assertEqual(self.count(target, Contact, user_id), 3)
+
+    async def test_move_sees_a_delete_committed_during_the_copy(self):
+        db, user = self.session((await self.signup("deadpool")).id)
+        user_id, source = user.id, user.shard
+        target = (source + 1) % 3
+        with db:
+            ids = [(await create_contact(db, contact_body(email=f"wade{i}@example.com"), user)).id for i in range(4)]
+        scans = []
+
+        async def write_meanwhile():
+            db, user_now = self.session(user_id)
+            with db:
+                await delete_contact(db, user_now, ids[0])
+                # A later change, so its version is above the delete's.
+                await update_contact(db, user_now, ids[1], contact_body(id=ids[1], first_name="Deadpool",
+                                                                         email="wade1@example.com"))
+
+        def on_select(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("SELECT") and "FROM contacts" in statement:
+                scans.append(statement)
+                if len(scans) == 2:
+                    writer = threading.Thread(target=asyncio.run, args=(write_meanwhile(),))
+                    writer.start()
+                    writer.join()
+
+        event.listen(self.router.engines[source], "before_cursor_execute", on_select)
+        try:
+            move_user(self.router, user_id, target, batch_size=2)
+        finally:
+            event.remove(self.router.engines[source], "before_cursor_execute", on_select)
+        self.assertGreaterEqual(len(scans), 2)
+        with Session(self.router.engines[target]) as db:
+            contacts = {c.id: c for c in db.query(Contact).filter(Contact.user_id == user_id)}
+            self.assertEqual(sorted(contacts), ids[1:])
+            self.assertEqual(contacts[ids[1]].first_name, "Deadpool")
+            self.assertEqual([t.contact_id for t in db.query(ContactTombstone)
+                              .filter(ContactTombstone.user_id == user_id)], [ids[0]])
+
+    async def test_move_through_every_shard(self):
+        # Covers the main database as both the old and the new home.
+        db, user = self.session((await self.signup("deadpool")).id)
+        user_id, home = user.id, user.shard
+        with db:
+            ids = [(await create_contact(db, contact_body(), user)).id]
+        for step in range(1, 4):
+            target = (home + step) % 3
+            move_user(self.router, user_id, target)
+            db, user = self.session(user_id)
+            with db:
+                self.assertEqual(user.shard, target)
+                self.assertEqual(sorted(c.id for c in await list_contacts(db, user, 0, 10)), ids)
+                ids.append((await create_contact(db, contact_body(email=f"wade{step}@example.com"), user)).id)
+            self.assertEqual([self.count(shard, Contact, user_id) for shard in range(3)],
+                             [len(ids) if shard == target else 0 for shard in range(3)])
+
+    async def test_birthday_reads_cover_every_shard(self):
+        today = date.today()
+        for i in range(12):
+            db, user = self.session((await self.signup(f"user{i}")).id)
+            with db:
+                await create_contact(db, contact_body(email=f"wade{i}@example.com",
+                                                      birth_date=today + timedelta(days=1)), user)
+        with Session(self.router.main) as db:
+            db.query(User).update({User.confirmed: True})
+            db.commit()
+            shards = {user.shard for user in db.query(User)}
+        self.assertEqual(shards, {0, 1, 2})
+
+        with self.sessions() as db:
+            self.assertEqual(len(await get_contacts_upcoming_birthdays(db)), 12)
+            sent = []
+
+            async def send(email, username, birthdays):
+                sent.append(email)
+                return True
+
+            stats = await send_birthday_reminders(db, today=today, days=7, chunk_size=5,
+                                                  state_file=f"{self.tmp.name}/birthdays.json", send=send)
+        self.assertEqual((stats["users"], stats["sent"], stats["contacts"]), (12, 12, 12))
+        self.assertEqual(len(set(sent)), 12)
+
+    async def test_hash_mapping_and_pinning(self):
+        self.router.mapping = "hash"
+        user = await self.signup("deadpool")
+        self.assertIsNone(user.shard)
+        self.assertEqual(self.router.shard_of(user), self.router.ring.node(user.id))
+        self.assertEqual(pin_users(self.router), 1)
+        with Session(self.router.main) as db:
+            self.assertEqual(db.get(User, user.id).shard, self.router.ring.node(user.id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from database.slow_queries import SlowQueryLog, fingerprint, query_context, redact, set_query_user
+
+
+class TestSlowQueryLog(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.log = SlowQueryLog(threshold_ms=0)
+        self.log.install(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_aggregates_by_fingerprint(self):
+        with self.engine.connect() as conn:
+            for n in range(3):
+                conn.execute(text("SELECT :n"), {"n": n})
+            conn.execute(text("SELECT 1, 2"))
+        report = self.log.report()
+        counts = {entry["fingerprint"]: entry["count"] for entry in report}
+        self.assertEqual(counts["SELECT ?"], 3)
+        self.assertEqual(counts["SELECT 1, 2"], 1)
+        self.assertGreaterEqual(report[0]["total_ms"], report[-1]["total_ms"])
+
+    def test_threshold(self):
+        log = SlowQueryLog(threshold_ms=10_000)
+        log.install(self.engine)
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(log.report(), [])
+
+    def test_failed_statement_leaves_no_timer_behind(self):
+        with self.engine.connect() as conn:
+            with self.assertRaises(OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+            conn.execute(text("SELECT 1"))
+            self.assertEqual(dict(conn.info), {})
+        self.assertEqual([entry["fingerprint"] for entry in self.log.report()], ["SELECT 1"])
+
+    def test_log_carries_route_and_user_with_redacted_parameters(self):
+        token = query_context.set({"scope": {"path": "/api/contacts/7"}})
+        try:
+            set_query_user(42)
+            with self.assertLogs("database.slow_queries", "WARNING") as logs, self.engine.connect() as conn:
+                conn.execute(text("SELECT :email"), {"email": "wade@example.com"})
+        finally:
+            query_context.reset(token)
+        record = logs.records[0]
+        self.assertEqual(record.route, "/api/contacts/7")
+        self.assertEqual(record.user_id, 42)
+        self.assertEqual(record.parameters, ["<str>"])
+        self.assertNotIn("wade@example.com", str(record.__dict__))
+
+    def test_fingerprint_collapses_in_lists(self):
+        self.assertEqual(fingerprint("SELECT * FROM contacts\n WHERE id IN (?, ?, ?)"),
+                         fingerprint("SELECT * FROM contacts WHERE id IN (?)"))
+
+    def test_redact(self):
+        self.assertEqual(redact({"a": 1, "b": None, "c": ("x",)}), {"a": "<int>", "b": None, "c": ["<str>"]})
+
+
+if __name__ == '__main__':
+    unittest.main()
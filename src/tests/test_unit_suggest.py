@@ -0,0 +1,101 @@
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from services.suggest import PrefixIndex, SuggestIndexes
+
+
+def contact(id, first_name, last_name, email=None, user_id=1):
+    return SimpleNamespace(id=id, first_name=first_name, last_name=last_name, email=email, user_id=user_id)
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex([contact(1, "Wade", "Wilson", "deadpool@example.com"),
+                                  contact(2, "Peter", "Parker", "spidey@example.com"),
+                                  contact(3, "Wanda", "Maximoff", None)])
+
+    def ids(self, prefix, limit=10):
+        return [suggestion["id"] for suggestion in self.index.search(prefix, limit)]
+
+    def test_matches_names_full_name_and_email(self):
+        self.assertEqual(self.ids("wa"), [1, 3])
+        self.assertEqual(self.ids("Par"), [2])
+        self.assertEqual(self.ids("wade w"), [1])
+        self.assertEqual(self.ids("spidey@"), [2])
+        self.assertEqual(self.ids("x"), [])
+
+    def test_limit_counts_contacts_not_terms(self):
+        self.assertEqual(self.ids("w", limit=1), [1])
+
+    def test_add_and_remove(self):
+        self.index.add(contact(1, "Deadpool", "Wilson", "deadpool@example.com"))
+        self.assertEqual(self.ids("wade"), [])
+        self.assertEqual(self.ids("dead"), [1])
+        self.index.remove(2)
+        self.assertEqual(self.ids("p"), [])
+        self.assertEqual(len(self.index), 2)
+
+    def test_large_index_answers_quickly(self):
+        index = PrefixIndex(contact(i, f"First{i}", f"Last{i}", f"user{i}@example.com") for i in range(100000))
+        started = time.perf_counter()
+        for _ in range(100):
+            suggestions = index.search("first123", 10)
+        self.assertLess((time.perf_counter() - started) / 100, 0.005)
+        self.assertEqual(len(suggestions), 10)
+
+
+class TestSuggestIndexes(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        # Each contact has four terms: first name, last name, full name and email.
+        indexes = SuggestIndexes(max_entries=8, ttl=60)
+        for user_id in (1, 2):
+            indexes.put(user_id, PrefixIndex([contact(user_id, "Wade", "Wilson", "wade@example.com")]))
+        indexes.get(1)
+        indexes.put(3, PrefixIndex([contact(3, "Peter", "Parker", "peter@example.com")]))
+        self.assertIsNone(indexes.get(2))
+        self.assertIsNotNone(indexes.get(1))
+        self.assertEqual(indexes.size, 8)
+
+    def test_writes_count_against_the_bound(self):
+        indexes = SuggestIndexes(max_entries=8, ttl=60)
+        indexes.put(1, PrefixIndex([contact(1, "Wade", "Wilson", "wade@example.com")]))
+        indexes.put(2, PrefixIndex())
+        indexes.contact_saved(contact(7, "Peter", "Parker", "peter@example.com", user_id=2))
+        indexes.contact_saved(contact(8, "Logan", "Howlett", "logan@example.com", user_id=2))
+        self.assertIsNone(indexes.get(1))
+        self.assertEqual(indexes.size, 8)
+
+    def test_expires(self):
+        indexes = SuggestIndexes(max_entries=100, ttl=60)
+        indexes.put(1, PrefixIndex())
+        with patch("services.suggest.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(indexes.get(1))
+
+    def test_writes_reach_cached_index_only(self):
+        indexes = SuggestIndexes(max_entries=100, ttl=60)
+        indexes.put(1, PrefixIndex())
+        indexes.contact_saved(contact(7, "Wade", "Wilson", user_id=1))
+        indexes.contact_saved(contact(8, "Peter", "Parker", user_id=2))
+        self.assertEqual(len(indexes.get(1)), 1)
+        self.assertIsNone(indexes.get(2))
+        indexes.contact_deleted(1, 7)
+        self.assertEqual(len(indexes.get(1)), 0)
+
+    def test_change_feed_drops_indexes_other_workers_changed(self):
+        indexes = SuggestIndexes(max_entries=100, ttl=60)
+        indexes.put(1, PrefixIndex())
+        indexes.contact_saved(contact(7, "Wade", "Wilson", user_id=1))
+        # This worker's own write comes back through the feed and keeps the index.
+        indexes.contact_changed(1, 7)
+        self.assertIsNotNone(indexes.get(1))
+        indexes.contact_changed(1, 7)
+        self.assertIsNone(indexes.get(1))
+        self.assertEqual(indexes.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
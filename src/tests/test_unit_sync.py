@@ -0,0 +1,139 @@
+import time
+import unittest
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from database.models import ContactTombstone, User
+from repository.contacts import (create_contact, delete_contact, get_changes, merge_contacts, purge_tombstones,
+                                 update_contact)
+from schemas import ContactCreate
+from services import sync
+from services.sync import decode_token, encode_token, purge_expired_tombstones
+
+
+def contact_body(**fields):
+    body = {"id": 0, "first_name": "Wade", "last_name": "Wilson", "email": "wade@example.com",
+            "phone_number": "+48500600700", "birth_date": date(1990, 1, 1)}
+    body.update(fields)
+    return ContactCreate(**body)
+
+
+class TestSyncToken(unittest.TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(decode_token(encode_token(42)), 42)
+        self.assertIsNone(decode_token(None))
+        self.assertIsNone(decode_token(""))
+
+    def test_expired_token_means_full_sync(self):
+        self.assertIsNone(decode_token(encode_token(42, time.time() - 31 * 86400)))
+
+    def test_malformed_token(self):
+        for token in ("abc", "1", "1.x", "-1.5", encode_token(-1)):
+            with self.subTest(token=token), self.assertRaises(ValueError):
+                decode_token(token)
+
+    def test_token_must_be_signed(self):
+        version, issued, signature = encode_token(42, time.time() - 31 * 86400).split(".")
+        with self.assertRaises(ValueError):
+            decode_token(f"{version}.{int(time.time())}.{signature}")
+
+
+@pytest.mark.usefixtures("database")
+class TestGetChanges(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.user = User(username="deadpool", email="deadpool@example.com", password="secret")
+        self.db.add(self.user)
+        self.db.commit()
+
+    async def version(self):
+        self.db.refresh(self.user)
+        return self.user.contacts_version
+
+    async def test_full_then_delta(self):
+        first = await create_contact(self.db, contact_body(), self.user)
+        second = await create_contact(self.db, contact_body(email="wade2@example.com"), self.user)
+        changed, deleted = await get_changes(self.db, self.user, None)
+        self.assertEqual([c.id for c in changed], [first.id, second.id])
+        self.assertEqual(deleted, [])
+
+        since = await self.version()
+        self.assertEqual(await get_changes(self.db, self.user, since), ([], []))
+        await update_contact(self.db, self.user, second.id, contact_body(first_name="Deadpool",
+                                                                          email="wade2@example.com"))
+        await delete_contact(self.db, self.user, first.id)
+        changed, deleted = await get_changes(self.db, self.user, since)
+        self.assertEqual([c.id for c in changed], [second.id])
+        self.assertEqual(deleted, [first.id])
+        self.assertEqual(await get_changes(self.db, self.user, await self.version()), ([], []))
+
+    async def test_versions_increase_per_write(self):
+        contact = await create_contact(self.db, contact_body(), self.user)
+        created = contact.version
+        await update_contact(self.db, self.user, contact.id, contact_body(first_name="Deadpool"))
+        self.assertEqual(contact.version, created + 1)
+        self.assertEqual(await self.version(), contact.version)
+
+    async def test_update_keeps_the_contact_id(self):
+        contact_id = (await create_contact(self.db, contact_body(), self.user)).id
+        since = await self.version()
+        await update_contact(self.db, self.user, contact_id, contact_body(id=999, first_name="Deadpool"))
+        changed, deleted = await get_changes(self.db, self.user, since)
+        self.assertEqual([(c.id, c.first_name) for c in changed], [(contact_id, "Deadpool")])
+        self.assertEqual(deleted, [])
+
+    async def test_merge_leaves_tombstones(self):
+        primary = await create_contact(self.db, contact_body(), self.user)
+        duplicates = [(await create_contact(self.db, contact_body(email=f"wade{i}@example.com"), self.user)).id
+                      for i in range(2)]
+        since = await self.version()
+        await merge_contacts(self.db, self.user, primary.id, duplicates)
+        changed, deleted = await get_changes(self.db, self.user, since)
+        self.assertEqual([c.id for c in changed], [primary.id])
+        self.assertEqual(deleted, duplicates)
+
+    async def test_reused_id_is_not_reported_deleted(self):
+        contact = await create_contact(self.db, contact_body(), self.user)
+        since = await self.version()
+        await delete_contact(self.db, self.user, contact.id)
+        # SQLite hands the highest id out again once its row is gone.
+        again = await create_contact(self.db, contact_body(), self.user)
+        self.assertEqual(again.id, contact.id)
+        changed, deleted = await get_changes(self.db, self.user, since)
+        self.assertEqual([c.id for c in changed], [again.id])
+        self.assertEqual(deleted, [])
+
+    async def test_purge_tombstones(self):
+        contact = await create_contact(self.db, contact_body(), self.user)
+        await delete_contact(self.db, self.user, contact.id)
+        self.assertEqual(await purge_tombstones(self.db, datetime.utcnow() - timedelta(days=30)), 0)
+        self.assertEqual(await purge_tombstones(self.db, datetime.utcnow() + timedelta(seconds=1)), 1)
+        self.assertEqual(self.db.query(ContactTombstone).count(), 0)
+
+    async def test_purge_expired_tombstones(self):
+        contacts = [await create_contact(self.db, contact_body(email=f"wade{n}@example.com"), self.user)
+                    for n in range(2)]
+        for contact in contacts:
+            await delete_contact(self.db, self.user, contact.id)
+        self.db.query(ContactTombstone).filter(ContactTombstone.contact_id == contacts[0].id).update(
+            {"deleted_at": datetime.utcnow() - timedelta(days=31)})
+        self.db.commit()
+        self.assertEqual(await purge_expired_tombstones(self.db), 1)
+        self.assertEqual(self.db.query(ContactTombstone).count(), 1)
+
+    async def test_purge_command(self):
+        contact = await create_contact(self.db, contact_body(), self.user)
+        await delete_contact(self.db, self.user, contact.id)
+        self.db.query(ContactTombstone).update({"deleted_at": datetime.utcnow() - timedelta(days=31)})
+        self.db.commit()
+        with patch("database.db.SessionLocal", lambda: nullcontext(self.db)):
+            await sync.main(["purge"])
+        self.assertEqual(self.db.query(ContactTombstone).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()